@@ -4,6 +4,9 @@ from django.utils.translation import gettext_lazy as _
 from .models import *
 from django.utils.html import format_html
 from django.urls import reverse
+from django.db.models import Q
+from django.utils import timezone
+from .search import search_ids
 
 
 # =======================
@@ -511,6 +514,32 @@ class RechargeAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
 
 
+# =======================
+# RECHARGE REQUEST ADMIN
+# =======================
+
+from .services import approve_recharge_requests
+
+@admin.register(RechargeRequest)
+class RechargeRequestAdmin(admin.ModelAdmin):
+    list_display = ('transaction_id', 'user', 'amount', 'payment_method', 'status',
+                   'payment_status', 'requested_at', 'verified_by')
+    list_filter = ('status', 'payment_status', 'payment_method', 'requested_at')
+    search_fields = ('transaction_id', 'reference_number', 'user__username')
+    readonly_fields = ('transaction_id', 'requested_at', 'payment_made_at',
+                      'processed_at', 'verified_at', 'verified_by')
+    list_select_related = ('user', 'payment_method', 'verified_by')
+    actions = ['approve_selected']
+
+    def approve_selected(self, request, queryset):
+        approved = approve_recharge_requests(queryset, request.user)
+        skipped = queryset.count() - approved
+        self.message_user(request, f'✅ Approved {approved} recharge(s).', level=messages.SUCCESS)
+        if skipped > 0:
+            self.message_user(request, f'{skipped} recharge(s) skipped: not pending or not paid.', level=messages.WARNING)
+    approve_selected.short_description = "✅ Approve selected paid recharges"
+
+
 # =======================
 # TASK ADMIN
 # =======================
@@ -817,11 +846,23 @@ class MessageInline(admin.TabularInline):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('sender', 'content_preview', 'timestamp', 'has_replies')
-    list_filter = ('timestamp',)
+    list_display = ('sender', 'content_preview', 'room', 'timestamp', 'is_flagged', 'has_replies')
+    list_filter = ('is_flagged', 'room', 'timestamp')
     search_fields = ('sender', 'content')
     readonly_fields = ('timestamp', 'replies_count')
     inlines = [MessageInline]
+    # Full-text matches considered per search; staff refine the terms past this
+    search_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        # Content goes through the full-text index instead of an icontains
+        # scan over the whole chat history; senders still match exactly.
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        _, hits = search_ids(search_term, limit=self.search_limit)
+        matches = Q(pk__in=[pk for pk, _ in hits]) | Q(sender__iexact=search_term)
+        return queryset.filter(matches), False
     
     def content_preview(self, obj):
         return obj.content[:50] + "..." if len(obj.content) > 50 else obj.content
@@ -837,6 +878,71 @@ class MessageAdmin(admin.ModelAdmin):
     replies_count.short_description = 'Number of Replies'
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'finished_at', 'locked_by')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at', 'last_error')
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status='running').update(
+            status='queued', run_at=timezone.now(), attempts=0, locked_by='', locked_at=None,
+        )
+        self.message_user(request, f'{updated} jobs were queued to run now.')
+    retry_now.short_description = "Retry selected jobs now"
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'user_id', 'created_at')
+    list_filter = ('topic',)
+    search_fields = ('=user_id',)
+    readonly_fields = ('topic', 'user_id', 'payload', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LedgerPeriod)
+class LedgerPeriodAdmin(admin.ModelAdmin):
+    list_display = ('customer', 'period', 'type', 'total', 'count')
+    list_filter = ('type', 'period')
+    search_fields = ('customer__username', 'customer__phone')
+    raw_id_fields = ('customer',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LedgerExport)
+class LedgerExportAdmin(admin.ModelAdmin):
+    list_display = ('period', 'rows', 'size', 'path', 'created_at')
+    readonly_fields = ('period', 'path', 'rows', 'size', 'sha256', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(OutboxCursor)
+class OutboxCursorAdmin(admin.ModelAdmin):
+    list_display = ('name', 'position', 'updated_at')
+
+
+@admin.register(BannedTerm)
+class BannedTermAdmin(admin.ModelAdmin):
+    list_display = ('term', 'action', 'is_active', 'created_at')
+    list_filter = ('action', 'is_active')
+    list_editable = ('action', 'is_active')
+    search_fields = ('term',)
+
+
 # =======================
 # CUSTOMER MESSAGE ADMIN
 # =======================
@@ -924,6 +1030,7 @@ class GiftRedemptionAdmin(admin.ModelAdmin):
 # =======================
 
 from django.utils.html import format_html
+from .catalog import bump_version
 
 @admin.register(MainProject)
 class MainProjectAdmin(admin.ModelAdmin):
@@ -1085,16 +1192,20 @@ class MainProjectAdmin(admin.ModelAdmin):
 
     actions = ['mark_as_featured', 'mark_as_sold_out', 'activate_projects']
 
+    # queryset.update() skips post_save, so bump the catalog version here
     def mark_as_featured(self, request, queryset):
         queryset.update(is_featured=True)
+        bump_version(MainProject)
     mark_as_featured.short_description = "Mark selected projects as featured"
 
     def mark_as_sold_out(self, request, queryset):
         queryset.update(status='sold_out', available_units=0)
+        bump_version(MainProject)
     mark_as_sold_out.short_description = "Mark selected projects as sold out"
 
     def activate_projects(self, request, queryset):
         queryset.update(is_active=True, status='available')
+        bump_version(MainProject)
     activate_projects.short_description = "Activate selected projects"
 
 
@@ -1436,18 +1547,22 @@ class VideoAdmin(admin.ModelAdmin):
     
     def approve_videos(self, request, queryset):
         updated = queryset.update(status='approved', approved_by=request.user)
+        bump_version(Video)
         self.message_user(request, f'{updated} videos were approved.')
     
     def reject_videos(self, request, queryset):
         updated = queryset.update(status='rejected')
+        bump_version(Video)
         self.message_user(request, f'{updated} videos were rejected.')
     
     def feature_videos(self, request, queryset):
         updated = queryset.update(is_featured=True)
+        bump_version(Video)
         self.message_user(request, f'{updated} videos were marked as featured.')
     
     def unfeature_videos(self, request, queryset):
         updated = queryset.update(is_featured=False)
+        bump_version(Video)
         self.message_user(request, f'{updated} videos were unfeatured.')
     
     approve_videos.short_description = "Approve selected videos"
@@ -10,6 +10,7 @@ urlpatterns = [
 
     path('profile/', api_views.profile_api, name='api_profile'),
     path('balance/', api_views.balance_api, name='api_balance'),
+    path('dashboard/', api_views.dashboard_api, name='api_dashboard'),
 
     path('withdraw/', api_views.withdraw_api, name='api_withdraw'),
     path('withdraw-history/', api_views.withdraw_history_api, name='api_withdraw_history'),
@@ -38,6 +39,8 @@ urlpatterns = [
     path('main-projects/featured/', api_views.get_featured_projects, name='featured-projects'),
     path('main-projects/available/', api_views.get_main_projects, name='available-projects'),
     path('recharge/history/',api_views.recharge_history, name='recharge_history'),
+    path('transactions/archive/', api_views.transaction_archive, name='transaction-archive'),
+    path('notifications/', api_views.notifications_api, name='api_notifications'),
     path("payment-methods/", api_views.get_payment_methods, name="payment-methods"),
     path('user/investments/', api_views.get_user_investments, name='user-investments'),
     path('api/vips/<int:vip_id>/claim/', api_views.claim_vip_income_api, name='claim-vip-income'),
@@ -58,6 +61,7 @@ urlpatterns = [
 
 
     path('videos/', api_views.video_list, name='video-list'),
+    path('videos/categories/', api_views.video_categories, name='video-categories'),
     path('videos/<int:pk>/', api_views.video_detail, name='video-detail'),
 
     # ==========================
@@ -79,6 +83,21 @@ urlpatterns = [
     path('admin/videos/<int:pk>/reject/', api_views.reject_video, name='video-reject'),
     path('admin/videos/<int:pk>/feature/', api_views.feature_video, name='video-feature'),
     path('admin/videos/<int:pk>/unfeature/',api_views.unfeature_video, name='video-unfeature'),
+
+    # ==========================
+    # STAFF METRICS
+    # ==========================
+    path('admin/metrics/endpoints/', api_views.endpoint_metrics_api, name='endpoint-metrics'),
+
+    # ==========================
+    # STAFF MESSAGE SEARCH
+    # ==========================
+    path('admin/messages/search/', api_views.message_search_api, name='message-search'),
+
+    # ==========================
+    # STAFF MODERATION
+    # ==========================
+    path('admin/moderation/reload/', api_views.moderation_reload_api, name='moderation-reload'),
     
 
 ]
@@ -5,7 +5,9 @@ from rest_framework import status
 from django.contrib.auth import authenticate, get_user_model
 from django.utils import timezone
 from rest_framework.authtoken.models import Token
-from django.db.models import Sum
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from . import catalog, idempotency, jobs, ledger, moderation, outbox, portfolio, tasks
 from .models import (
     Profile, Transaction, OTP, VIP, UserVIP, Task, Message, Order, Recharge, CustomerMessage
 )
@@ -67,8 +69,7 @@ def signup_api(request):
         first_name = data.get('first_name')
         last_name = data.get('last_name')
         
-        # Debug print
-        print(f"Signup attempt: username={username}, email={email}, phone={phone}")
+        logger.info("Signup attempt", extra={"event": "auth.signup", "username": username})
         
         # Validate required fields
         if not username:
@@ -111,7 +112,7 @@ def signup_api(request):
         return JsonResponse({'error': 'Invalid JSON format'}, status=400)
     except Exception as e:
         # Make sure to return a response for all exceptions
-        print(f"Unexpected error in signup_api: {e}")
+        logger.exception("Unexpected error in signup_api")
         return JsonResponse({'error': f'Server error: {str(e)}'}, status=500)
 @csrf_exempt
 @require_POST
@@ -193,8 +194,11 @@ def profile_api(request):
     Includes account_number.
     """
     try:
-        # Get or create the profile
-        profile, created = Profile.objects.get_or_create(user=request.user)
+        # Profile, user and balance in a single query
+        try:
+            profile = Profile.objects.select_related('user', 'user__balance').get(user=request.user)
+        except Profile.DoesNotExist:
+            profile, created = Profile.objects.get_or_create(user=request.user)
 
         # Serialize
         serializer = ProfileSerializer(profile)
@@ -227,12 +231,8 @@ def balance_api(request):
         user = request.user
         transactions = Transaction.objects.filter(customer=user).order_by('-date')
 
-        # Calculate total deposits and withdrawals
-        total_deposit = transactions.filter(type='deposit').aggregate(total=Sum('amount'))['total'] or 0
-        total_withdraw = transactions.filter(type='withdraw').aggregate(total=Sum('amount'))['total'] or 0
-
-        # Calculate balances
-        balance = float(total_deposit - total_withdraw)
+        # Calculate balances (includes archived months, see cat/ledger.py)
+        balance = float(ledger.balance(user))
         frozen_balance = float(balance * 0.01)
         available_balance = float(balance - frozen_balance)
 
@@ -252,151 +252,74 @@ def balance_api(request):
             status=500
         )
 
-@api_view(['POST'])
+@api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def redeem_gift_code(request):
+def dashboard_api(request):
     """
-    Redeem a gift code and add balance to user's account.
+    Everything the home screen needs in one round trip: profile, balance,
+    investments, VIP packages, featured projects and gift code info.
+    Costs a fixed set of queries; the catalog sections come from cache.
     """
     try:
         user = request.user
-        code = request.data.get('gift_code', '').strip().upper()
-        
-        if not code:
-            return Response(
-                {"error": "Gift code is required."},
-                status=400
-            )
-        
-        # Validate gift code
-        gift_code = _validate_gift_code(code, user)
-        if isinstance(gift_code, Response):
-            return gift_code  # Return error response
-        
-        # Calculate redemption amount
-        redemption_amount = _calculate_redemption_amount(gift_code)
-        
-        # Process redemption
-        redemption, transaction = _process_redemption(gift_code, user, redemption_amount)
-        
-        # Update user balance
-        _update_user_balance(user, redemption_amount)
-        
-        logger.info(f"User {user.username} redeemed gift code {code} for {redemption_amount} Br")
-        
-        return Response({
-            "success": True,
-            "message": f"Successfully redeemed {redemption_amount:.2f} Br",
-            "amount": redemption_amount,
-            "balance": float(user.profile.balance) if hasattr(user, 'profile') else 0,
-            "transaction_id": transaction.id,
-            "redemption_id": redemption.id
-        })
-        
-    except Exception as e:
-        logger.exception(f"Error redeeming gift code for user {user.username}: {str(e)}")
-        return Response(
-            {"error": "Failed to redeem gift code. Please try again."},
-            status=500
-        )
 
-def _validate_gift_code(code, user):
-    """Validate gift code and return it or error response"""
-    try:
-        gift_code = GiftCode.objects.get(code=code)
-    except GiftCode.DoesNotExist:
-        return Response(
-            {"error": "Invalid gift code."},
-            status=400
-        )
-    
-    # Check if user already redeemed this code
-    if GiftRedemption.objects.filter(gift_code=gift_code, user=user).exists():
-        return Response(
-            {"error": "You have already redeemed this gift code."},
-            status=400
-        )
-    
-    # Check expiration
-    if gift_code.expires_at and gift_code.expires_at < timezone.now():
-        return Response(
-            {"error": "This gift code has expired."},
-            status=400
-        )
-    
-    # Check if active
-    if not gift_code.is_active:
-        return Response(
-            {"error": "This gift code is no longer active."},
-            status=400
-        )
-    
-    # Check remaining amount
-    remaining_amount = gift_code.remaining_amount()
-    if remaining_amount <= 0:
-        return Response(
-            {"error": "This gift code has no remaining balance."},
-            status=400
-        )
-    
-    # Check max redemptions
-    if gift_code.max_redemptions and gift_code.redemptions.count() >= gift_code.max_redemptions:
-        return Response(
-            {"error": "This gift code has reached its redemption limit."},
-            status=400
-        )
-    
-    return gift_code
+        try:
+            profile = Profile.objects.select_related('user', 'user__balance').get(user=user)
+        except Profile.DoesNotExist:
+            profile, created = Profile.objects.get_or_create(user=user)
+        profile_data = ProfileSerializer(profile).data
+        profile_data['account_number'] = profile.account_number
+
+        # Deposits and withdrawals, hot and archived, in a single query
+        balance = float(ledger.balance(user))
+        frozen_balance = float(balance * 0.01)
+        recent = Transaction.objects.filter(customer=user).order_by('-date')[:5]
+
+        gift = GiftCode.objects.annotate(
+            used_amount=Sum('redemptions__amount'),
+            already_redeemed=Exists(
+                GiftRedemption.objects.filter(code=OuterRef('pk'), user=user)
+            ),
+        ).order_by('pk').first()
+        gift_data = None
+        if gift:
+            gift_data = {
+                'code': gift.code,
+                'per_user_amount': str(gift.per_user_amount),
+                'remaining_amount': float(gift.total_amount - (gift.used_amount or 0)),
+                'already_redeemed': gift.already_redeemed,
+            }
 
-def _calculate_redemption_amount(gift_code):
-    """Calculate the amount to redeem"""
-    remaining_amount = gift_code.remaining_amount()
-    redemption_amount = float(gift_code.per_user_amount)
-    
-    # If per_user_amount exceeds remaining, use remaining
-    if redemption_amount > remaining_amount:
-        redemption_amount = remaining_amount
-    
-    return redemption_amount
-
-def _process_redemption(gift_code, user, amount):
-    """Process the redemption and create records"""
-    # Create redemption record
-    redemption = GiftRedemption.objects.create(
-        gift_code=gift_code,
-        user=user,
-        amount=amount,
-        redeemed_at=timezone.now()
-    )
-    
-    # Create transaction
-    transaction = Transaction.objects.create(
-        customer=user,
-        amount=amount,
-        type='deposit',
-        description=f'Gift code redemption: {gift_code.code}',
-        status='completed'
-    )
-    
-    return redemption, transaction
+        # One query for the catalog stamps the three cached sections check
+        with catalog.versions_read(VIP, MainProject):
+            return Response({
+                'profile': profile_data,
+                'balance': {
+                    'balance': balance,
+                    'available_balance': float(balance - frozen_balance),
+                    'frozen_balance': frozen_balance,
+                    'recent_transactions': TransactionSerializer(recent, many=True).data,
+                },
+                'investments': portfolio.payload(user),
+                'vip_packages': catalog.vip_packages(),
+                'featured_projects': catalog.featured_projects(),
+                'gift': gift_data,
+            })
 
-def _update_user_balance(user, amount):
-    """Update user's balance"""
-    try:
-        if hasattr(user, 'profile'):
-            user.profile.balance += amount
-            user.profile.save()
     except Exception as e:
-        logger.error(f"Error updating user balance: {str(e)}")
+        logger.exception("Error building dashboard for user %s", request.user.username)
+        return Response(
+            {"error": "Failed to load dashboard. Please contact support."},
+            status=500
+        )
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotency.idempotent
 def withdraw_api(request):
     amount = request.data.get('amount')
     user = request.user
-    transactions = Transaction.objects.filter(customer=user)
-    balance = transactions.filter(type='deposit').aggregate(total=Sum('amount'))['total'] or 0
-    balance -= transactions.filter(type='withdraw').aggregate(total=Sum('amount'))['total'] or 0
+    balance = ledger.balance(user)
 
     if not amount or float(amount) <= 0:
         return Response({'error': 'Invalid amount'}, status=status.HTTP_400_BAD_REQUEST)
@@ -426,10 +349,9 @@ from .serializers import VIPSerializer
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@catalog.cached_catalog_response(VIP)
 def vip_packages_api(request):
-    vips = VIP.objects.all().order_by('upgrade')
-    serializer = VIPSerializer(vips, many=True)
-    return Response(serializer.data)
+    return Response(catalog.vip_packages())
 
 
 
@@ -443,6 +365,7 @@ from .models import UserVIP, VIP, Transaction
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotency.idempotent
 def buy_vip_api(request):
     vip_id = request.data.get('vip_id')
     user = request.user
@@ -454,33 +377,32 @@ def buy_vip_api(request):
         return Response({'error': 'VIP not found'}, status=status.HTTP_404_NOT_FOUND)
 
     # Calculate user balance
-    transactions = Transaction.objects.filter(customer=user)
-    deposit_sum = transactions.filter(type='deposit').aggregate(total=Sum('amount'))['total'] or 0
-    withdraw_sum = transactions.filter(type='withdraw').aggregate(total=Sum('amount'))['total'] or 0
-    balance = deposit_sum - withdraw_sum
+    balance = ledger.balance(user)
 
     if balance < vip_package.price:
         return Response({'error': 'Insufficient balance'}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        # Create or update VIP first
-        user_vip, created = UserVIP.objects.get_or_create(
-            user=user,
-            defaults={
-                'vip': vip_package,
-                'invested': vip_package.price,
-                'last_claim_time': timezone.now(),
-            }
-        )
+        with transaction.atomic():
+            # Create or update VIP first
+            user_vip, created = UserVIP.objects.get_or_create(
+                user=user,
+                defaults={
+                    'vip': vip_package,
+                    'invested': vip_package.price,
+                    'last_claim_time': timezone.now(),
+                }
+            )
 
-        if not created:
-            user_vip.vip = vip_package
-            user_vip.invested = vip_package.price
-            user_vip.last_claim_time = timezone.now()
-            user_vip.save()
+            if not created:
+                user_vip.vip = vip_package
+                user_vip.invested = vip_package.price
+                user_vip.last_claim_time = timezone.now()
+                user_vip.save()
 
-        # Deduct balance
-        Transaction.objects.create(customer=user, type='withdraw', amount=vip_package.price)
+            # Deduct balance
+            Transaction.objects.create(customer=user, type='withdraw', amount=vip_package.price)
+            outbox.record('vip.purchased', user.pk, {'vip_id': vip_package.pk, 'amount': str(vip_package.price)})
 
     except Exception as e:
         return Response({'error': f'Purchase failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -544,12 +466,14 @@ def save_message_api(request):
         
         # Get sender from authenticated user
         sender = request.user.username
+        checked = moderation.moderate(content)
         
         # Create message
         msg = Message.objects.create(
             sender=sender, 
-            content=content, 
-            timestamp=timezone.now()
+            content=checked.text, 
+            timestamp=timezone.now(),
+            is_flagged=checked.flagged,
         )
         
         # Return the created message
@@ -634,7 +558,7 @@ def delete_message_api(request, message_id):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_orders_api(request):
-    orders = Order.objects.filter(user=request.user)
+    orders = Order.objects.filter(customer=request.user)
     serializer = OrderSerializer(orders, many=True)
     return Response(serializer.data)
 
@@ -670,12 +594,12 @@ import json
 def commissions_api(request):
     try:
         user = request.user
-        print(f"Fetching commissions for user: {user}")
+        logger.debug("Fetching commissions", extra={"event": "team.commissions", "user_id": user.pk})
         commissions = Commission.objects.filter(user=user)
         serializer = CommissionSerializer(commissions, many=True)
         return Response(serializer.data)
     except Exception as e:
-        print("Error in commissions_api:", e)
+        logger.exception("Error in commissions_api")
         return Response({'error': str(e)}, status=500)
 
 
@@ -779,23 +703,27 @@ def claim_vip_income(request):
         # Calculate daily income
         daily_income = user_vip.vip.daily_income
         
-        # Update user balance
-        profile = Profile.objects.get(user=request.user)
-        profile.balance += daily_income
-        profile.available_balance += daily_income
-        profile.save()
-        
-        # Update last claim time
-        user_vip.last_claim_time = timezone.now()
-        user_vip.save()
-        
-        # Record transaction
-        Transaction.objects.create(
-            customer=request.user,
-            type='profit',
-            amount=daily_income,
-            status='success',
-        )
+        with transaction.atomic():
+            # Update user balance
+            profile = Profile.objects.get(user=request.user)
+            profile.balance += daily_income
+            profile.available_balance += daily_income
+            profile.save()
+            
+            # Update last claim time
+            user_vip.last_claim_time = timezone.now()
+            user_vip.save()
+            
+            # Record transaction
+            Transaction.objects.create(
+                customer=request.user,
+                type='profit',
+                amount=daily_income,
+                status='success',
+            )
+            outbox.record('vip.claimed', request.user.pk, {
+                'vip_id': user_vip.vip_id, 'amount': str(daily_income),
+            })
         
         return Response({
             'success': True,
@@ -825,6 +753,7 @@ def claim_vip_income(request):
 # Function for URL WITH vip_id parameter (gets it from URL)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotency.idempotent
 def claim_vip_income_api(request, vip_id):
     """Claim income from a VIP investment - vip_id from URL"""
     
@@ -841,23 +770,27 @@ def claim_vip_income_api(request, vip_id):
         # Calculate daily income
         daily_income = user_vip.vip.daily_income
         
-        # Update user balance
-        profile = Profile.objects.get(user=request.user)
-        profile.balance += daily_income
-        profile.available_balance += daily_income
-        profile.save()
-        
-        # Update last claim time
-        user_vip.last_claim_time = timezone.now()
-        user_vip.save()
-        
-        # Record transaction
-        Transaction.objects.create(
-            customer=request.user,
-            type='profit',
-            amount=daily_income,
-            status='success',
-        )
+        with transaction.atomic():
+            # Update user balance
+            profile = Profile.objects.get(user=request.user)
+            profile.balance += daily_income
+            profile.available_balance += daily_income
+            profile.save()
+            
+            # Update last claim time
+            user_vip.last_claim_time = timezone.now()
+            user_vip.save()
+            
+            # Record transaction
+            Transaction.objects.create(
+                customer=request.user,
+                type='profit',
+                amount=daily_income,
+                status='success',
+            )
+            outbox.record('vip.claimed', request.user.pk, {
+                'vip_id': user_vip.vip_id, 'amount': str(daily_income),
+            })
         
         return Response({
             'success': True,
@@ -927,6 +860,7 @@ from .models import GiftCode, GiftRedemption, Profile
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotency.idempotent
 def redeem_gift_code(request):
     """
     Redeem the single gift code for a user.
@@ -940,26 +874,34 @@ def redeem_gift_code(request):
     except GiftCode.DoesNotExist:
         return Response({"success": False, "message": "Invalid code."}, status=404)
 
-    # Check if user has already redeemed
-    if GiftRedemption.objects.filter(code=gift, user=request.user).exists():
-        return Response({"success": False, "message": "You have already redeemed this code."}, status=400)
+    with transaction.atomic():
+        # The code's row serialises checks against the shared pool, the
+        # profile's row the user's own redemptions; both are read under lock.
+        gift = GiftCode.objects.select_for_update().get(pk=gift.pk)
+        profile = Profile.objects.select_for_update().get(user=request.user)
 
-    # Check if total pool has enough left
-    if gift.remaining_amount() < gift.per_user_amount:
-        return Response({"success": False, "message": "Gift pool exhausted."}, status=400)
+        # Check if user has already redeemed
+        if GiftRedemption.objects.filter(code=gift, user=request.user).exists():
+            return Response({"success": False, "message": "You have already redeemed this code."}, status=400)
 
-    # Redeem
-    GiftRedemption.objects.create(
-        code=gift,
-        user=request.user,
-        amount=gift.per_user_amount
-    )
+        # Check if total pool has enough left
+        if gift.remaining_amount() < gift.per_user_amount:
+            return Response({"success": False, "message": "Gift pool exhausted."}, status=400)
 
-    # Add to user's balance
-    profile = request.user.profile
-    profile.balance += gift.per_user_amount
-    profile.available_balance += gift.per_user_amount
-    profile.save()
+        # Redeem
+        redemption = GiftRedemption.objects.create(
+            code=gift,
+            user=request.user,
+            amount=gift.per_user_amount
+        )
+
+        # Add to user's balance
+        profile.balance += gift.per_user_amount
+        profile.available_balance += gift.per_user_amount
+        profile.save(update_fields=['balance', 'available_balance'])
+        outbox.record('gift.redeemed', request.user.pk, {
+            'redemption_id': redemption.pk, 'code': gift.code, 'amount': str(gift.per_user_amount),
+        })
 
     return Response({"success": True, "amount": float(gift.per_user_amount)})
 
@@ -982,75 +924,159 @@ def get_gift_code_info(request):
         return Response(serializer.data)
     except GiftCode.DoesNotExist:
         return Response({"message": "No gift code available."}, status=404)
+
+
+from . import pagination
+from .models import RechargeRequest
+
+RECHARGE_TRANSACTION_TYPES = ['deposit', 'recharge', 'payment', 'topup']
+# Approved requests already show up as their deposit transaction
+OPEN_RECHARGE_STATUSES = ['pending', 'processing', 'failed', 'cancelled']
+
+
+def _recharge_transactions(user, position, limit):
+    rows = Transaction.objects.filter(
+        pagination.after(position, 'transaction', 'date'),
+        customer=user,
+        type__in=RECHARGE_TRANSACTION_TYPES,
+    ).order_by('-date', '-id').values('id', 'type', 'amount', 'status', 'description', 'date')[:limit + 1]
+    return [
+        (row['date'], row['id'], {
+            'id': row['id'],
+            'source': 'transaction',
+            'transaction_id': f"TX{row['id']:08d}",
+            'amount': float(row['amount']),
+            'type': row['type'],
+            'description': row['description'] or 'Deposit',
+            'status': row['status'],
+            'payment_method': '',
+            'reference_number': '',
+            'created_at': row['date'].isoformat(),
+            'completed_at': None,
+            'payment_proof_url': None,
+        })
+        for row in rows
+    ]
+
+
+def _open_recharge_requests(request, position, limit):
+    proofs = RechargeRequest._meta.get_field('payment_proof').storage
+    rows = RechargeRequest.objects.filter(
+        pagination.after(position, 'request', 'requested_at'),
+        user=request.user,
+        status__in=OPEN_RECHARGE_STATUSES,
+    ).order_by('-requested_at', '-id').values(
+        'id', 'transaction_id', 'reference_number', 'amount', 'status', 'requested_at', 'processed_at',
+        'payment_proof', 'payment_method__name',
+    )[:limit + 1]
+    return [
+        (row['requested_at'], row['id'], {
+            'id': row['id'],
+            'source': 'request',
+            'transaction_id': row['transaction_id'],
+            'amount': float(row['amount']),
+            'type': 'deposit',
+            'description': 'Recharge request',
+            'status': row['status'],
+            'payment_method': row['payment_method__name'] or '',
+            'reference_number': row['reference_number'] or '',
+            'created_at': row['requested_at'].isoformat(),
+            'completed_at': row['processed_at'].isoformat() if row['processed_at'] else None,
+            'payment_proof_url': (
+                request.build_absolute_uri(proofs.url(row['payment_proof'])) if row['payment_proof'] else None
+            ),
+        })
+        for row in rows
+    ]
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def recharge_history(request):
     """
-    Get user's recharge/deposit history
-    Endpoint: GET /api/recharge/history/
+    Get user's recharge/deposit history, newest first
+    Endpoint: GET /api/recharge/history/?limit=20&cursor=...
+
+    ``include_requests=1`` also lists recharge requests that haven't been
+    approved yet (pending proofs, failed ones). Pass ``next_cursor`` back
+    as ``cursor`` for the next page; it is null on the last one.
     """
-    try:
-        user = request.user
-        logger.info(f"Fetching recharge history for user: {user.username}")
-        
-        # Get all deposit/recharge transactions for the user
-        # Filter by type: 'deposit', 'recharge', 'payment', 'topup'
-        deposits = Transaction.objects.filter(
-            customer=user,
-            type__in=['deposit', 'recharge', 'payment', 'topup']
-        ).order_by('-date')  # Most recent first
-        
-        # Prepare response data
-        history_data = []
-        for deposit in deposits:
-            # Safely format the transaction data using getattr
-            transaction_data = {
-                'id': getattr(deposit, 'id', None),
-                'transaction_id': getattr(deposit, 'transaction_id', None) or f"TX{getattr(deposit, 'id', 0):08d}",
-                'amount': float(getattr(deposit, 'amount', 0)),
-                'type': getattr(deposit, 'type', 'deposit'),
-                'description': getattr(deposit, 'description', 'Deposit'),  # Use getattr for safety
-                'status': getattr(deposit, 'status', 'pending'),
-                'payment_method': getattr(deposit, 'payment_method', ''),
-                'reference_number': getattr(deposit, 'reference_number', ''),
-            }
-            
-            # Safely handle date fields
-            date = getattr(deposit, 'date', None)
-            if date:
-                transaction_data['created_at'] = date.isoformat()
-            else:
-                transaction_data['created_at'] = None
-            
-            completed_at = getattr(deposit, 'completed_at', None)
-            if completed_at:
-                transaction_data['completed_at'] = completed_at.isoformat()
-            else:
-                transaction_data['completed_at'] = None
-            
-            # Add payment proof URL if exists
-            if hasattr(deposit, 'payment_proof') and deposit.payment_proof:
-                try:
-                    transaction_data['payment_proof_url'] = request.build_absolute_uri(deposit.payment_proof.url)
-                except (AttributeError, ValueError):
-                    transaction_data['payment_proof_url'] = None
-            
-            history_data.append(transaction_data)
-        
-        logger.info(f"Found {len(history_data)} recharge transactions for {user.username}")
-        
-        return Response({
-            'success': True,
-            'count': len(history_data),
-            'transactions': history_data
-        })
-        
-    except Exception as e:
-        logger.error(f"Error in recharge_history for user {request.user.username}: {str(e)}")
-        return Response(
-            {"success": False, "error": "Failed to fetch recharge history", "details": str(e)},
-            status=500
-        )
+    limit = pagination.page_limit(request)
+    position = pagination.decode_cursor(request.query_params.get('cursor'))
+
+    streams = [('transaction', _recharge_transactions(request.user, position, limit))]
+    if request.query_params.get('include_requests') in ('1', 'true'):
+        streams.append(('request', _open_recharge_requests(request, position, limit)))
+    history_data, next_cursor = pagination.merge_pages(streams, limit)
+
+    return Response({
+        'success': True,
+        'count': len(history_data),
+        'next_cursor': next_cursor,
+        'transactions': history_data,
+    })
+
+
+from datetime import datetime
+
+from django.http import StreamingHttpResponse
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def transaction_archive(request):
+    """
+    Stream the user's transactions from archived months, newest first, as
+    newline-delimited JSON. ``?period=YYYY-MM`` limits it to one month.
+    Endpoint: GET /api/transactions/archive/
+    """
+    month = None
+    if request.query_params.get('period'):
+        try:
+            month = datetime.strptime(request.query_params['period'], '%Y-%m').date()
+        except ValueError:
+            return Response({'error': 'period must look like 2025-01'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = ledger.history(request.user.pk, month)
+    return StreamingHttpResponse(
+        (json.dumps(row, separators=(',', ':')) + '\n' for row in rows),
+        content_type='application/x-ndjson',
+    )
+
+
+from . import realtime
+from .models import RechargeNotification
+
+NOTIFICATIONS_PAGE_SIZE = 50
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def notifications_api(request):
+    """
+    GET: the user's recharge notifications, newest first (``?unread=1`` for
+    unread only), plus the unread count.
+    POST: mark notifications read - ``{"ids": [...]}``, or all without ids.
+    New notifications are also pushed on the ``ws/user/`` socket.
+    """
+    notifications = RechargeNotification.objects.filter(user=request.user)
+
+    if request.method == 'POST':
+        ids = request.data.get('ids')
+        unread = notifications.filter(is_read=False)
+        if ids:
+            unread = unread.filter(id__in=ids)
+        marked = unread.update(is_read=True)
+        return Response({'success': True, 'marked_read': marked})
+
+    listed = notifications.filter(is_read=False) if request.query_params.get('unread') in ('1', 'true') else notifications
+    return Response({
+        'success': True,
+        'unread_count': notifications.filter(is_read=False).count(),
+        'notifications': [
+            dict(realtime.notification_payload(notification), is_read=notification.is_read)
+            for notification in listed.order_by('-created_at')[:NOTIFICATIONS_PAGE_SIZE]
+        ],
+    })
 
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
@@ -1065,6 +1091,7 @@ from decimal import Decimal
 import json
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@catalog.cached_catalog_response(MainProject)
 def get_main_projects(request):
     """
     Get all main projects (public access)
@@ -1099,23 +1126,17 @@ def get_main_projects(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
+@catalog.cached_catalog_response(MainProject)
 def get_featured_projects(request):
     """
     Get featured main projects (public access)
     """
     try:
-        projects = MainProject.objects.filter(
-            is_active=True,
-            is_featured=True,
-            status='available',
-            available_units__gt=0
-        ).order_by('-created_at')[:3]
-        
-        serializer = MainProjectSerializer(projects, many=True)
+        projects = catalog.featured_projects()
         return Response({
             'success': True,
-            'count': len(serializer.data),
-            'projects': serializer.data
+            'count': len(projects),
+            'projects': projects
         })
         
     except Exception as e:
@@ -1180,6 +1201,7 @@ from .models import MainProject ,UserMainProject
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotency.idempotent
 def invest_in_project(request):
     """
     Invest in a main project (authenticated users only)
@@ -1282,13 +1304,27 @@ def invest_in_project(request):
                 daily_income = project.daily_income * Decimal(units)
                 total_income = project.total_income * Decimal(units)
                 
-                # Deduct from user balance
+                # Deduct from user balance, read again under the lock that
+                # gift redemption and other credits take
+                user_profile = Profile.objects.select_for_update().get(pk=user_profile.pk)
+                if user_profile.balance < total_amount:
+                    return Response({
+                        'success': False,
+                        'message': f'Insufficient balance. Required: {total_amount:.2f} Br, Available: {user_profile.balance:.2f} Br'
+                    }, status=status.HTTP_400_BAD_REQUEST)
                 user_profile.balance -= total_amount
-                user_profile.save()
+                user_profile.save(update_fields=['balance'])
                 
-                # Update project available units
-                project.available_units -= units
-                project.save()
+                # Update project available units. A plain UPDATE: a purchase
+                # isn't a catalog edit, so it must not bump the catalog stamp
+                # (which would drop the cached catalog and every portfolio).
+                MainProject.objects.filter(pk=project.pk).update(
+                    available_units=F('available_units') - units,
+                    status=Case(When(available_units__lte=units, then=Value('sold_out')), default=F('status')),
+                )
+                project.refresh_from_db(fields=['available_units', 'status'])
+                if project.status == 'sold_out':
+                    catalog.bump_version(MainProject)  # it leaves the listings
                 
                 # Create UserMainProject record
                 user_main_project = UserMainProject.objects.create(
@@ -1299,15 +1335,19 @@ def invest_in_project(request):
                     status='active'
                 )
                 
+                outbox.record('project.invested', request.user.pk, {
+                    'project_id': project.pk, 'investment_id': user_main_project.pk,
+                    'units': units, 'amount': str(total_amount),
+                })
+                
                 # Refresh the instance to get auto-added fields
                 user_main_project.refresh_from_db()
                 
                 # Test the can_claim method to ensure no errors
                 try:
-                    can_claim = user_main_project.can_claim()
-                    print(f"DEBUG: can_claim() result: {can_claim}")
-                except Exception as method_error:
-                    print(f"DEBUG: Error in can_claim(): {str(method_error)}")
+                    user_main_project.can_claim()
+                except Exception:
+                    logger.exception("can_claim() failed for investment %s", user_main_project.pk)
                 
                 # Format dates safely
                 purchase_date_str = None
@@ -1338,9 +1378,7 @@ def invest_in_project(request):
                 return Response(response_data, status=status.HTTP_201_CREATED)
                 
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            print(f"Transaction error details:\n{error_details}")
+            logger.exception("Investment transaction failed for user %s", request.user.pk)
             
             return Response({
                 'success': False,
@@ -1348,9 +1386,7 @@ def invest_in_project(request):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"General error details:\n{error_details}")
+        logger.exception("Investment error for user %s", request.user.pk)
         
         return Response({
             'success': False,
@@ -1427,6 +1463,7 @@ from .models import PaymentMethod
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@catalog.cached_catalog_response(PaymentMethod)
 def get_payment_methods(request):
     methods = PaymentMethod.objects.filter(is_active=True)
 
@@ -1447,62 +1484,12 @@ def get_payment_methods(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_investments(request):
-    """Get user's purchased VIPs and Main Projects"""
-    user = request.user
-    
-    # Get user's VIPs
-    user_vips = UserVIP.objects.filter(user=user)
-    vip_data = []
-    for user_vip in user_vips:
-        vip = user_vip.vip
-        vip_data.append({
-            'id': vip.id,
-            'title': vip.title,
-            'price': float(vip.price),
-            'daily_income': float(vip.daily_income),
-            'income_days': vip.income_days,
-            'total_income': float(vip.daily_income * vip.income_days),
-            'purchase_date': user_vip.purchase_date.strftime('%Y-%m-%d') if hasattr(user_vip, 'purchase_date') else timezone.now().strftime('%Y-%m-%d'),
-            'last_claim_time': user_vip.last_claim_time.strftime('%Y-%m-%d %H:%M:%S') if user_vip.last_claim_time else None,
-            'status': 'active' if user_vip.can_claim() else 'completed',
-            'type': 'vip',
-            'image_url': vip.image_url,
-        })
-    
-    # Get user's Main Projects (if you have UserMainProject model)
-    main_projects_data = []
-    try:
-        from .models import UserMainProject
-        user_projects = UserMainProject.objects.filter(user=user)
-        for user_project in user_projects:
-            project = user_project.main_project
-            main_projects_data.append({
-                'id': project.id,
-                'title': project.title,
-                'price': float(project.price),
-                'daily_income': float(project.daily_income),
-                'cycle_days': project.cycle_days,
-                'total_income': float(project.total_income),
-                'purchase_date': user_project.purchase_date.strftime('%Y-%m-%d'),
-                'units': user_project.units,
-                'available_units': project.available_units,
-                'last_claim_time': user_project.last_claim_time.strftime('%Y-%m-%d %H:%M:%S') if user_project.last_claim_time else None,
-                'status': user_project.status,
-                'type': 'main_project',
-                'image_url': project.image_url,
-            })
-    except ImportError:
-        # If UserMainProject doesn't exist yet, return empty list
-        pass
-    
-    return Response({
-        'vips': vip_data,
-        'main_projects': main_projects_data,
-        'total_count': len(vip_data) + len(main_projects_data),
-    })
+    """Get user's purchased VIPs and Main Projects from their portfolio read model"""
+    return Response(portfolio.payload(request.user))
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotency.idempotent
 def claim_vip_income(request):
     """Claim income from a VIP investment"""
     try:
@@ -1535,23 +1522,27 @@ def claim_vip_income(request):
         # Calculate daily income
         daily_income = user_vip.vip.daily_income
         
-        # Update user balance
-        profile = Profile.objects.get(user=request.user)
-        profile.balance += daily_income
-        profile.available_balance += daily_income
-        profile.save()
-        
-        # Update last claim time
-        user_vip.last_claim_time = timezone.now()
-        user_vip.save()
-        
-        # Record transaction
-        Transaction.objects.create(
-            customer=request.user,
-            type='profit',
-            amount=daily_income,
-            status='success',
-        )
+        with transaction.atomic():
+            # Update user balance
+            profile = Profile.objects.get(user=request.user)
+            profile.balance += daily_income
+            profile.available_balance += daily_income
+            profile.save()
+            
+            # Update last claim time
+            user_vip.last_claim_time = timezone.now()
+            user_vip.save()
+            
+            # Record transaction
+            Transaction.objects.create(
+                customer=request.user,
+                type='profit',
+                amount=daily_income,
+                status='success',
+            )
+            outbox.record('vip.claimed', request.user.pk, {
+                'vip_id': user_vip.vip_id, 'amount': str(daily_income),
+            })
         
         return Response({
             'success': True,
@@ -1574,6 +1565,7 @@ def claim_vip_income(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotency.idempotent
 def claim_main_project_income(request):
     """Claim income from a Main Project investment"""
     try:
@@ -1614,29 +1606,34 @@ def claim_main_project_income(request):
         # Calculate daily income (daily income * units)
         daily_income = user_project.main_project.daily_income * user_project.units
         
-        # Update user balance
-        profile = Profile.objects.get(user=request.user)
-        profile.balance += daily_income
-        profile.available_balance += daily_income
-        profile.save()
-        
-        # Update last claim time
-        user_project.last_claim_time = timezone.now()
-        user_project.save()
-        
-        # Check if investment cycle is completed
-        days_since_purchase = (timezone.now() - user_project.purchase_date).days
-        if days_since_purchase >= user_project.main_project.cycle_days:
-            user_project.status = 'completed'
+        with transaction.atomic():
+            # Update user balance
+            profile = Profile.objects.get(user=request.user)
+            profile.balance += daily_income
+            profile.available_balance += daily_income
+            profile.save()
+            
+            # Update last claim time
+            user_project.last_claim_time = timezone.now()
             user_project.save()
-        
-        # Record transaction
-        Transaction.objects.create(
-            customer=request.user,
-            type='profit',
-            amount=daily_income,
-            status='success',
-        )
+            
+            # Check if investment cycle is completed
+            days_since_purchase = (timezone.now() - user_project.purchase_date).days
+            if days_since_purchase >= user_project.main_project.cycle_days:
+                user_project.status = 'completed'
+                user_project.save()
+            
+            # Record transaction
+            Transaction.objects.create(
+                customer=request.user,
+                type='profit',
+                amount=daily_income,
+                status='success',
+            )
+            outbox.record('project.claimed', request.user.pk, {
+                'project_id': user_project.main_project_id, 'amount': str(daily_income),
+                'status': user_project.status,
+            })
         
         return Response({
             'success': True,
@@ -1690,7 +1687,7 @@ def video_list(request):
     queryset = Video.objects.filter(
         is_published=True,
         status='approved'
-    )
+    ).select_related('uploaded_by')
 
     featured = request.query_params.get('featured')
     category = request.query_params.get('category')
@@ -1742,28 +1739,28 @@ def video_detail(request, pk):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def increment_views(request, pk):
-    video = Video.objects.get(pk=pk)
-    video.views += 1
-    video.save()
-    return Response({'views': video.views})
+    # F() update: counters don't race and don't invalidate the catalog cache
+    Video.objects.filter(pk=pk).update(views=F('views') + 1)
+    views = Video.objects.values_list('views', flat=True).get(pk=pk)
+    return Response({'views': views})
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def like_video(request, pk):
-    video = Video.objects.get(pk=pk)
-    video.likes += 1
-    video.save()
-    return Response({'likes': video.likes})
+    # F() update: counters don't race and don't invalidate the catalog cache
+    Video.objects.filter(pk=pk).update(likes=F('likes') + 1)
+    likes = Video.objects.values_list('likes', flat=True).get(pk=pk)
+    return Response({'likes': likes})
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def dislike_video(request, pk):
-    video = Video.objects.get(pk=pk)
-    video.dislikes += 1
-    video.save()
-    return Response({'dislikes': video.dislikes})
+    # F() update: counters don't race and don't invalidate the catalog cache
+    Video.objects.filter(pk=pk).update(dislikes=F('dislikes') + 1)
+    dislikes = Video.objects.values_list('dislikes', flat=True).get(pk=pk)
+    return Response({'dislikes': dislikes})
 
 
 # ==========================
@@ -1783,14 +1780,22 @@ def upload_video(request):
 
     if serializer.is_valid():
         video_file = serializer.validated_data['video_file']
+        title = moderation.moderate(serializer.validated_data['title'])
+        description = moderation.moderate(serializer.validated_data.get('description', ''))
+        # Flagged metadata always goes to the review queue, even for staff
+        approved = request.user.is_staff and not (title.flagged or description.flagged)
 
         video = serializer.save(
+            title=title.text,
+            description=description.text,
             uploaded_by=request.user,
             duration=0,
             file_size=video_file.size,
-            status='approved' if request.user.is_staff else 'pending',
-            is_published=request.user.is_staff
+            status='approved' if approved else 'pending',
+            is_published=approved
         )
+        # Duration is probed by the worker (cat/tasks.py)
+        jobs.enqueue('videos.process', video_id=video.pk)
 
         return Response(
             VideoSerializer(video, context={'request': request}).data,
@@ -1849,6 +1854,7 @@ def unfeature_video(request, pk):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@catalog.cached_catalog_response(Video)
 def video_categories(request):
     categories = Video.objects.values_list(
         'category',
@@ -1882,82 +1888,55 @@ def get_team_members(request):
         user = request.user
         user_profile = user.profile
         
-        # Get all users directly referred by this user
-        direct_referrals = User.objects.filter(
+        # Direct referrals with their VIP and active investment, in one query
+        zero = Value(Decimal('0'), output_field=DecimalField(max_digits=14, decimal_places=2))
+        direct_referrals = list(User.objects.filter(
             profile__inviter=user
-        ).select_related('profile')
+        ).select_related('profile', 'uservip__vip').annotate(
+            active_investment=Coalesce(Subquery(
+                UserMainProject.objects.filter(user=OuterRef('pk'), status='active')
+                .values('user').annotate(total=Sum('invested_amount')).values('total')
+            ), zero),
+        ).order_by('pk'))
         
         team_members = []
         for referral in direct_referrals:
-            # Get referral's profile
             referral_profile = referral.profile
             
-            # Calculate total investment for this referral
-            total_investment = UserMainProject.objects.filter(
-                user=referral,
-                status='active'
-            ).aggregate(
-                total=Sum('invested_amount')
-            )['total'] or Decimal('0')
-            
-            # Get user's VIP if any
+            # VIP comes from the select_related join
             vip_level = 'No VIP'
-            try:
-                user_vip = UserVIP.objects.get(user=referral)
+            user_vip = getattr(referral, 'uservip', None)
+            if user_vip is not None:
                 vip_level = f"VIP {user_vip.vip.upgrade}"
-            except UserVIP.DoesNotExist:
-                pass
-            
-            # Calculate commission earned from this referral (if Commission model exists)
-            commission_earned = Decimal('0')
-            try:
-                from .models import Commission
-                commission_earned = Commission.objects.filter(
-                    user=user,
-                    related_user=referral
-                ).aggregate(
-                    total=Sum('amount')
-                )['total'] or Decimal('0')
-            except (ImportError, AttributeError):
-                pass
             
             team_members.append({
                 'id': referral.id,
-                'name': referral.get_full_name() or referral.username,
+                'name': f'{referral.first_name} {referral.last_name}'.strip() or referral.username,
                 'username': referral.username,
                 'phone': referral_profile.phone or '',
                 'email': referral.email or '',
                 'level': vip_level,
                 'joined': referral.date_joined.strftime('%Y-%m-%d'),
                 'status': 'active' if referral.is_active else 'inactive',
-                'investment': float(total_investment),
-                'commission_earned': float(commission_earned),
+                'investment': float(referral.active_investment),
+                # Commissions only record the level they were paid at, not
+                # the member behind them
+                'commission_earned': 0.0,
                 'avatar': referral_profile.avatar.url if referral_profile.avatar else None,
             })
         
         # Get team stats
-        total_members = direct_referrals.count()
-        active_members = direct_referrals.filter(is_active=True).count()
+        total_members = len(direct_referrals)
+        active_members = sum(1 for referral in direct_referrals if referral.is_active)
+        total_investment = sum((referral.active_investment for referral in direct_referrals), Decimal('0'))
         
-        total_investment = UserMainProject.objects.filter(
-            user__profile__inviter=user,
-            status='active'
+        # Calculate total commission earned
+        total_commission = Commission.objects.filter(
+            user=user
         ).aggregate(
-            total=Sum('invested_amount')
+            total=Sum('amount')
         )['total'] or Decimal('0')
         
-        # Calculate total commission earned
-        total_commission = Decimal('0')
-        try:
-            from .models import Commission
-            total_commission = Commission.objects.filter(
-                user=user
-            ).aggregate(
-                total=Sum('amount')
-            )['total'] or Decimal('0')
-        except (ImportError, AttributeError):
-            pass
-        
         team_stats = {
             'total_members': total_members,
             'active_members': active_members,
@@ -1974,9 +1953,7 @@ def get_team_members(request):
         })
         
     except Exception as e:
-        import traceback
-        print(f"Error in get_team_members: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in get_team_members")
         return Response({
             'success': False,
             'message': f'Error loading team data: {str(e)}'
@@ -1989,7 +1966,7 @@ def send_invitation(request):
     try:
         data = request.data
         phone = data.get('phone')
-        message = data.get('message', 'Join me on this amazing platform and start earning!')
+        greeting = data.get('message', tasks.DEFAULT_INVITATION)
         
         if not phone:
             return Response({
@@ -1999,14 +1976,10 @@ def send_invitation(request):
         
         # Get user's invite code
         invite_code = request.user.profile.invite_code
-        referral_link = f"https://yourapp.com/register?ref={invite_code}"
-        
-        # Full message with referral link
-        full_message = f"{message}\n\nUse my referral link to register: {referral_link}\n\nMy invite code: {invite_code}"
         
-        # Log the invitation (in production, integrate with SMS service)
-        print(f"[INVITATION] To: {phone}")
-        print(f"[INVITATION] Message: {full_message}")
+        # Sent by the worker (cat/tasks.py), which builds the text from the
+        # invite code so it never sits in the job row
+        jobs.enqueue('team.send_invitation', user_id=request.user.pk, phone=phone, greeting=greeting)
         
         # Create a record of the invitation (optional)
         # You could create an Invitation model to track these
@@ -2014,7 +1987,7 @@ def send_invitation(request):
         return Response({
             'success': True,
             'message': 'Invitation sent successfully!',
-            'referral_link': referral_link,
+            'referral_link': tasks.referral_link(invite_code),
             'invite_code': invite_code,
         })
         
@@ -2074,66 +2047,37 @@ def get_team_stats(request):
     try:
         user = request.user
         
-        # Direct referrals (Level 1)
-        level1_referrals = User.objects.filter(profile__inviter=user)
-        
-        # Level 2 referrals (referrals of referrals)
-        level2_referrals = User.objects.filter(
-            profile__inviter__in=level1_referrals
-        )
-        
-        # Level 3 referrals
-        level3_referrals = User.objects.filter(
-            profile__inviter__in=level2_referrals
+        # A member's path to the user, per level
+        paths = {1: 'inviter', 2: 'inviter__profile__inviter', 3: 'inviter__profile__inviter__profile__inviter'}
+        in_level = {level: Q(**{path: user}) for level, path in paths.items()}
+        in_team = in_level[1] | in_level[2] | in_level[3]
+
+        # One query each for members, active investment and commission
+        # across the three levels
+        members = Profile.objects.filter(in_team).aggregate(**{
+            f'level{level}': Count('pk', filter=q) for level, q in in_level.items()
+        })
+        member_ids = Profile.objects.filter(in_team).values('user_id')
+        investments = UserMainProject.objects.filter(status='active', user_id__in=member_ids).aggregate(**{
+            f'level{level}': Sum('invested_amount', filter=Q(**{f'user__profile__{path}': user}))
+            for level, path in paths.items()
+        })
+        commissions = dict(
+            Commission.objects.filter(user=user, level__in=paths).values_list('level').annotate(total=Sum('amount'))
         )
-        
-        # Calculate investments by level
-        def get_investment_for_users(users):
-            return UserMainProject.objects.filter(
-                user__in=users,
-                status='active'
-            ).aggregate(total=Sum('invested_amount'))['total'] or Decimal('0')
-        
-        level1_investment = get_investment_for_users(level1_referrals)
-        level2_investment = get_investment_for_users(level2_referrals)
-        level3_investment = get_investment_for_users(level3_referrals)
-        
-        # Calculate commissions by level (if Commission model exists)
-        def get_commission_for_level(level):
-            try:
-                from .models import Commission
-                return Commission.objects.filter(
-                    user=user,
-                    level=level
-                ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
-            except (ImportError, AttributeError):
-                return Decimal('0')
-        
-        level1_commission = get_commission_for_level(1)
-        level2_commission = get_commission_for_level(2)
-        level3_commission = get_commission_for_level(3)
-        
-        stats = {
-            'level1': {
-                'members': level1_referrals.count(),
-                'investment': float(level1_investment),
-                'commission': float(level1_commission),
-            },
-            'level2': {
-                'members': level2_referrals.count(),
-                'investment': float(level2_investment),
-                'commission': float(level2_commission),
-            },
-            'level3': {
-                'members': level3_referrals.count(),
-                'investment': float(level3_investment),
-                'commission': float(level3_commission),
-            },
-            'total': {
-                'members': level1_referrals.count() + level2_referrals.count() + level3_referrals.count(),
-                'investment': float(level1_investment + level2_investment + level3_investment),
-                'commission': float(level1_commission + level2_commission + level3_commission),
+
+        levels = {
+            f'level{level}': {
+                'members': members[f'level{level}'],
+                'investment': investments[f'level{level}'] or Decimal('0'),
+                'commission': commissions.get(level) or Decimal('0'),
             }
+            for level in paths
+        }
+        levels['total'] = {key: sum(row[key] for row in levels.values()) for key in ('members', 'investment', 'commission')}
+        stats = {
+            name: {'members': row['members'], 'investment': float(row['investment']), 'commission': float(row['commission'])}
+            for name, row in levels.items()
         }
         
         return Response({
@@ -2179,7 +2123,80 @@ def share_referral_link(request):
 
 
 
+# ==========================
+# STAFF METRICS
+# ==========================
 
+from chat.backpressure import outbound_metrics
+from .middleware import endpoint_metrics
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def endpoint_metrics_api(request):
+    """
+    Per-endpoint query count, DB time and latency for this worker process,
+    plus chat fan-out frame and drop counters. DELETE resets the counters.
+    """
+    if request.method == 'DELETE':
+        endpoint_metrics.reset()
+        outbound_metrics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response({
+        'endpoints': endpoint_metrics.snapshot(),
+        'chat_outbound': outbound_metrics.snapshot(),
+    })
 
 
+# ==========================
+# STAFF MESSAGE SEARCH
+# ==========================
+
+from .search import search_messages
+
+MESSAGE_SEARCH_MAX_PAGE_SIZE = 100
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def message_search_api(request):
+    """
+    Full-text search over chat messages, best match first.
+    Query params: q (required), room, page, page_size.
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page = max(int(request.query_params.get('page', 1)), 1)
+        page_size = min(max(int(request.query_params.get('page_size', 20)), 1), MESSAGE_SEARCH_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({'error': 'page and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+    total, messages = search_messages(query, room=request.query_params.get('room') or None, page=page, page_size=page_size)
+    return Response({
+        'count': total,
+        'page': page,
+        'page_size': page_size,
+        'results': [
+            dict(MessageSerializer(message).data, room=message.room, rank=message.rank)
+            for message in messages
+        ],
+    })
+
+
+# ==========================
+# STAFF MODERATION
+# ==========================
+
+import time
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def moderation_reload_api(request):
+    """Recompile the banned-terms filter after bulk edits; other processes follow within MODERATION_RELOAD_INTERVAL."""
+    started = time.perf_counter()
+    content_filter = moderation.reload_filter()
+    return Response({
+        'terms': len(content_filter),
+        'compile_ms': round((time.perf_counter() - started) * 1000, 3),
+    })
 
@@ -4,3 +4,6 @@ class CatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cat'
     verbose_name = 'Cat Investment Platform'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
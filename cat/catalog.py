@@ -0,0 +1,162 @@
+import hashlib
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.core.cache import cache
+from django.db.models import Subquery
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+from .models import VIP, CatalogVersion, MainProject
+from .serializers import MainProjectSerializer, VIPSerializer
+
+
+# =======================
+# CATALOG VERSION STAMPS
+# =======================
+
+# Catalog rows only change when staff edit them in admin, so cached entries
+# are keyed by a per-model version stamp that signals bump on every write.
+# The stamps live in ``CatalogVersion`` rather than the cache: the cache is
+# per process, and a bump has to reach every web, socket and worker
+# process. Reading them costs one primary-key query per request. The
+# bodies stay in the local cache because their keys include the stamps.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def label(model):
+    return model._meta.label_lower
+
+
+# Stamps already read for the response being built (see ``versions_read``),
+# so the code building it does not read them a second time.
+_request_versions = ContextVar('catalog_request_versions', default={})
+
+
+def get_versions(*models):
+    """Current version stamps for ``models`` in one query; missing ones are created."""
+    labels = [label(model) for model in models]
+    versions = dict(_request_versions.get())
+    unread = [name for name in labels if name not in versions]
+    if unread:
+        versions.update(CatalogVersion.objects.filter(name__in=unread).values_list('name', 'version'))
+    for name in labels:
+        if name not in versions:
+            versions[name] = CatalogVersion.objects.get_or_create(
+                name=name, defaults={'version': uuid.uuid4().hex},
+            )[0].version
+    return [versions[name] for name in labels]
+
+
+def get_version(model):
+    return get_versions(model)[0]
+
+
+def version_subquery(model):
+    """The stamp of ``model`` as a subquery, for reading it along with another row (None if never set)."""
+    return Subquery(CatalogVersion.objects.filter(name=label(model)).values('version')[:1])
+
+
+@contextmanager
+def versions_read(*models):
+    """Read the stamps of ``models`` once for everything built inside the block."""
+    stamps = get_versions(*models)
+    token = _request_versions.set(dict(_request_versions.get(), **{
+        label(model): stamp for model, stamp in zip(models, stamps)
+    }))
+    try:
+        yield stamps
+    finally:
+        _request_versions.reset(token)
+
+
+def bump_version(model):
+    """Invalidate every cached catalog entry that depends on ``model``."""
+    CatalogVersion.objects.update_or_create(name=label(model), defaults={'version': uuid.uuid4().hex})
+
+
+def _versioned(name, models, build):
+    versions = '.'.join(get_versions(*models))
+    return cache.get_or_set(f'catalog:{name}:{versions}', build, CATALOG_CACHE_TIMEOUT)
+
+
+# =======================
+# CACHED CATALOG DATA
+# =======================
+
+def vip_packages():
+    """All VIP packages ordered by upgrade level, as serialized for the app."""
+    return _versioned(
+        'vip_packages', [VIP],
+        lambda: VIPSerializer(VIP.objects.all().order_by('upgrade'), many=True).data,
+    )
+
+
+def featured_projects():
+    """The three newest featured main projects that can still be bought."""
+    return _versioned(
+        'featured_projects', [MainProject],
+        lambda: MainProjectSerializer(
+            MainProject.objects.filter(
+                is_active=True,
+                is_featured=True,
+                status='available',
+                available_units__gt=0
+            ).order_by('-created_at')[:3],
+            many=True,
+        ).data,
+    )
+
+
+# =======================
+# CACHED CATALOG RESPONSES
+# =======================
+
+def cached_catalog_response(*models):
+    """
+    Cache a read-only catalog view per URL and per version of ``models``.
+
+    Responses carry an ETag derived from the version stamps, so unchanged
+    clients get a bodiless 304 and everyone else is served from the cache
+    after one query for the stamps. Apply it below ``@api_view`` so
+    authentication and permissions still run first.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            with versions_read(*models) as stamps:
+                return respond(request, stamps, *args, **kwargs)
+
+        def respond(request, stamps, *args, **kwargs):
+            versions = '.'.join(stamps)
+            digest = hashlib.md5(f'{request.get_full_path()}|{versions}'.encode()).hexdigest()
+            etag = f'"{digest}"'
+
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                response = HttpResponseNotModified()
+            else:
+                key = f'catalog:response:{digest}'
+                cached = cache.get(key)
+                if cached is None:
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    if isinstance(response, Response):
+                        cached = ('data', response.data)
+                    else:
+                        cached = ('raw', response.content, response['Content-Type'])
+                    cache.set(key, cached, CATALOG_CACHE_TIMEOUT)
+
+                if cached[0] == 'data':
+                    response = Response(cached[1])
+                else:
+                    response = HttpResponse(cached[1], content_type=cached[2])
+
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
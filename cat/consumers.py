@@ -0,0 +1,49 @@
+import json
+import logging
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from .models import RechargeNotification
+from .realtime import ledger_balances, user_group
+
+logger = logging.getLogger(__name__)
+
+
+def _snapshot(user_id):
+    return {
+        'balance': ledger_balances([user_id]).get(user_id, {
+            'balance': 0.0, 'available_balance': 0.0, 'frozen_balance': 0.0,
+        }),
+        'unread_notifications': RechargeNotification.objects.filter(user_id=user_id, is_read=False).count(),
+    }
+
+
+class UserConsumer(AsyncWebsocketConsumer):
+    """
+    The signed-in user's private channel. On connect it sends the current
+    balance and unread count; after that it relays the ledger and
+    notification events the outbox dispatcher pushes via ``cat.realtime``.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.user_id = user.pk
+        await self.channel_layer.group_add(user_group(self.user_id), self.channel_name)
+        await self.accept()
+        snapshot = await database_sync_to_async(_snapshot)(self.user_id)
+        await self.send(text_data=json.dumps(dict(snapshot, type='snapshot')))
+        logger.info('User socket connected', extra={'event': 'user.connect', 'user_id': self.user_id})
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'user_id', None) is not None:
+            await self.channel_layer.group_discard(user_group(self.user_id), self.channel_name)
+
+    async def user_events(self, event):
+        frame = {'type': 'events', 'events': event['events']}
+        if 'balance' in event:
+            frame['balance'] = event['balance']
+        await self.send(text_data=json.dumps(frame))
@@ -0,0 +1,125 @@
+"""
+Idempotency keys for money-moving endpoints.
+
+The app sends an ``Idempotency-Key`` header (any unique string, usually a
+UUID) with a POST. If the connection drops it retries with the same key.
+The first request runs normally, and its response is stored in the same
+database transaction as its writes. A retry is answered from that row with
+one indexed lookup, so it neither runs the view again nor double-applies
+it. Replays carry ``Idempotent-Replayed: true``.
+
+Keys are scoped to the user. Reusing a key for a different request (other
+endpoint or body) is refused with 422. Only responses below 500 are kept;
+a server error rolls the key back with everything else, so the retry runs
+for real. Rows expire after IDEMPOTENCY_KEY_TTL seconds and are pruned by
+the ``idempotency.prune`` job.
+
+Requests without the header behave exactly as before.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+
+def key_digest(user_id, key):
+    return hashlib.sha256(f'{user_id}:{key}'.encode()).hexdigest()
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.blake2b(f'{request.method} {request.path}\n{body}'.encode(), digest_size=16).hexdigest()
+
+
+def _replay(record, request_fingerprint):
+    if record.fingerprint != request_fingerprint:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    response = Response(record.response, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _lookup(digest):
+    record = IdempotencyKey.objects.filter(key=digest).first()
+    if record is not None and record.expires_at <= timezone.now():
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+        return None
+    return record
+
+
+def idempotent(view):
+    """
+    Honour ``Idempotency-Key`` on a DRF function view. Apply it below
+    ``@api_view`` so authentication runs first.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        digest = key_digest(request.user.pk, key)
+        request_fingerprint = fingerprint(request)
+        record = _lookup(digest)
+        if record is not None:
+            return _replay(record, request_fingerprint)
+
+        with transaction.atomic():
+            try:
+                # Reserve the key first: a concurrent duplicate blocks on the
+                # unique index until this transaction ends, then replays.
+                with transaction.atomic():
+                    IdempotencyKey.objects.create(
+                        key=digest, user_id=request.user.pk, fingerprint=request_fingerprint,
+                        expires_at=timezone.now() + timedelta(seconds=_ttl()),
+                    )
+            except IntegrityError:
+                response = None
+            else:
+                response = view(request, *args, **kwargs)
+                if isinstance(response, Response) and response.status_code < 500:
+                    IdempotencyKey.objects.filter(key=digest).update(
+                        status_code=response.status_code, response=response.data,
+                    )
+                else:
+                    transaction.set_rollback(True)
+        if response is not None:
+            return response
+
+        record = _lookup(digest)
+        if record is None or record.status_code is None:
+            return Response(
+                {'error': f'A request with this {HEADER} is still in progress'},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return _replay(record, request_fingerprint)
+    return wrapper
+
+
+def prune_expired():
+    """Delete expired keys; returns how many."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,182 @@
+"""
+Database-backed background jobs.
+
+Slow side effects are queued as ``Job`` rows and run by ``manage.py
+run_worker``, so requests don't wait for them and no broker is needed.
+``enqueue`` inside a transaction only queues the job if that transaction
+commits.
+
+Tasks are plain functions registered with ``@task('name')`` that take
+JSON-serialisable keyword arguments. A task that raises is retried
+with exponential backoff (JOB_RETRY_BASE * 2**attempt seconds) until
+``max_attempts``, then left ``failed`` with its traceback for staff.
+``@task(..., every=seconds)`` also makes the worker keep one queued run of
+it scheduled.
+
+Claiming: on PostgreSQL workers take due rows with ``SELECT ... FOR UPDATE
+SKIP LOCKED``, so concurrent workers never wait on each other. SQLite has
+no row locks, so there a worker claims each candidate with a conditional
+``UPDATE ... WHERE status = 'queued'`` and keeps the rows it won. The
+worker refreshes ``locked_at`` on its running jobs every
+JOB_HEARTBEAT_INTERVAL seconds. A job whose lock is older than
+JOB_LOCK_TIMEOUT (its worker died) is put back in the queue, and a worker
+that lost a job that way does not record an outcome for it.
+"""
+import logging
+import os
+import socket
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: object
+    max_attempts: int = 3
+    every: int = None
+
+
+TASKS = {}
+
+
+def task(name, max_attempts=3, every=None):
+    """Register the decorated function as the job ``name``."""
+    def register(func):
+        TASKS[name] = Task(name, func, max_attempts, every)
+        return func
+    return register
+
+
+def enqueue(name, run_at=None, delay=None, **kwargs):
+    """Queue ``name(**kwargs)``, to run at ``run_at`` or after ``delay`` seconds."""
+    if name not in TASKS:
+        raise KeyError(f'Unknown job {name!r}')
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    return Job.objects.create(name=name, kwargs=kwargs, run_at=run_at, max_attempts=TASKS[name].max_attempts)
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# =======================
+# CLAIMING
+# =======================
+
+def claim(limit, worker=None):
+    """Mark up to ``limit`` due jobs as running for ``worker`` and return them."""
+    worker = worker or worker_id()
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(id__in=ids).update(status='running', locked_by=worker, locked_at=now)
+    else:
+        ids = []
+        for job_id in due.values_list('id', flat=True)[:limit * 2]:
+            if Job.objects.filter(id=job_id, status='queued').update(
+                    status='running', locked_by=worker, locked_at=now):
+                ids.append(job_id)
+                if len(ids) == limit:
+                    break
+    return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def heartbeat(job_ids, worker=None):
+    """Refresh the lock on ``worker``'s running jobs; returns how many it still holds."""
+    return Job.objects.filter(id__in=job_ids, status='running', locked_by=worker or worker_id()).update(
+        locked_at=timezone.now(),
+    )
+
+
+def requeue_stale():
+    """Put back jobs whose worker stopped reporting; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=_setting('JOB_LOCK_TIMEOUT', 300))
+    return Job.objects.filter(status='running', locked_at__lt=cutoff).update(
+        status='queued', locked_by='', locked_at=None,
+    )
+
+
+def schedule_periodic():
+    """Make sure every ``every=`` task has one queued or running job."""
+    scheduled = set(
+        Job.objects.filter(status__in=['queued', 'running'], name__in=[
+            name for name, spec in TASKS.items() if spec.every
+        ]).values_list('name', flat=True)
+    )
+    for name, spec in TASKS.items():
+        if spec.every and name not in scheduled:
+            enqueue(name, delay=spec.every)
+
+
+# =======================
+# RUNNING
+# =======================
+
+def execute(job_id, worker=None):
+    """
+    Run one job claimed by ``worker`` and record the outcome, unless the job
+    was requeued and claimed elsewhere meanwhile. Safe to call from pool
+    workers.
+    """
+    worker = worker or worker_id()
+    close_old_connections()
+    try:
+        job = Job.objects.get(id=job_id)
+        spec = TASKS.get(job.name)
+        job.attempts += 1
+        try:
+            if spec is None:
+                raise KeyError(f'Unknown job {job.name!r}')
+            spec.func(**job.kwargs)
+        except Exception:
+            job.last_error = traceback.format_exc()[-4000:]
+            if job.attempts < job.max_attempts:
+                job.status = 'queued'
+                job.run_at = timezone.now() + timedelta(
+                    seconds=_setting('JOB_RETRY_BASE', 10) * 2 ** (job.attempts - 1)
+                )
+            else:
+                job.status = 'failed'
+                job.finished_at = timezone.now()
+            logger.warning('Job %s failed (attempt %s/%s)', job.name, job.attempts, job.max_attempts, extra={
+                'event': 'jobs.failed', 'job_id': job.id, 'final': job.status == 'failed',
+            })
+        else:
+            job.status = 'done'
+            job.finished_at = timezone.now()
+        saved = Job.objects.filter(id=job.id, status='running', locked_by=worker).update(
+            status=job.status, attempts=job.attempts, last_error=job.last_error, run_at=job.run_at,
+            finished_at=job.finished_at, locked_by='', locked_at=None,
+        )
+        if not saved:
+            logger.warning('Job %s lost its lock; outcome not recorded', job.name, extra={
+                'event': 'jobs.lost', 'job_id': job.id, 'worker': worker,
+            })
+            return 'lost'
+        return job.status
+    finally:
+        close_old_connections()
+
+
+@task('jobs.prune', every=60 * 60)
+def prune_finished():
+    """Delete finished jobs older than JOB_RETENTION_DAYS; failed ones stay for staff."""
+    cutoff = timezone.now() - timedelta(days=_setting('JOB_RETENTION_DAYS', 7))
+    Job.objects.filter(status='done', finished_at__lt=cutoff).delete()
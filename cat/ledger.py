@@ -0,0 +1,345 @@
+"""
+Ledger totals and the transaction archive.
+
+``Transaction`` only keeps recent months once archiving runs: the
+``archive_ledger`` command, or the daily ``ledger.archive`` job when
+LEDGER_ARCHIVE_SCHEDULED is on. Recharge and withdraw history read only the
+hot table. Archiving moves older rows through three tiers:
+
+1. *Hot*: ``Transaction``, the last LEDGER_HOT_DAYS days, rounded down to
+   the start of a month. Everything the app reads day to day.
+2. *Archive*: ``ArchivedTransaction``, one closed month at a time. On
+   PostgreSQL each month is its own partition of the table. On SQLite it
+   is an ordinary table. Each month is also rolled into one
+   ``LedgerPeriod`` row per user and type. ``totals`` adds those rows to
+   the hot sums, so balances never change when rows move.
+3. *Cold*: months older than LEDGER_EXPORT_DAYS are written to
+   ``LEDGER_ARCHIVE_DIR/ledger-YYYY-MM.jsonl.gz`` and dropped from the
+   archive. The file holds one gzip member per user, with its offset
+   recorded in ``LedgerExportChunk``. ``history`` can therefore stream one
+   user's rows back by reading just that member. The file as a whole is
+   still a plain gzip that ``zcat`` reads. Rows archived into a month after
+   it was exported are merged into a new file for it.
+"""
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import ArchivedTransaction, LedgerExport, LedgerExportChunk, LedgerPeriod, Transaction
+
+logger = logging.getLogger(__name__)
+
+BALANCE_TYPES = ('deposit', 'withdraw')
+ROW_FIELDS = (
+    'id', 'customer_id', 'type', 'bank', 'amount', 'account_number', 'phone_number', 'status', 'description', 'date',
+)
+
+
+# =======================
+# TOTALS
+# =======================
+
+def grouped_totals(types=BALANCE_TYPES, **filters):
+    """
+    ``(customer_id, type, total)`` rows summing hot transactions and
+    archived period totals of ``types`` for the customers matching
+    ``filters`` (e.g. ``customer_id__in=...``), in one query. A
+    customer/type pair may appear twice, once per source.
+    """
+    hot = Transaction.objects.filter(type__in=types, **filters).values(
+        'customer_id', 'type',
+    ).annotate(total=Sum('amount')).order_by()
+    closed = LedgerPeriod.objects.filter(type__in=types, **filters).values(
+        'customer_id', 'type',
+    ).annotate(total=Sum('total')).order_by()
+    return hot.union(closed, all=True).values_list('customer_id', 'type', 'total')
+
+
+def totals(user_ids):
+    """``{user_id: {'deposit': Decimal, 'withdraw': Decimal}}`` over hot and archived transactions."""
+    result = {}
+    for customer_id, kind, total in grouped_totals(customer_id__in=user_ids):
+        per_user = result.setdefault(customer_id, dict.fromkeys(BALANCE_TYPES, 0))
+        per_user[kind] += total or 0
+    return result
+
+
+def balance(user):
+    """Deposits minus withdrawals for ``user``."""
+    user_totals = totals([user.pk]).get(user.pk)
+    if user_totals is None:
+        return 0
+    return user_totals['deposit'] - user_totals['withdraw']
+
+
+# =======================
+# PERIODS
+# =======================
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def _bounds(month):
+    following = next_month(month)
+    return (
+        timezone.make_aware(datetime(month.year, month.month, 1)),
+        timezone.make_aware(datetime(following.year, following.month, 1)),
+    )
+
+
+def cutoff(days, now=None):
+    """Start of the oldest month that must stay where it is."""
+    return month_start(timezone.localtime(now) - timedelta(days=days))
+
+
+# =======================
+# ARCHIVE TABLE
+# =======================
+
+def _partition(month):
+    return f'{ArchivedTransaction._meta.db_table}_y{month.year}m{month.month:02d}'
+
+
+def install_archive_table(schema_editor, model):
+    """Create the archive table; partitioned by month on PostgreSQL."""
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(model)
+        return
+    sql, params = schema_editor.table_sql(model)
+    schema_editor.execute(f'{sql} PARTITION BY RANGE ("date")', params)
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+
+
+def drop_archive_table(schema_editor, model):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{model._meta.db_table}" CASCADE')
+    else:
+        schema_editor.delete_model(model)
+
+
+def ensure_partition(month):
+    if connection.vendor != 'postgresql':
+        return
+    start, end = _bounds(month)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS "{_partition(month)}" PARTITION OF "{ArchivedTransaction._meta.db_table}" '
+            'FOR VALUES FROM (%s) TO (%s)',
+            [start, end],
+        )
+
+
+def archive_month(month, batch_size=2000):
+    """
+    Move ``month``'s transactions to the archive and add them to the
+    users' period totals, in one transaction. Returns the rows moved.
+    """
+    start, end = _bounds(month)
+    rows = Transaction.objects.filter(date__gte=start, date__lt=end)
+    with transaction.atomic():
+        ensure_partition(month)
+        moved = 0
+        # Copy in id order, one batch at a time, so memory stays flat.
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id).order_by('id').values(*ROW_FIELDS)[:batch_size])
+            if not batch:
+                break
+            ArchivedTransaction.objects.bulk_create([ArchivedTransaction(**row) for row in batch])
+            moved += len(batch)
+            last_id = batch[-1]['id']
+
+        summaries = rows.values('customer_id', 'type').annotate(total=Sum('amount'), count=Count('id')).order_by()
+        existing = {
+            (period.customer_id, period.type): period
+            for period in LedgerPeriod.objects.select_for_update().filter(period=month)
+        }
+        created = []
+        for row in summaries:
+            period = existing.get((row['customer_id'], row['type']))
+            if period is None:
+                created.append(LedgerPeriod(
+                    customer_id=row['customer_id'], period=month, type=row['type'],
+                    total=row['total'], count=row['count'],
+                ))
+            else:
+                period.total += row['total']
+                period.count += row['count']
+                period.save(update_fields=['total', 'count'])
+        LedgerPeriod.objects.bulk_create(created)
+        rows.delete()
+    logger.info('Archived ledger month', extra={'event': 'ledger.archive', 'month': f'{month:%Y-%m}', 'rows': moved})
+    return moved
+
+
+def archive_closed_months(days=None, batch_size=2000):
+    """Archive every month that ended more than ``days`` ago; returns ``{month: rows}``."""
+    if days is None:
+        days = getattr(settings, 'LEDGER_HOT_DAYS', 90)
+    start, _ = _bounds(cutoff(days))
+    months = Transaction.objects.filter(date__lt=start).dates('date', 'month')
+    return {month: archive_month(month, batch_size) for month in months}
+
+
+# =======================
+# COLD EXPORTS
+# =======================
+
+def archive_dir():
+    return str(getattr(settings, 'LEDGER_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'ledger_archive')))
+
+
+def row_payload(row):
+    return {
+        'id': row['id'],
+        'type': row['type'],
+        'amount': str(row['amount']),
+        'status': row['status'],
+        'description': row['description'],
+        'bank': row['bank'],
+        'date': row['date'].isoformat(),
+    }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _export_groups(rows, previous):
+    """
+    ``(customer_id, payloads)`` per user, newest first, from the archived
+    ``rows`` plus the chunks of the ``previous`` export of the same month.
+    """
+    ordered = rows.order_by('customer_id', '-date', '-id').values(*ROW_FIELDS).iterator(chunk_size=2000)
+    fresh = (
+        (customer_id, [row_payload(row) for row in group])
+        for customer_id, group in itertools.groupby(ordered, key=lambda row: row['customer_id'])
+    )
+    kept = []
+    if previous is not None:
+        kept = ((chunk.customer_id, chunk) for chunk in previous.chunks.select_related('export').order_by('customer_id'))
+    merged = heapq.merge(fresh, kept, key=lambda pair: pair[0])
+    for customer_id, parts in itertools.groupby(merged, key=lambda pair: pair[0]):
+        payloads = []
+        for _, part in parts:
+            payloads.extend(read_chunk(part) if isinstance(part, LedgerExportChunk) else part)
+        payloads.sort(key=lambda row: (datetime.fromisoformat(row['date']), row['id']), reverse=True)
+        yield customer_id, payloads
+
+
+def export_month(month):
+    """
+    Write ``month``'s archived rows to a compressed file and drop them from
+    the archive table. An earlier export of the month is merged into a new
+    file, and its own file removed once the new one is recorded. Returns the
+    ``LedgerExport``, or None if the month has no archived rows.
+    """
+    start, end = _bounds(month)
+    rows = ArchivedTransaction.objects.filter(date__gte=start, date__lt=end)
+    if not rows.exists():
+        return None
+    previous = LedgerExport.objects.filter(period=month).first()
+    directory = archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    temporary = os.path.join(directory, f'ledger-{month:%Y-%m}.jsonl.gz.tmp')
+
+    chunks, digest, total, offset = [], hashlib.sha256(), 0, 0
+    with open(temporary, 'wb') as handle:
+        for customer_id, payloads in _export_groups(rows, previous):
+            lines = [json.dumps(payload, separators=(',', ':')) for payload in payloads]
+            member = gzip.compress(('\n'.join(lines) + '\n').encode(), mtime=0)
+            handle.write(member)
+            digest.update(member)
+            chunks.append(LedgerExportChunk(customer_id=customer_id, offset=offset, length=len(member), rows=len(lines)))
+            offset += len(member)
+            total += len(lines)
+    # A merged export gets its own name: the previous file stays intact
+    # until the rows pointing into it are replaced.
+    name = f'ledger-{month:%Y-%m}.jsonl.gz'
+    if previous is not None:
+        name = f'ledger-{month:%Y-%m}-{digest.hexdigest()[:12]}.jsonl.gz'
+    os.replace(temporary, os.path.join(directory, name))
+
+    with transaction.atomic():
+        export, _ = LedgerExport.objects.update_or_create(period=month, defaults={
+            'path': name, 'rows': total, 'size': offset, 'sha256': digest.hexdigest(),
+        })
+        export.chunks.all().delete()
+        for chunk in chunks:
+            chunk.export = export
+        LedgerExportChunk.objects.bulk_create(chunks)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS "{_partition(month)}"')
+        else:
+            rows.delete()
+        if previous is not None and previous.path != name:
+            transaction.on_commit(partial(_remove, os.path.join(directory, previous.path)))
+    logger.info('Exported ledger month', extra={
+        'event': 'ledger.export', 'month': f'{month:%Y-%m}', 'rows': total, 'bytes': offset,
+        'merged': previous is not None,
+    })
+    return export
+
+
+def export_closed_months(days=None):
+    """Export every archived month that ended more than ``days`` ago."""
+    if days is None:
+        days = getattr(settings, 'LEDGER_EXPORT_DAYS', 365)
+    start, _ = _bounds(cutoff(days))
+    months = ArchivedTransaction.objects.filter(date__lt=start).dates('date', 'month')
+    return {month: export_month(month) for month in months}
+
+
+def read_chunk(chunk):
+    """The rows of one user's gzip member in an export file."""
+    with open(os.path.join(archive_dir(), chunk.export.path), 'rb') as handle:
+        handle.seek(chunk.offset)
+        data = gzip.decompress(handle.read(chunk.length))
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+# =======================
+# HISTORY
+# =======================
+
+def history(user_id, month=None):
+    """
+    Yield the user's archived and exported transactions as API dicts,
+    newest first, one month at a time. ``month`` limits it to that month.
+    """
+    periods = LedgerPeriod.objects.filter(customer_id=user_id)
+    if month is not None:
+        periods = periods.filter(period=month)
+    exported = {
+        chunk.export.period: chunk
+        for chunk in LedgerExportChunk.objects.filter(customer_id=user_id).select_related('export')
+    }
+    for period in periods.order_by('-period').values_list('period', flat=True).distinct():
+        if period in exported:
+            yield from read_chunk(exported[period])
+            continue
+        start, end = _bounds(period)
+        rows = ArchivedTransaction.objects.filter(customer_id=user_id, date__gte=start, date__lt=end)
+        for row in rows.order_by('-date', '-id').values(*ROW_FIELDS).iterator(chunk_size=500):
+            yield row_payload(row)
@@ -0,0 +1,452 @@
+"""
+In-process load testing against the ASGI application.
+
+Virtual users drive ``dog.asgi.application`` through ``httpx.ASGITransport``,
+and websocket clients through ``WebsocketCommunicator`` or raw sockets, so
+a run needs no external load tool. Results are plain dicts ready to be
+dumped as JSON and compared across commits.
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import resource
+import struct
+import subprocess
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+
+BASE_URL = 'https://localhost'
+
+
+# =======================
+# STATISTICS
+# =======================
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(seconds):
+    """p50/p95/p99/max in milliseconds of a list of durations."""
+    values = sorted(seconds)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def rss_bytes(pid='self'):
+    """Resident set size of ``pid``, from /proc where available."""
+    try:
+        with open(f'/proc/{pid}/status') as fh:
+            for line in fh:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == 'self':
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+class LatencyRecorder:
+    """Per-label latency samples and status counts."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, label, seconds, status='ok'):
+        self.samples[label].append(seconds)
+        self.statuses[label][str(status)] += 1
+
+    def summary(self, elapsed):
+        report = {}
+        for label in sorted(self.samples):
+            values = self.samples[label]
+            report[label] = {
+                **latency_summary(values),
+                'throughput_rps': round(len(values) / elapsed, 2) if elapsed else None,
+                'statuses': dict(self.statuses[label]),
+            }
+        return report
+
+
+def git_revision():
+    """Commit the run was taken on, so reports can be lined up across commits."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# =======================
+# JOURNEYS
+# =======================
+
+class VirtualUser:
+    """One logged-in client replaying journeys against the app."""
+
+    def __init__(self, client, recorder, account, rng):
+        self.client = client
+        self.recorder = recorder
+        self.account = account
+        self.rng = rng
+        self.headers = {}
+
+    async def request(self, method, path, **kwargs):
+        start = time.perf_counter()
+        response = await self.client.request(method, path, headers=self.headers, **kwargs)
+        self.recorder.record(f'{method} {path}', time.perf_counter() - start, response.status_code)
+        return response
+
+    async def login(self):
+        response = await self.request('POST', '/api/auth/login/', json={
+            'username': self.account['username'], 'password': self.account['password'],
+        })
+        if response.status_code == 200:
+            self.headers = {'Authorization': f'Token {response.json()["token"]}'}
+        return response
+
+    async def dashboard(self):
+        await self.request('GET', '/api/dashboard/')
+
+    async def claim(self):
+        if self.account['projects']:
+            await self.request('POST', '/api/main-projects/claim/', json={
+                'project_id': self.rng.choice(self.account['projects']),
+            })
+
+    async def invest(self):
+        if self.account['catalog']:
+            await self.request('POST', '/api/main-projects/invest/', json={
+                'project_id': self.rng.choice(self.account['catalog']), 'units': 1,
+            })
+
+    async def chat_poll(self):
+        await self.request('GET', '/api/chat/')
+
+
+JOURNEYS = {
+    'login': VirtualUser.login,
+    'dashboard': VirtualUser.dashboard,
+    'claim': VirtualUser.claim,
+    'invest': VirtualUser.invest,
+    'chat_poll': VirtualUser.chat_poll,
+}
+
+
+# =======================
+# RUNNER
+# =======================
+
+async def run_http_load(app, accounts, journeys, concurrency, iterations=None, duration=None, seed=None):
+    """
+    Run ``concurrency`` virtual users, each logging in once and then
+    replaying randomly chosen ``journeys`` until it has done ``iterations``
+    of them or ``duration`` seconds have passed. Returns the JSON report.
+    """
+    recorder = LatencyRecorder()
+    rng = random.Random(seed)
+    deadline = time.perf_counter() + duration if duration else None
+    steps = [JOURNEYS[name] for name in journeys]
+
+    async def worker(account, worker_rng):
+        user = VirtualUser(client, recorder, account, worker_rng)
+        await user.login()
+        done = 0
+        while (iterations is None or done < iterations) and (deadline is None or time.perf_counter() < deadline):
+            journey = worker_rng.choice(steps)
+            start = time.perf_counter()
+            await journey(user)
+            recorder.record(f'journey:{journey.__name__}', time.perf_counter() - start)
+            done += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url=BASE_URL) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(accounts[i % len(accounts)], random.Random(rng.random()))
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    total = sum(len(v) for label, v in recorder.samples.items() if not label.startswith('journey:'))
+    return {
+        'commit': git_revision(),
+        'concurrency': concurrency,
+        'journeys': list(journeys),
+        'elapsed_s': round(elapsed, 3),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+        'routes': recorder.summary(elapsed),
+    }
+
+
+# =======================
+# WEBSOCKET CLIENTS
+# =======================
+
+class CommunicatorClient:
+    """In-process websocket client on ``channels.testing.WebsocketCommunicator``."""
+
+    def __init__(self, app, path):
+        from channels.testing import WebsocketCommunicator
+
+        self.communicator = WebsocketCommunicator(app, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise ConnectionError('websocket handshake rejected')
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self, timeout):
+        return await self.communicator.receive_from(timeout=timeout)
+
+    async def close(self):
+        # A receive timeout cancels the application; there is nothing left to close.
+        if not self.communicator.future.done():
+            await self.communicator.disconnect()
+
+
+class RawSocketClient:
+    """
+    Minimal RFC 6455 client over asyncio streams, for driving a separately
+    running daphne/uvicorn without any websocket library on the client side.
+    Only text frames are supported; pings are answered, close ends the read.
+    """
+
+    def __init__(self, base_url, path):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'wss' else 80)
+        self.ssl = parts.scheme == 'wss'
+        self.path = '/' + path.lstrip('/')
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            f'GET {self.path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'
+        ).encode())
+        await self.writer.drain()
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        if not head.startswith(b'HTTP/1.1 101'):
+            raise ConnectionError(head.split(b'\r\n', 1)[0].decode(errors='replace'))
+
+    def _frame(self, opcode, payload):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    async def send(self, text):
+        self.writer.write(self._frame(0x1, text.encode()))
+        await self.writer.drain()
+
+    async def _read_frame(self):
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack('!H', await self.reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await self.reader.readexactly(8))
+        return first & 0x80, first & 0x0F, await self.reader.readexactly(length)
+
+    async def _read_message(self):
+        parts = []
+        while True:
+            fin, opcode, payload = await self._read_frame()
+            if opcode == 0x8:
+                raise ConnectionError('server closed the connection')
+            if opcode == 0x9:
+                self.writer.write(self._frame(0xA, payload))
+                continue
+            if opcode == 0xA:
+                continue
+            parts.append(payload)
+            if fin:
+                return b''.join(parts).decode()
+
+    async def receive(self, timeout):
+        return await asyncio.wait_for(self._read_message(), timeout)
+
+    async def close(self):
+        try:
+            self.writer.write(self._frame(0x8, struct.pack('!H', 1000)))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+async def open_clients(factory, count, ramp_batch=500):
+    """Connect ``count`` clients in batches; returns them with per-connect latencies."""
+    clients, connect_times = [], []
+
+    async def connect_one():
+        client = factory()
+        start = time.perf_counter()
+        await client.connect()
+        connect_times.append(time.perf_counter() - start)
+        return client
+
+    for offset in range(0, count, ramp_batch):
+        clients += await asyncio.gather(*(connect_one() for _ in range(min(ramp_batch, count - offset))))
+    return clients, connect_times
+
+
+# =======================
+# WEBSOCKET SCENARIOS
+# =======================
+
+async def run_chat_fanout(factory, connections, senders, messages, interval=0.05, timeout=10.0, rss=rss_bytes):
+    """
+    Open ``connections`` chat sockets, let ``senders`` of them each post
+    ``messages`` messages, and time how long every broadcast takes to reach
+    every socket. ``complete`` is the time until the last socket got a
+    message; frames lost to full channel-layer queues show up as the gap
+    between ``frames_expected`` and ``frames_received``.
+    """
+    rss_before = rss()
+    clients, connect_times = await open_clients(factory, connections)
+    rss_after = rss()
+
+    sent_at = {}
+    arrivals = defaultdict(list)
+    expected = senders * messages
+
+    async def read(client):
+        received = 0
+        while received < expected:
+            try:
+                frame = json.loads(await client.receive(timeout))
+            except (asyncio.TimeoutError, ConnectionError):
+                return
+            if frame.get('type') not in (None, 'batch'):
+                continue  # history on join or a persistence confirmation
+            now = time.perf_counter()
+            batch = frame['messages'] if frame.get('type') == 'batch' else [frame]
+            for item in batch:
+                arrivals[item['message']].append(now)
+            received += len(batch) + frame.get('skipped', 0)
+
+    async def send(client, sender):
+        for n in range(messages):
+            key = f'{sender}:{n}'
+            sent_at[key] = time.perf_counter()
+            await client.send(json.dumps({'message': key, 'sender': f'load-{sender}'}))
+            await asyncio.sleep(interval)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(read(client) for client in clients),
+        *(send(clients[i], i) for i in range(min(senders, connections))),
+    )
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*(client.close() for client in clients))
+
+    latencies = [t - sent_at[key] for key, times in arrivals.items() for t in times]
+    complete = [max(times) - sent_at[key] for key, times in arrivals.items()]
+    received = len(latencies)
+    return {
+        'consumer': 'chat',
+        'connections': connections,
+        'senders': senders,
+        'messages_per_sender': messages,
+        'connect': latency_summary(connect_times),
+        'fanout_latency': latency_summary(latencies),
+        'fanout_complete': latency_summary(complete),
+        'frames_expected': expected * connections,
+        'frames_received': received,
+        'frames_per_s': round(received / elapsed, 2) if elapsed else None,
+        'elapsed_s': round(elapsed, 3),
+        **_rss_report(rss_before, rss_after, connections),
+    }
+
+
+async def run_aviator_rounds(factory, connections, rounds=1, tick=0.1, timeout=10.0, rss=rss_bytes):
+    """
+    Open ``connections`` aviator sockets and play ``rounds`` games on each.
+    ``tick_lag`` is how far each multiplier frame arrived behind the
+    consumer's nominal ``tick``, the number that degrades first when a
+    worker holds too many sockets.
+    """
+    rss_before = rss()
+    clients, connect_times = await open_clients(factory, connections)
+    rss_after = rss()
+
+    lags = []
+    frames = 0
+
+    async def play(client):
+        nonlocal frames
+        try:
+            await client.receive(timeout)  # greeting
+            for _ in range(rounds):
+                await client.send(json.dumps({'action': 'start'}))
+                previous = time.perf_counter()
+                while True:
+                    frame = json.loads(await client.receive(timeout))
+                    now = time.perf_counter()
+                    frames += 1
+                    if 'crash' in frame:
+                        break
+                    if frame['multiplier'] > 1.0:
+                        lags.append(max(0.0, now - previous - tick))
+                    previous = now
+        except (asyncio.TimeoutError, ConnectionError):
+            return
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play(client) for client in clients))
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*(client.close() for client in clients))
+
+    return {
+        'consumer': 'aviator',
+        'connections': connections,
+        'rounds': rounds,
+        'connect': latency_summary(connect_times),
+        'tick_lag': latency_summary(lags),
+        'frames_received': frames,
+        'frames_per_s': round(frames / elapsed, 2) if elapsed else None,
+        'elapsed_s': round(elapsed, 3),
+        **_rss_report(rss_before, rss_after, connections),
+    }
+
+
+def _rss_report(before, after, connections):
+    if before is None or after is None:
+        return {'rss_bytes': None, 'rss_per_connection_bytes': None}
+    return {'rss_bytes': after, 'rss_per_connection_bytes': round((after - before) / connections)}
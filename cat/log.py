@@ -0,0 +1,146 @@
+"""
+Structured, non-blocking logging.
+
+Application loggers write to ``QueuedHandler``, which only puts the record
+on an in-memory queue; a ``QueueListener`` thread formats it as one JSON
+line and does the actual stream/file I/O. A full queue drops the record
+instead of blocking, so neither the websocket event loop nor request
+threads ever wait on log output.
+
+High-frequency events are tagged with ``extra={'event': ...}`` and thinned
+out by ``SamplingFilter``.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else came in through ``extra``.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def mask_phone(phone):
+    """``phone`` with all but its last two digits starred out, for log lines."""
+    phone = str(phone or '')
+    return '*' * max(len(phone) - 2, 0) + phone[-2:]
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with ``extra`` fields at the top level."""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of records for the events listed in ``rates``,
+    e.g. ``{'chat.receive': 0.01}``. Warnings and errors are always kept;
+    kept records carry ``sample_rate`` so counts can be scaled back up.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class QueuedHandler(QueueHandler):
+    """
+    Enqueue records for a background listener that writes JSON lines to
+    ``stream`` and, from ``file_level`` up, to ``filename``.
+    """
+
+    def __init__(self, stream=None, filename=None, file_level='ERROR', queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        formatter = JsonFormatter()
+        targets = [logging.StreamHandler(stream or sys.stderr)]
+        if filename:
+            file_handler = logging.FileHandler(filename, delay=True)
+            file_handler.setLevel(file_level)
+            targets.append(file_handler)
+        for target in targets:
+            target.setFormatter(formatter)
+        self.listener = QueueListener(self.queue, *targets, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self._stop_listener)
+
+    def prepare(self, record):
+        # Resolve the message and traceback in the caller, but leave JSON
+        # formatting and I/O to the listener thread.
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(vars(record))
+        record.msg, record.args = message, None
+        record.exc_info, record.exc_text = None, exc_text
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def restart(self):
+        """
+        Start a fresh queue and listener thread. A forked child gets a copy
+        of the queue but not the parent's listener, so it must call this.
+        """
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.listener = QueueListener(self.queue, *self.listener.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def _stop_listener(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self._stop_listener()
+        super().close()
+
+
+def restart_after_fork():
+    """
+    Restart every ``QueuedHandler`` in a forked child process (for example
+    as a ``ProcessPoolExecutor`` initializer) and flush it when the child
+    exits. Without this the child's records are queued but never written.
+    """
+    from multiprocessing import util
+
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values() if isinstance(logger, logging.Logger)
+    ]
+    handlers = {handler for logger in loggers for handler in logger.handlers if isinstance(handler, QueuedHandler)}
+    for handler in handlers:
+        handler.restart()
+        # Pool children leave through os._exit, which skips atexit.
+        util.Finalize(handler, handler._stop_listener, exitpriority=10)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cat import ledger
+
+
+class Command(BaseCommand):
+    help = (
+        'Move transactions from closed months into the archive (per-user period totals keep balances '
+        'unchanged) and export old archived months to compressed files. See cat/ledger.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=None,
+                            help='Days of history to keep in Transaction (default LEDGER_HOT_DAYS)')
+        parser.add_argument('--export', action='store_true', help='Also export old archived months')
+        parser.add_argument('--export-days', type=int, default=None,
+                            help='Archived months older than this are exported (default LEDGER_EXPORT_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        archived = ledger.archive_closed_months(options['keep_days'], options['batch_size'])
+        for month, rows in archived.items():
+            self.stdout.write(f'Archived {month:%Y-%m}: {rows} transactions')
+        if options['export']:
+            for month, export in ledger.export_closed_months(options['export_days']).items():
+                if export is not None:
+                    self.stdout.write(f'Exported {month:%Y-%m}: {export.rows} rows, {export.size} bytes -> {export.path}')
+        if not archived and not options['export']:
+            self.stdout.write('Nothing to archive')
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand, CommandError
+
+from cat.loadtest import git_revision, latency_summary
+from chat.layers import PostgresChannelLayer, UnixSocketChannelLayer
+
+GROUP = 'bench'
+
+
+def build_layer(backend, capacity, path):
+    if backend == 'memory':
+        return InMemoryChannelLayer(capacity=capacity)
+    if backend == 'unix':
+        return UnixSocketChannelLayer(path=path, capacity=capacity)
+    return PostgresChannelLayer(capacity=capacity)
+
+
+async def collect(layer, channels, messages, timeout):
+    """Receive on every channel until ``messages`` arrived or it went idle; returns latencies."""
+    latencies = []
+
+    async def drain(channel):
+        for _ in range(messages):
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), timeout)
+            except asyncio.TimeoutError:
+                return
+            latencies.append(time.monotonic() - message['sent'])
+
+    await asyncio.gather(*(drain(channel) for channel in channels))
+    return latencies
+
+
+async def join_group(layer, receivers):
+    channels = [await layer.new_channel() for _ in range(receivers)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    return channels
+
+
+def worker(backend, capacity, path, receivers, messages, timeout, ready, results):
+    async def main():
+        layer = build_layer(backend, capacity, path)
+        channels = await join_group(layer, receivers)
+        ready.put(os.getpid())
+        latencies = await collect(layer, channels, messages, timeout)
+        await layer.close()
+        results.put(latencies)
+
+    asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark channel layers: one process group_sends to receivers in itself and in '
+        'worker processes, and the report gives send throughput, delivery latency and the '
+        'share of frames that reached each side. The in-memory layer shows the '
+        'single-process limit; unix and postgres fan out across processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default='memory,unix',
+                            help='Comma-separated subset of memory, unix, postgres.')
+        parser.add_argument('--processes', type=int, default=2, help='Receiver worker processes.')
+        parser.add_argument('--receivers', type=int, default=50, help='Group members per process.')
+        parser.add_argument('--messages', type=int, default=500, help='group_send calls.')
+        parser.add_argument('--timeout', type=float, default=3.0,
+                            help='Seconds a receiver waits for the next message before giving up.')
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        backends = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        unknown = set(backends) - {'memory', 'unix', 'postgres'}
+        if unknown:
+            raise CommandError(f'Unknown backends: {", ".join(sorted(unknown))}')
+
+        report = {'commit': git_revision(), 'results': [self._bench(backend, options) for backend in backends]}
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output)
+        self.stdout.write(output)
+
+    def _bench(self, backend, options):
+        processes, receivers, messages = options['processes'], options['receivers'], options['messages']
+        capacity = messages + 1  # measure fan-out, not per-channel queue limits
+        path = tempfile.mkdtemp(prefix='channels-bench-')
+        context = multiprocessing.get_context('fork')
+        ready, results = context.Queue(), context.Queue()
+
+        # Workers are forked before this process starts an event loop.
+        children = [
+            context.Process(target=worker, args=(
+                backend, capacity, path, receivers, messages, options['timeout'], ready, results,
+            ))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        for _ in children:
+            ready.get(timeout=30)
+
+        local, elapsed, stats = asyncio.run(self._send(backend, capacity, path, options))
+
+        remote = []
+        for _ in children:
+            try:
+                remote += results.get(timeout=options['timeout'] + 30)
+            except queue.Empty:
+                break
+        for child in children:
+            child.join(timeout=5)
+            if child.is_alive():
+                child.terminate()
+        shutil.rmtree(path, ignore_errors=True)
+
+        expected = messages * receivers
+        return {
+            'backend': backend,
+            'processes': processes,
+            'receivers_per_process': receivers,
+            'messages': messages,
+            'send_throughput_msgs_s': round(messages / elapsed, 2) if elapsed else None,
+            'local': {**latency_summary(local), 'delivery_ratio': round(len(local) / expected, 4)},
+            'remote': {
+                **latency_summary(remote),
+                'delivery_ratio': round(len(remote) / (expected * processes), 4) if processes else None,
+            },
+            'layer_stats': stats,
+        }
+
+    async def _send(self, backend, capacity, path, options):
+        layer = build_layer(backend, capacity, path)
+        channels = await join_group(layer, options['receivers'])
+        receiving = asyncio.ensure_future(collect(layer, channels, options['messages'], options['timeout']))
+
+        started = time.monotonic()
+        for n in range(options['messages']):
+            await layer.group_send(GROUP, {'type': 'bench.message', 'sent': time.monotonic()})
+            if n % 50 == 0:
+                await asyncio.sleep(0)
+        elapsed = time.monotonic() - started
+
+        local = await receiving
+        await layer.close()
+        return local, elapsed, getattr(layer, 'stats', None)
@@ -0,0 +1,62 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cat import outbox, realtime
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Tail the outbox and feed new events, in order and in batches, to the '
+        'registered handlers (websocket pushes and other side effects).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handlers', nargs='+', help='Handlers to run (default: all registered)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=0.2,
+                            help='Seconds to sleep when every handler is caught up')
+        parser.add_argument('--once', action='store_true', help='Drain what is there now and exit')
+        parser.add_argument('--from-start', action='store_true',
+                            help='Start new cursors at the beginning of the log instead of its end')
+
+    def handle(self, *args, **options):
+        names = options['handlers'] or sorted(outbox.HANDLERS)
+        unknown = [name for name in names if name not in outbox.HANDLERS]
+        if unknown:
+            raise CommandError(f"Unknown outbox handler(s): {', '.join(unknown)}. "
+                               f"Registered: {', '.join(sorted(outbox.HANDLERS))}")
+        if 'realtime' in names and not realtime.layer_is_shared():
+            raise CommandError(
+                'The realtime handler needs a channel layer shared between processes '
+                '(CHANNEL_LAYER=unix or postgres); with the in-memory layer each write '
+                'pushes its own events on commit. Use --handlers to run the others.'
+            )
+        for name in names:
+            outbox.get_cursor(name, from_start=options['from_start'])
+
+        handled = dict.fromkeys(names, 0)
+        try:
+            while True:
+                busy = False
+                for name in names:
+                    try:
+                        count = outbox.dispatch(name, batch_size=options['batch_size'])
+                    except Exception:
+                        # Cursor not moved; the batch is retried on the next pass.
+                        logger.exception('Outbox handler failed', extra={'event': 'outbox.error', 'handler': name})
+                        count = 0
+                    handled[name] += count
+                    busy = busy or count == options['batch_size']
+                if not busy:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        for name in names:
+            self.stdout.write(f'{name}: {handled[name]} events')
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cat.loadtest import JOURNEYS, run_http_load
+from cat.models import MainProject, User, UserMainProject
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the ASGI app in-process through httpx with concurrent virtual users '
+        'replaying login, dashboard, claim, invest and chat poll journeys, and print '
+        'p50/p95/p99 latency and throughput per route as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--iterations', type=int, default=None,
+                            help='Journeys per virtual user.')
+        parser.add_argument('--duration', type=float, default=None,
+                            help='Run for this many seconds instead of a fixed number of journeys.')
+        parser.add_argument('--journeys', default=','.join(JOURNEYS),
+                            help=f'Comma-separated subset of: {", ".join(JOURNEYS)}.')
+        parser.add_argument('--prefix', default='load',
+                            help='Username prefix of the accounts to log in as (see seed_load).')
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        journeys = [name.strip() for name in options['journeys'].split(',') if name.strip()]
+        unknown = set(journeys) - set(JOURNEYS)
+        if unknown:
+            raise CommandError(f'Unknown journeys: {", ".join(sorted(unknown))}')
+        if options['iterations'] is None and options['duration'] is None:
+            options['iterations'] = 50
+
+        accounts = self._accounts(options['prefix'], options['password'], options['concurrency'])
+        if not accounts:
+            raise CommandError(f'No users prefixed "{options["prefix"]}-"; run seed_load first.')
+
+        from dog.asgi import application
+
+        report = asyncio.run(run_http_load(
+            application, accounts, journeys, options['concurrency'],
+            iterations=options['iterations'], duration=options['duration'], seed=options['seed'],
+        ))
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output)
+        self.stdout.write(output)
+
+    def _accounts(self, prefix, password, limit):
+        """Credentials plus the project ids each virtual user can claim and buy."""
+        users = list(
+            User.objects.filter(username__startswith=f'{prefix}-').order_by('pk').values_list('pk', 'username')[:limit]
+        )
+        held = {}
+        for user_id, project_id in UserMainProject.objects.filter(
+            user_id__in=[pk for pk, _ in users], status='active',
+        ).values_list('user_id', 'main_project_id'):
+            held.setdefault(user_id, []).append(project_id)
+        catalog = list(MainProject.objects.filter(
+            is_active=True, status='available', available_units__gt=0,
+        ).values_list('pk', flat=True))
+        return [
+            {'username': username, 'password': password, 'projects': held.get(pk, []), 'catalog': catalog}
+            for pk, username in users
+        ]
@@ -0,0 +1,64 @@
+import csv
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare Profile.balance and Balance.amount with the figure expected from every recorded money '
+        'movement for every user and report the drift. Nothing is written. See cat/reconciliation.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Users per batch of queries')
+        parser.add_argument('--tolerance', type=Decimal, default=Decimal('0'),
+                            help='Ignore differences up to this amount (ETB)')
+        parser.add_argument('--top', type=int, default=20, help='List the users with the largest drift')
+        parser.add_argument('--csv', help='Write every drifted user to this CSV file')
+
+    def handle(self, *args, **options):
+        try:
+            from cat import reconciliation
+        except ImportError as exc:
+            raise CommandError(f'reconcile_balances needs numpy ({exc}); pip install -r requirements.txt')
+
+        def money(cents):
+            return '-' if cents is None else str(reconciliation.from_cents(cents))
+
+        on_drift = writer = None
+        handle = open(options['csv'], 'w', newline='') if options['csv'] else None
+        if handle:
+            writer = csv.writer(handle)
+            writer.writerow(['user_id', 'expected', 'profile_balance', 'balance_amount'])
+
+            def on_drift(user_id, expected, profile, balance):
+                writer.writerow([user_id, money(expected), money(profile), money(balance)])
+
+        started = time.monotonic()
+        try:
+            report = reconciliation.reconcile(
+                chunk_size=options['chunk_size'],
+                tolerance=int(options['tolerance'] * 100),
+                top=options['top'],
+                on_drift=on_drift,
+            )
+        finally:
+            if handle:
+                handle.close()
+
+        self.stdout.write(f'Users scanned: {report.users} in {time.monotonic() - started:.1f}s')
+        self.stdout.write(
+            f'Profile.balance drift: {report.profile_drift} users, '
+            f'{money(report.profile_drift_total)} ETB in total ({report.missing_profiles} users without a profile)'
+        )
+        self.stdout.write(
+            f'Balance.amount drift: {report.balance_drift} users, '
+            f'{money(report.balance_drift_total)} ETB in total ({report.missing_balances} missing rows)'
+        )
+        self.stdout.write(f'available_balance above balance: {report.available_over_balance} users')
+        if report.worst:
+            self.stdout.write('Largest drift (user: expected / profile / balance):')
+            for _, user_id, expected, profile, balance in report.worst:
+                self.stdout.write(f'  {user_id}: {money(expected)} / {money(profile)} / {money(balance)}')
@@ -0,0 +1,85 @@
+import logging
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from cat import jobs, log
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps for stale locks and periodic jobs
+MAINTENANCE_INTERVAL = 30
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (cat/jobs.py) on a thread or process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Jobs run at the same time')
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread',
+                            help='Use processes for CPU-bound jobs')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls when idle')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now and exit')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Exit after this many jobs (0 = no limit)')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        processes = options['pool'] == 'process'
+        worker = jobs.worker_id()
+        if processes:
+            connections.close_all()
+            # Forked children don't inherit the log listener thread.
+            executor = ProcessPoolExecutor(concurrency, mp_context=multiprocessing.get_context('fork'),
+                                           initializer=log.restart_after_fork)
+        else:
+            executor = ThreadPoolExecutor(concurrency, thread_name_prefix='job')
+
+        heartbeat_interval = getattr(settings, 'JOB_HEARTBEAT_INTERVAL', 60)
+        outcomes = Counter()
+        running = {}  # future -> job id
+        last_sweep = None
+        last_heartbeat = time.monotonic()
+        logger.info('Worker started', extra={'event': 'jobs.worker', 'worker': worker, 'pool': options['pool']})
+        try:
+            while True:
+                if last_sweep is None or time.monotonic() - last_sweep >= MAINTENANCE_INTERVAL:
+                    jobs.requeue_stale()
+                    jobs.schedule_periodic()
+                    last_sweep = time.monotonic()
+                if running and time.monotonic() - last_heartbeat >= heartbeat_interval:
+                    jobs.heartbeat(list(running.values()), worker)
+                    last_heartbeat = time.monotonic()
+
+                claimed = jobs.claim(concurrency - len(running), worker) if len(running) < concurrency else []
+                if processes:
+                    connections.close_all()  # forked children must not share the parent's socket
+                for job in claimed:
+                    running[executor.submit(jobs.execute, job.id, worker)] = job.id
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                done, _ = wait(running, timeout=0 if claimed else options['interval'],
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    try:
+                        outcomes[future.result()] += 1
+                    except Exception:
+                        logger.exception('Job runner crashed', extra={'event': 'jobs.crash'})
+                        outcomes['crashed'] += 1
+                if options['max_jobs'] and sum(outcomes.values()) >= options['max_jobs']:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            executor.shutdown(wait=True)
+
+        self.stdout.write(', '.join(f'{status}: {count}' for status, count in sorted(outcomes.items())) or 'no jobs')
@@ -0,0 +1,296 @@
+import random
+import string
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from cat import catalog
+from cat.models import (
+    VIP, Balance, GiftCode, GiftRedemption, MainProject, Message, Profile, Transaction,
+    User, UserMainProject, UserVIP, Video,
+)
+
+
+@contextmanager
+def backdated(model, *field_names):
+    """
+    Let ``bulk_create`` keep explicit values for ``auto_now_add`` fields so
+    generated rows can be spread over the past instead of all being "now".
+    """
+    fields = [model._meta.get_field(name) for name in field_names]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a production-sized synthetic dataset with bulk_create: users with '
+        'Profile/Balance in a multi-level invite tree, transactions, VIP and project '
+        'holdings, chat messages, videos and gift redemptions. Per-row save() and '
+        'post_save signals are bypassed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--transactions', type=int, default=1000000)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--videos', type=int, default=2000)
+        parser.add_argument('--fanout', type=int, default=4,
+                            help='Invitees per inviter; controls the depth of the invite tree.')
+        parser.add_argument('--vip-ratio', type=float, default=0.3,
+                            help='Share of users holding a VIP package.')
+        parser.add_argument('--project-ratio', type=float, default=0.5,
+                            help='Share of users holding main projects.')
+        parser.add_argument('--redeem-ratio', type=float, default=0.2,
+                            help='Share of users that redeemed the load-test gift code.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread generated timestamps over this many past days.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='load',
+                            help='Username prefix; must not already be in use.')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for repeatable data.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1.')
+        if options['fanout'] < 1:
+            raise CommandError('--fanout must be at least 1.')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users prefixed "{prefix}-" already exist; pass a different --prefix.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.span = timedelta(days=options['days']).total_seconds()
+
+        with transaction.atomic():
+            user_ids = self._step('users', self._create_users, prefix, options['users'])
+            # Each step that moves money updates ``totals``, so the profiles
+            # written last carry the balance reconcile_balances expects
+            totals = self._step('transactions', self._create_transactions, user_ids, options['transactions'])
+            self._step('VIP holdings', self._create_vip_holdings, user_ids, options['vip_ratio'])
+            self._step('project holdings', self._create_project_holdings, user_ids, totals, options['project_ratio'])
+            self._step('messages', self._create_messages, prefix, len(user_ids), options['messages'])
+            self._step('videos', self._create_videos, user_ids, options['videos'])
+            self._step('gift redemptions', self._create_redemptions, user_ids, totals, options['redeem_ratio'])
+            self._step('profiles and balances', self._create_profiles, user_ids, totals, options['fanout'])
+
+        self.stdout.write(self.style.SUCCESS('Load dataset generated.'))
+
+    # =======================
+    # HELPERS
+    # =======================
+
+    def _step(self, label, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f'{label}: {time.perf_counter() - start:.1f}s')
+        return result
+
+    def _past(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.span)
+
+    def _insert(self, model, rows):
+        """bulk_create an iterable of unsaved instances in fixed-size batches."""
+        batch, created = [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+                created += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+            created += len(batch)
+        return created
+
+    # =======================
+    # USERS, PROFILES AND BALANCES
+    # =======================
+
+    def _create_users(self, prefix, count):
+        password = make_password('loadtest')  # hashing once keeps this step I/O bound
+        self._insert(User, (
+            User(username=f'{prefix}-{i}', phone=f'09{i:08d}', password=password, date_joined=self._past())
+            for i in range(count)
+        ))
+        ids = dict(User.objects.filter(username__startswith=f'{prefix}-').values_list('username', 'id'))
+        return [ids[f'{prefix}-{i}'] for i in range(count)]
+
+    def _invite_codes(self, count):
+        taken = set(Profile.objects.exclude(invite_code=None).values_list('invite_code', flat=True))
+        alphabet = string.ascii_uppercase + string.digits
+        codes = []
+        while len(codes) < count:
+            code = ''.join(self.rng.choices(alphabet, k=6))
+            if code not in taken:
+                taken.add(code)
+                codes.append(code)
+        return codes
+
+    def _create_profiles(self, user_ids, totals, fanout):
+        # User i is invited by user (i - 1) // fanout, which gives a complete
+        # fanout-ary tree rooted at the first user, log_fanout(N) levels deep.
+        codes = self._invite_codes(len(user_ids))
+        self._insert(Profile, (
+            Profile(
+                user_id=user_id,
+                inviter_id=user_ids[(i - 1) // fanout] if i else None,
+                invite_code=codes[i],
+                account_number=f'{1000000 + user_id}',
+                balance=totals.get(user_id, Decimal('0')),
+                available_balance=totals.get(user_id, Decimal('0')),
+            )
+            for i, user_id in enumerate(user_ids)
+        ))
+        self._insert(Balance, (
+            Balance(customer_id=user_id, amount=totals.get(user_id, Decimal('0')))
+            for user_id in user_ids
+        ))
+
+    # =======================
+    # LEDGER
+    # =======================
+
+    def _create_transactions(self, user_ids, count):
+        """Insert ``count`` transactions and return each user's deposit plus profit minus withdraw total."""
+        totals = {}
+        banks = [choice for choice, _ in Transaction.BANK_CHOICES]
+        statuses = [choice for choice, _ in Transaction.STATUS_CHOICES]
+
+        def rows():
+            for _ in range(count):
+                user_id = self.rng.choice(user_ids)
+                amount = Decimal(self.rng.randrange(1000, 500000)) / 100
+                balance = totals.get(user_id, Decimal('0'))
+                kind = self.rng.choices(('deposit', 'withdraw', 'profit'), weights=(5, 2, 3))[0]
+                if kind == 'withdraw' and amount > balance:
+                    kind = 'deposit'
+                if kind == 'withdraw':
+                    totals[user_id] = balance - amount
+                else:
+                    totals[user_id] = balance + amount
+                yield Transaction(
+                    customer_id=user_id, type=kind, amount=amount, bank=self.rng.choice(banks),
+                    status=self.rng.choice(statuses), date=self._past(),
+                )
+
+        with backdated(Transaction, 'date'):
+            self._insert(Transaction, rows())
+        return totals
+
+    # =======================
+    # HOLDINGS
+    # =======================
+
+    def _catalog(self):
+        """Reuse the existing catalog, creating a small one on an empty database."""
+        vips = list(VIP.objects.all())
+        if not vips:
+            vips = VIP.objects.bulk_create([
+                VIP(title=f'VIP {level}', description='', price=Decimal(500 * level),
+                    daily_income=Decimal(20 * level), income_days=30, upgrade=level)
+                for level in range(1, 6)
+            ])
+            catalog.bump_version(VIP)
+        projects = list(MainProject.objects.all())
+        if not projects:
+            projects = MainProject.objects.bulk_create([
+                MainProject(title=f'Load Project {n}', slug=f'load-project-{n}', description='',
+                            price=Decimal(1000 * n), daily_income=Decimal(40 * n),
+                            total_income=Decimal(1200 * n), total_units=100000, available_units=100000)
+                for n in range(1, 11)
+            ])
+            catalog.bump_version(MainProject)
+        return vips, projects
+
+    def _create_vip_holdings(self, user_ids, ratio):
+        vips, _ = self._catalog()
+        self._insert(UserVIP, (
+            UserVIP(user_id=user_id, vip=vip, invested=vip.price, purchase_date=self._past())
+            for user_id in user_ids
+            if self.rng.random() < ratio
+            for vip in [self.rng.choice(vips)]
+        ))
+
+    def _create_project_holdings(self, user_ids, totals, ratio):
+        """Buy projects users can afford, taking the price off ``totals``."""
+        _, projects = self._catalog()
+
+        def rows():
+            for user_id in user_ids:
+                if self.rng.random() >= ratio:
+                    continue
+                for project in self.rng.sample(projects, self.rng.randint(1, min(3, len(projects)))):
+                    units = self.rng.randint(1, 3)
+                    invested = project.price * units
+                    balance = totals.get(user_id, Decimal('0'))
+                    if invested > balance:
+                        continue
+                    totals[user_id] = balance - invested
+                    yield UserMainProject(
+                        user_id=user_id, main_project=project, units=units,
+                        invested_amount=invested, purchase_date=self._past(),
+                    )
+
+        with backdated(UserMainProject, 'purchase_date'):
+            self._insert(UserMainProject, rows())
+
+    # =======================
+    # CHAT, VIDEOS AND GIFTS
+    # =======================
+
+    def _create_messages(self, prefix, user_count, count):
+        self._insert(Message, (
+            Message(
+                sender=f'{prefix}-{self.rng.randrange(user_count)}',
+                content=f'Load test message {n}',
+                timestamp=self._past(),
+            )
+            for n in range(count)
+        ))
+
+    def _create_videos(self, user_ids, count):
+        categories = [choice for choice, _ in Video.CATEGORY_CHOICES]
+        with backdated(Video, 'created_at'):
+            self._insert(Video, (
+                Video(
+                    title=f'Load Video {n}', video_file=f'videos/load/{n}.mp4',
+                    category=self.rng.choice(categories), duration=self.rng.randint(30, 1800),
+                    views=self.rng.randint(0, 50000), likes=self.rng.randint(0, 2000),
+                    uploaded_by_id=self.rng.choice(user_ids), created_at=self._past(),
+                    published_at=self.now,
+                )
+                for n in range(count)
+            ))
+        if count:
+            catalog.bump_version(Video)
+
+    def _create_redemptions(self, user_ids, totals, ratio):
+        redeemers = [user_id for user_id in user_ids if self.rng.random() < ratio]
+        if not redeemers:
+            return
+        per_user = Decimal('10.00')
+        for user_id in redeemers:
+            totals[user_id] = totals.get(user_id, Decimal('0')) + per_user
+        code, _ = GiftCode.objects.get_or_create(
+            code='LOADTEST',
+            defaults={'total_amount': per_user * len(redeemers), 'per_user_amount': per_user},
+        )
+        with backdated(GiftRedemption, 'redeemed_at'):
+            self._insert(GiftRedemption, (
+                GiftRedemption(code=code, user_id=user_id, amount=per_user, redeemed_at=self._past())
+                for user_id in redeemers
+            ))
@@ -0,0 +1,75 @@
+import asyncio
+import json
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cat.loadtest import (
+    CommunicatorClient, RawSocketClient, git_revision, rss_bytes, run_aviator_rounds, run_chat_fanout,
+)
+
+PATHS = {'chat': 'ws/chat/', 'aviator': 'ws/aviator/'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many concurrent websockets to ws/chat/ and ws/aviator/, drive messages '
+        'and report fan-out latency, frames per second and RSS per connection as JSON. '
+        'Runs in-process through WebsocketCommunicator, or with --url against a running '
+        'daphne/uvicorn over raw sockets.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', choices=['chat', 'aviator', 'both'], default='both')
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--senders', type=int, default=10,
+                            help='Chat sockets that post messages; every socket receives them.')
+        parser.add_argument('--messages', type=int, default=10, help='Messages per chat sender.')
+        parser.add_argument('--interval', type=float, default=0.05, help='Seconds between chat sends.')
+        parser.add_argument('--rounds', type=int, default=1, help='Aviator games per socket.')
+        parser.add_argument('--timeout', type=float, default=10.0,
+                            help='Give up on a socket after this many idle seconds.')
+        parser.add_argument('--url', default=None,
+                            help='ws://host:port of a running server; enables raw-socket mode.')
+        parser.add_argument('--server-pid', type=int, default=None,
+                            help='Sample RSS of this server process in raw-socket mode.')
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1:
+            raise CommandError('--connections must be at least 1.')
+        if options['url']:
+            factory = partial(RawSocketClient, options['url'])
+            pid = options['server_pid']
+            rss = partial(rss_bytes, pid) if pid else (lambda: None)
+        else:
+            from dog.asgi import application
+
+            factory = partial(CommunicatorClient, application)
+            rss = rss_bytes
+
+        consumers = ['chat', 'aviator'] if options['consumer'] == 'both' else [options['consumer']]
+        results = []
+        for name in consumers:
+            results.append(asyncio.run(self._run(name, partial(factory, PATHS[name]), rss, options)))
+
+        output = json.dumps({
+            'commit': git_revision(),
+            'mode': 'raw' if options['url'] else 'in-process',
+            'results': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output)
+        self.stdout.write(output)
+
+    def _run(self, name, factory, rss, options):
+        if name == 'chat':
+            return run_chat_fanout(
+                factory, options['connections'], options['senders'], options['messages'],
+                interval=options['interval'], timeout=options['timeout'], rss=rss,
+            )
+        return run_aviator_rounds(
+            factory, options['connections'], rounds=options['rounds'],
+            timeout=options['timeout'], rss=rss,
+        )
@@ -1,4 +1,12 @@
 # middleware.py
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
 class ReferralMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -8,3 +16,96 @@ class ReferralMiddleware:
         if ref:
             request.session["refcode"] = ref
         return self.get_response(request)
+
+
+# =======================
+# PER-ENDPOINT QUERY METRICS
+# =======================
+
+class EndpointMetrics:
+    """Process-local request, query and latency totals per URL name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, queries, db_time, total_time):
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_time': 0.0, 'total_time': 0.0, 'max_time': 0.0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['max_queries'] = max(stats['max_queries'], queries)
+            stats['db_time'] += db_time
+            stats['total_time'] += total_time
+            stats['max_time'] = max(stats['max_time'], total_time)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'requests': s['requests'],
+                    'avg_queries': round(s['queries'] / s['requests'], 2),
+                    'max_queries': s['max_queries'],
+                    'avg_db_ms': round(s['db_time'] * 1000 / s['requests'], 3),
+                    'avg_ms': round(s['total_time'] * 1000 / s['requests'], 3),
+                    'max_ms': round(s['max_time'] * 1000, 3),
+                }
+                for name, s in sorted(self._stats.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+endpoint_metrics = EndpointMetrics()
+
+
+class _QueryRecorder:
+    """execute_wrapper that counts queries and sums their duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class QueryMetricsMiddleware:
+    """
+    Record query count, DB time and total latency for every request that
+    resolves to a named URL. Figures are exposed through the staff-only
+    metrics endpoint, and as X-DB-Queries / X-DB-Time-ms / X-Response-Time-ms
+    headers when QUERY_METRICS_HEADERS is enabled.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = _QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        if match and match.view_name:
+            endpoint_metrics.record(match.view_name, recorder.count, recorder.duration, elapsed)
+
+        if getattr(settings, 'QUERY_METRICS_HEADERS', False):
+            response['X-DB-Queries'] = str(recorder.count)
+            response['X-DB-Time-ms'] = f'{recorder.duration * 1000:.3f}'
+            response['X-Response-Time-ms'] = f'{elapsed * 1000:.3f}'
+        return response
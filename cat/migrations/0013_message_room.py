@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0012_message_image_url_message_is_support_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='room',
+            field=models.CharField(default='public', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp'], name='cat_message_room_3adbbe_idx'),
+        ),
+    ]
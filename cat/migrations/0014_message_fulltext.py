@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-19 15:30
+
+from django.db import migrations
+
+# Full-text index over Message.content, queried by cat/search.py.
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS cat_message_fts USING fts5("
+    "content, content='cat_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER IF NOT EXISTS cat_message_fts_ai AFTER INSERT ON cat_message BEGIN
+        INSERT INTO cat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cat_message_fts_ad AFTER DELETE ON cat_message BEGIN
+        INSERT INTO cat_message_fts(cat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cat_message_fts_au AFTER UPDATE OF content ON cat_message BEGIN
+        INSERT INTO cat_message_fts(cat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO cat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    # Index the messages written before the table existed.
+    "INSERT INTO cat_message_fts(cat_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS cat_message_fts_ai',
+    'DROP TRIGGER IF EXISTS cat_message_fts_ad',
+    'DROP TRIGGER IF EXISTS cat_message_fts_au',
+    'DROP TABLE IF EXISTS cat_message_fts',
+]
+
+POSTGRES_FORWARD = [
+    "CREATE INDEX IF NOT EXISTS cat_message_content_fts ON cat_message "
+    "USING GIN (to_tsvector('simple', content))",
+]
+
+POSTGRES_BACKWARD = [
+    'DROP INDEX IF EXISTS cat_message_content_fts',
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0013_message_room'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            _run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
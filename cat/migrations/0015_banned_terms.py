@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-19 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0014_message_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BannedTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('action', models.CharField(choices=[('mask', 'Mask'), ('flag', 'Flag for review')], default='mask', max_length=10)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['term'],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='is_flagged',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-19 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0018_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['customer', 'type', 'date'], name='cat_transac_custome_40b694_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-19 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0019_transaction_history_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commission',
+            index=models.Index(fields=['user', 'created_at'], name='cat_commiss_user_id_1ef89b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commission',
+            index=models.Index(fields=['user', 'level', 'amount'], name='cat_commiss_user_id_ca8475_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['customer', 'type', 'amount'], name='cat_transac_custome_7e79e7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['customer', 'date'], name='cat_transac_custome_aa56d2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermainproject',
+            index=models.Index(fields=['user', 'purchase_date'], name='cat_usermai_user_id_5ebdae_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermainproject',
+            index=models.Index(fields=['user', 'status', 'invested_amount'], name='cat_usermai_user_id_ccb389_idx'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 6.0 on 2026-10-19 18:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# The archive table is partitioned by month on PostgreSQL, which Django's
+# schema editor can't express; the DDL lives in cat/ledger.py.
+
+
+def create_archive_table(apps, schema_editor):
+    from cat.ledger import install_archive_table
+    install_archive_table(schema_editor, apps.get_model('cat', 'ArchivedTransaction'))
+
+
+def drop_archive_table(apps, schema_editor):
+    from cat.ledger import drop_archive_table
+    drop_archive_table(schema_editor, apps.get_model('cat', 'ArchivedTransaction'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0020_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(unique=True)),
+                ('path', models.CharField(help_text='Relative to LEDGER_ARCHIVE_DIR', max_length=255)),
+                ('rows', models.PositiveIntegerField()),
+                ('size', models.PositiveBigIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-period'],
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ArchivedTransaction',
+                    fields=[
+                        ('pk', models.CompositePrimaryKey('id', 'date', blank=True, editable=False, primary_key=True, serialize=False)),
+                        ('id', models.BigIntegerField()),
+                        ('type', models.CharField(choices=[('deposit', 'Deposit'), ('withdraw', 'Withdraw'), ('profit', 'Profit')], max_length=10)),
+                        ('bank', models.CharField(blank=True, choices=[('cbe', 'CBE'), ('telebirr', 'Telebirr'), ('abay', 'Abay Bank'), ('dashen', 'Dashen Bank')], max_length=20, null=True)),
+                        ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                        ('account_number', models.CharField(blank=True, max_length=50, null=True)),
+                        ('phone_number', models.CharField(blank=True, max_length=20, null=True)),
+                        ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('success', 'success')], max_length=20)),
+                        ('description', models.TextField(blank=True, null=True)),
+                        ('date', models.DateTimeField()),
+                        ('customer', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'indexes': [models.Index(fields=['customer', 'date'], name='cat_archive_customer_date')],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_archive_table, drop_archive_table),
+        migrations.CreateModel(
+            name='LedgerExportChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer_id', models.BigIntegerField()),
+                ('offset', models.PositiveBigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('rows', models.PositiveIntegerField()),
+                ('export', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='cat.ledgerexport')),
+            ],
+            options={
+                'unique_together': {('customer_id', 'export')},
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='First day of the month')),
+                ('type', models.CharField(choices=[('deposit', 'Deposit'), ('withdraw', 'Withdraw'), ('profit', 'Profit')], max_length=10)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('count', models.PositiveIntegerField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_periods', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'type', 'total'], name='cat_ledgerp_custome_ee336a_idx')],
+                'unique_together': {('customer', 'period', 'type')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-19 14:20
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0021_ledger_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Portfolio',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='portfolio', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0022_portfolio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('name', models.CharField(help_text='app_label.model_name', max_length=100, primary_key=True, serialize=False)),
+                ('version', models.CharField(max_length=32)),
+            ],
+        ),
+    ]
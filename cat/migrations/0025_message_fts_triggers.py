@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-19 17:10
+
+from django.db import migrations
+
+# 0015 added Message.is_flagged, which makes SQLite rebuild cat_message and
+# drop the full-text triggers created in 0014. Put them back and reindex
+# the messages written in between. PostgreSQL's GIN index survives.
+SQLITE_FORWARD = [
+    """CREATE TRIGGER IF NOT EXISTS cat_message_fts_ai AFTER INSERT ON cat_message BEGIN
+        INSERT INTO cat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cat_message_fts_ad AFTER DELETE ON cat_message BEGIN
+        INSERT INTO cat_message_fts(cat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cat_message_fts_au AFTER UPDATE OF content ON cat_message BEGIN
+        INSERT INTO cat_message_fts(cat_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO cat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    "INSERT INTO cat_message_fts(cat_message_fts) VALUES ('rebuild')",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0023_catalog_version'),
+    ]
+
+    operations = [
+        # Reversing leaves the triggers in place; 0014's reverse drops them.
+        migrations.RunPython(_run({'sqlite': SQLITE_FORWARD}), migrations.RunPython.noop),
+    ]
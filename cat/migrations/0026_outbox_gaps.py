@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cat', '0025_message_fts_triggers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxcursor',
+            name='gaps',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
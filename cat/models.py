@@ -1,10 +1,11 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.utils import timezone
 from datetime import timedelta
 import random, string
 from django.conf import settings
 from django.core.validators import MinValueValidator, EmailValidator
+from django.core.serializers.json import DjangoJSONEncoder
 
 
 # =======================
@@ -176,6 +177,17 @@ class Transaction(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     description = models.TextField(blank=True, null=True)
     date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Per-user history by type, newest first (recharge_history pages)
+            models.Index(fields=['customer', 'type', 'date']),
+            # Balance sums read amounts straight from the index
+            models.Index(fields=['customer', 'type', 'amount']),
+            # All-type history, newest first (transactions, dashboard)
+            models.Index(fields=['customer', 'date']),
+        ]
+
     def get_description(self, obj):
         """Create description from available data"""
         amount = getattr(obj, 'amount', 0)
@@ -191,6 +203,82 @@ class Transaction(models.Model):
         return f"{self.customer.phone} - {self.type} - {self.amount}"
 
 
+class ArchivedTransaction(models.Model):
+    """
+    A ``Transaction`` from a closed month, moved out of the hot table by
+    ``archive_ledger`` (see cat/ledger.py). On PostgreSQL the table is
+    partitioned by month, so the key includes ``date``. Rows stay when the
+    user is deleted, like the rest of the financial record.
+    """
+    pk = models.CompositePrimaryKey('id', 'date')
+    id = models.BigIntegerField()
+    customer = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+',
+    )
+    type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPES)
+    bank = models.CharField(max_length=20, choices=Transaction.BANK_CHOICES, blank=True, null=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    account_number = models.CharField(max_length=50, blank=True, null=True)
+    phone_number = models.CharField(max_length=20, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=Transaction.STATUS_CHOICES)
+    description = models.TextField(blank=True, null=True)
+    date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'date'], name='cat_archive_customer_date'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.type} {self.amount} ({self.date:%Y-%m-%d})"
+
+
+class LedgerPeriod(models.Model):
+    """Per-user monthly totals of archived transactions; balances add these to the hot table."""
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_periods')
+    period = models.DateField(help_text='First day of the month')
+    type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPES)
+    total = models.DecimalField(max_digits=14, decimal_places=2)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('customer', 'period', 'type')
+        indexes = [
+            models.Index(fields=['customer', 'type', 'total']),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} {self.period:%Y-%m} {self.type}: {self.total}"
+
+
+class LedgerExport(models.Model):
+    """A closed month written to a compressed file and removed from the archive table."""
+    period = models.DateField(unique=True)
+    path = models.CharField(max_length=255, help_text='Relative to LEDGER_ARCHIVE_DIR')
+    rows = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-period']
+
+    def __str__(self):
+        return f"{self.period:%Y-%m} ({self.rows} rows)"
+
+
+class LedgerExportChunk(models.Model):
+    """Where one user's rows sit in an export file: a gzip member at ``offset``."""
+    export = models.ForeignKey(LedgerExport, on_delete=models.CASCADE, related_name='chunks')
+    customer_id = models.BigIntegerField()
+    offset = models.PositiveBigIntegerField()
+    length = models.PositiveIntegerField()
+    rows = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('customer_id', 'export')
+
+
 class Withdrawal(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -356,23 +444,27 @@ class RechargeRequest(models.Model):
             self.verified_at = timezone.now()
             self.processed_at = timezone.now()
             
-            # Update user balance
-            profile = Profile.objects.filter(user=self.user).first()
-            if profile:
-                profile.balance += self.amount
-                profile.available_balance += self.amount
-                profile.save()
-            
-            # Create transaction record
-            Transaction.objects.create(
-                customer=self.user,
-                type='deposit',
-                amount=self.amount,
-                status='success',
-                account_number=profile.account_number if profile else None
-            )
-            
-            self.save()
+            with transaction.atomic():
+                # Update user balance
+                profile = Profile.objects.filter(user=self.user).first()
+                if profile:
+                    profile.balance += self.amount
+                    profile.available_balance += self.amount
+                    profile.save()
+                
+                # Create transaction record
+                Transaction.objects.create(
+                    customer=self.user,
+                    type='deposit',
+                    amount=self.amount,
+                    status='success',
+                    account_number=profile.account_number if profile else None
+                )
+                OutboxEvent.record('recharge.approved', self.user_id, {
+                    'recharge_id': self.pk, 'amount': str(self.amount),
+                })
+                
+                self.save()
             return True
         return False
     
@@ -456,6 +548,13 @@ class Commission(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+            # Per-level commission totals, summed from the index
+            models.Index(fields=['user', 'level', 'amount']),
+        ]
+
     def __str__(self):
         return f"Level {self.level} - {self.user.phone} - {self.amount}"
 
@@ -538,14 +637,43 @@ class Message(models.Model):
     is_support = models.BooleanField(default=False)
     message_type = models.CharField(max_length=20, default='text')  # 'text' or 'image'
     image_url = models.URLField(blank=True, null=True)
+    # 'public', 'topic:<slug>' or 'support:<user_id>' (see chat/rooms.py)
+    room = models.CharField(max_length=100, default='public')
+    # Hit a banned term whose action is 'flag' (see cat/moderation.py)
+    is_flagged = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp']),
+        ]
     
     def __str__(self):
         return f"{self.sender}: {self.content[:50]}"
 
 
+class BannedTerm(models.Model):
+    ACTION_CHOICES = [
+        ('mask', 'Mask'),
+        ('flag', 'Flag for review'),
+    ]
+
+    term = models.CharField(max_length=100, unique=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default='mask')
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['term']
+
+    def save(self, *args, **kwargs):
+        self.term = self.term.strip().lower()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.term} ({self.action})"
+
+
 
 class CustomerMessage(models.Model):
     phone = models.CharField(max_length=20)
@@ -699,6 +827,11 @@ class UserMainProject(models.Model):
     class Meta:
         unique_together = ('user', 'main_project')
         ordering = ['-purchase_date']
+        indexes = [
+            models.Index(fields=['user', 'purchase_date']),
+            # Active investment totals (team stats), summed from the index
+            models.Index(fields=['user', 'status', 'invested_amount']),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.main_project.title} ({self.units} units)"
@@ -797,6 +930,16 @@ class UserMainProject(models.Model):
         super().save(*args, **kwargs)
 
 
+class Portfolio(models.Model):
+    """A user's holdings as served by get_user_investments; rebuilt by cat.portfolio when one changes."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='portfolio')
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Portfolio of {self.user_id}"
+
+
 
 
 
@@ -907,4 +1050,112 @@ class Video(models.Model):
             if size < 1024.0:
                 return f"{size:.2f} {unit}"
             size /= 1024.0
-        return f"{size:.2f} TB"
\ No newline at end of file
+        return f"{size:.2f} TB"
+
+class OutboxEvent(models.Model):
+    """
+    Append-only log of money-moving events, written in the same database
+    transaction as the change itself and tailed by ``dispatch_outbox``
+    (see cat/outbox.py).
+    """
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=50)
+    # Plain id rather than a foreign key: the log outlives deleted users
+    user_id = models.BigIntegerField(null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.id} {self.topic} (user {self.user_id})"
+
+    @classmethod
+    def record(cls, topic, user_id, payload, using=None):
+        return cls.objects.using(using).create(topic=topic, user_id=user_id, payload=payload)
+
+    @classmethod
+    def record_many(cls, events, using=None):
+        """Insert ``(topic, user_id, payload)`` triples in one statement."""
+        now = timezone.now()
+        return cls.objects.using(using).bulk_create([
+            cls(topic=topic, user_id=user_id, payload=payload, created_at=now)
+            for topic, user_id, payload in events
+        ])
+
+
+class OutboxCursor(models.Model):
+    """How far each outbox consumer has read."""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    # {id: epoch seconds} for ids below ``position`` that were read past
+    # before they committed
+    gaps = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+class Job(models.Model):
+    """A unit of background work for ``run_worker`` (see cat/jobs.py)."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.name} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Stored response for an ``Idempotency-Key`` retry (see cat/idempotency.py).
+    Kept small: hashes instead of the raw key and request, no foreign keys.
+    """
+    id = models.BigAutoField(primary_key=True)
+    # sha256 of "<user id>:<header value>"
+    key = models.CharField(max_length=64, unique=True)
+    user_id = models.BigIntegerField()
+    fingerprint = models.CharField(max_length=32)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key[:12]} (user {self.user_id}, {self.status_code})"
+
+
+class CatalogVersion(models.Model):
+    """
+    Version stamp of one catalog model (see cat/catalog.py). Kept in the
+    database so a bump in any process is seen by every other one.
+    """
+    name = models.CharField(max_length=100, primary_key=True, help_text='app_label.model_name')
+    # A fresh random token on every bump, so a stamp is never reused
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.name} {self.version}"
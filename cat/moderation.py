@@ -0,0 +1,174 @@
+"""
+Banned-term filter for chat messages and video metadata.
+
+Staff manage ``BannedTerm`` rows in admin. The active terms are compiled
+once into an Aho-Corasick automaton, so checking a message costs one pass
+over its characters however many terms there are. Each term either
+``mask``s the hit (replaced with ``*``) or ``flag``s the content for review.
+Matching ignores case and only counts whole words, so "class" doesn't trip
+on "ass".
+
+Edits bump the ``BannedTerm`` version stamp, which is kept in the database
+(see ``catalog``). Each process reads it at most every
+MODERATION_RELOAD_INTERVAL seconds and recompiles when it changed.
+``reload_filter`` (the staff reload endpoint) recompiles the process that
+served it right away and bumps the stamp. Every other process therefore
+picks up the change within one interval.
+"""
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from . import catalog
+from .models import BannedTerm
+
+MASK_CHAR = '*'
+
+
+class Automaton:
+    """Aho-Corasick automaton over lower-cased ``terms``."""
+
+    def __init__(self, terms):
+        self.terms = list(terms)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for index, term in enumerate(self.terms):
+            self._insert(term.lower(), index)
+        self._link()
+
+    def _insert(self, term, index):
+        state = 0
+        for char in term:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = following
+        self._out[state] += ((len(term), index),)
+
+    def _link(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                self._out[following] += self._out[self._fail[following]]
+
+    def find(self, text):
+        """Yield ``(start, end, term_index)`` for every whole-word hit."""
+        goto, fail, out = self._goto, self._fail, self._out
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # A few characters lower-case to two ('İ'); keep offsets aligned.
+            lowered = ''.join(char if len(char.lower()) != 1 else char.lower() for char in text)
+        state = 0
+        last = len(text) - 1
+        for position, char in enumerate(lowered):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, index in out[state]:
+                start = position - length + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (
+                        position == last or not text[position + 1].isalnum()):
+                    yield start, position + 1, index
+
+
+@dataclass
+class ModerationResult:
+    text: str
+    flagged: bool = False
+    hits: list = field(default_factory=list)
+
+
+class ContentFilter:
+    def __init__(self, terms, version=None):
+        """``terms`` maps each banned term to its action, 'mask' or 'flag'."""
+        self.version = version
+        self.actions = list(terms.values())
+        self.automaton = Automaton(terms)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def check(self, text):
+        if not text or not self.actions:
+            return ModerationResult(text)
+        hits = list(self.automaton.find(text))
+        if not hits:
+            return ModerationResult(text)
+        result = ModerationResult(text, hits=sorted({self.automaton.terms[index] for _, _, index in hits}))
+        masked = None
+        for start, end, index in hits:
+            if self.actions[index] == 'flag':
+                result.flagged = True
+            else:
+                if masked is None:
+                    masked = list(text)
+                masked[start:end] = MASK_CHAR * (end - start)
+        if masked is not None:
+            result.text = ''.join(masked)
+        return result
+
+
+_filter = None
+_checked_at = 0.0
+
+
+def _reload_interval():
+    return getattr(settings, 'MODERATION_RELOAD_INTERVAL', 5)
+
+
+def compile_filter():
+    """Build a filter from the active banned terms."""
+    version = catalog.get_version(BannedTerm)
+    terms = dict(BannedTerm.objects.filter(is_active=True).values_list('term', 'action'))
+    return ContentFilter(terms, version)
+
+
+def cached_filter():
+    """
+    The compiled filter, or None when it must be (re)built or its stamp
+    re-checked first. Never touches the database, so async code can call
+    it directly and only fall back to ``get_filter`` in a thread when it
+    returns None.
+    """
+    if _filter is None or time.monotonic() - _checked_at >= _reload_interval():
+        return None
+    return _filter
+
+
+def get_filter():
+    """The current filter, re-checking the stamp if the interval has passed."""
+    global _filter, _checked_at
+    current = cached_filter()
+    if current is None:
+        if _filter is None or catalog.get_version(BannedTerm) != _filter.version:
+            _filter = compile_filter()
+        _checked_at = time.monotonic()
+        current = _filter
+    return current
+
+
+def reload_filter():
+    """
+    Recompile in this process now. Bumping the stamp makes the other
+    processes recompile within MODERATION_RELOAD_INTERVAL seconds.
+    """
+    global _filter, _checked_at
+    catalog.bump_version(BannedTerm)
+    _filter = compile_filter()
+    _checked_at = time.monotonic()
+    return _filter
+
+
+def moderate(text):
+    return get_filter().check(text)
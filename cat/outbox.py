@@ -0,0 +1,119 @@
+"""
+Transactional outbox.
+
+Money-moving code writes an ``OutboxEvent`` row inside the same database
+transaction as the change, so an event exists exactly when the change
+committed. Side effects (websocket pushes, rollups, notifications) are
+handlers registered here. The ``dispatch_outbox`` command runs them outside
+the request path.
+
+Each handler has an ``OutboxCursor`` and gets events in id order, in
+batches. Its cursor only moves after the handler returns, so delivery is
+at least once. Handlers must tolerate seeing a batch twice after a crash.
+
+Ids are allocated at insert but become visible at commit, so a reader can
+see id 12 before id 11 commits. The reader stops at such a gap until
+OUTBOX_GAP_GRACE seconds have passed, then reads past it and records the
+missing ids on the cursor. Every later dispatch looks for them again, and an
+event that commits late is delivered with that batch, out of order. An id
+still missing after OUTBOX_GAP_TIMEOUT seconds belonged to a rolled-back
+transaction and is forgotten.
+
+Topics in use:
+
+* ``ledger.transaction`` - a ``Transaction`` row was created.
+* ``notification.recharge`` - a ``RechargeNotification`` was created.
+* ``recharge.approved``, ``vip.purchased``, ``vip.claimed``,
+  ``project.invested``, ``project.claimed`` - the business event behind it.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import OutboxCursor, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(name):
+    """Register ``func(events)`` as the outbox consumer ``name``."""
+    def register(func):
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def record(topic, user_id, payload):
+    """Append an event; call this inside the transaction making the change."""
+    return OutboxEvent.record(topic, user_id, payload)
+
+
+def get_cursor(name, from_start=False):
+    """
+    The cursor for ``name``. A new cursor starts at the current end of the
+    log, unless ``from_start`` asks to replay everything.
+    """
+    position = 0
+    if not from_start:
+        position = OutboxEvent.objects.aggregate(last=Max('id'))['last'] or 0
+    cursor, _ = OutboxCursor.objects.get_or_create(name=name, defaults={'position': position})
+    return cursor
+
+
+def read_batch(position, limit, grace=None):
+    """
+    Committed events after ``position``, stopping at a gap that may still
+    fill. Returns ``(events, skipped)``; ``skipped`` lists the ids of older
+    gaps the batch read past.
+    """
+    if grace is None:
+        grace = getattr(settings, 'OUTBOX_GAP_GRACE', 5)
+    settled = timezone.now() - timedelta(seconds=grace)
+    events, skipped = [], []
+    expected = position + 1
+    for event in OutboxEvent.objects.filter(id__gt=position).order_by('id')[:limit]:
+        if event.id != expected:
+            if event.created_at > settled:
+                break
+            skipped.extend(range(expected, event.id))
+        events.append(event)
+        expected = event.id + 1
+    return events, skipped
+
+
+def dispatch(name, batch_size=500, grace=None):
+    """
+    Feed the next batch of events, plus any skipped ones that have since
+    committed, to handler ``name`` and advance its cursor. Returns how many
+    events were handled.
+    """
+    cursor = get_cursor(name)
+    events, skipped = read_batch(cursor.position, batch_size, grace)
+    gaps = {int(pk): since for pk, since in cursor.gaps.items()}
+    late = list(OutboxEvent.objects.filter(id__in=gaps).order_by('id')) if gaps else []
+    if late or events:
+        HANDLERS[name](late + events)
+
+    now = time.time()
+    expired = now - getattr(settings, 'OUTBOX_GAP_TIMEOUT', 3600)
+    remaining = {pk: since for pk, since in gaps.items() if since > expired}
+    for event in late:
+        remaining.pop(event.id, None)
+    remaining.update(dict.fromkeys(skipped, now))
+    if not events and remaining == gaps:
+        return 0
+    with transaction.atomic():
+        # Only write if no other dispatcher moved the cursor meanwhile.
+        OutboxCursor.objects.filter(pk=cursor.pk, position=cursor.position).update(
+            position=events[-1].id if events else cursor.position,
+            gaps={str(pk): since for pk, since in remaining.items()},
+            updated_at=timezone.now(),
+        )
+    return len(late) + len(events)
@@ -0,0 +1,79 @@
+"""
+Keyset (cursor) pagination for long per-user histories.
+
+Pages are ordered newest first by ``(timestamp, source, id)`` and the next
+page starts strictly after the last row sent. Each page is one indexed
+range scan of ``limit + 1`` rows, whatever the page number, and rows
+inserted meanwhile never shift or repeat a page the way OFFSET does.
+
+The cursor handed to clients is opaque (url-safe base64 of that triple).
+``source`` lets one cursor walk several tables merged into one timeline.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def page_limit(request, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(timestamp, source, pk):
+    raw = json.dumps([timestamp.isoformat(), source, pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """``(timestamp, source, pk)`` from a client cursor, or None for the first page."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, source, pk = json.loads(raw)
+        return datetime.fromisoformat(timestamp), str(source), int(pk)
+    except (ValueError, TypeError):
+        raise ValidationError({'cursor': 'Invalid cursor.'})
+
+
+def after(position, source, time_field, pk_field='id'):
+    """
+    Filter for rows of ``source`` that come after ``position`` in
+    ``(time desc, source desc, pk desc)`` order.
+    """
+    if position is None:
+        return Q()
+    timestamp, cursor_source, pk = position
+    if source < cursor_source:
+        return Q(**{f'{time_field}__lte': timestamp})
+    if source > cursor_source:
+        return Q(**{f'{time_field}__lt': timestamp})
+    return Q(**{f'{time_field}__lt': timestamp}) | Q(**{time_field: timestamp, f'{pk_field}__lt': pk})
+
+
+def merge_pages(streams, limit):
+    """
+    Merge ``(source, rows)`` streams, each already sorted newest first and
+    holding at most ``limit + 1`` rows of ``(timestamp, pk, item)``.
+    Returns the page of items and the cursor for the next one (or None).
+    """
+    merged = sorted(
+        ((timestamp, source, pk, item) for source, rows in streams for timestamp, pk, item in rows),
+        key=lambda row: (row[0], row[1], row[2]),
+        reverse=True,
+    )
+    page = merged[:limit]
+    next_cursor = None
+    if len(merged) > limit:
+        timestamp, source, pk, _ = page[-1]
+        next_cursor = encode_cursor(timestamp, source, pk)
+    return [item for _, _, _, item in page], next_cursor
@@ -0,0 +1,208 @@
+"""
+Per-user portfolio read model.
+
+``get_user_investments`` and the dashboard used to walk the user's
+``UserVIP`` and ``UserMainProject`` rows, load the VIP or project behind
+each one and call ``can_claim()`` on it. The portfolio keeps that work done
+in one ``Portfolio`` row per user: every holding with its catalog figures,
+next claim time and cycle end. What depends on the clock (whether a
+holding can be claimed now, income accrued so far) is worked out from
+those stored timestamps when the payload is served, so the row only
+changes when a holding does.
+
+Purchases and claims save a holding. The signals in ``signals.py`` then
+delete the user's row in the same transaction and rebuild it once the
+transaction commits. Serving is one primary-key lookup that also reads the
+current VIP and main project catalog stamps. The row records the stamps it
+was built with, so an admin edit to a title, price or image makes it
+rebuild on the next read. Units left in a project change with everyone's
+purchases. ``invest_in_project`` decrements them with a plain UPDATE that
+leaves the stamp alone, so ``available_units`` is not stored; it is read
+when serving, in one more query for users holding main projects unless
+the row was rebuilt just now.
+"""
+import logging
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog
+from .models import VIP, MainProject, Portfolio, UserMainProject, UserVIP
+
+logger = logging.getLogger(__name__)
+
+CLAIM_INTERVAL = timedelta(hours=24)
+DAY = 24 * 60 * 60
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _catalog_versions():
+    return '.'.join(catalog.get_versions(VIP, MainProject))
+
+
+def _format(value):
+    return value.strftime(TIME_FORMAT) if value else None
+
+
+# =======================
+# BUILDING
+# =======================
+
+def _holding(item, purchase_date, last_claim_time, days, daily, claimable=True):
+    """
+    Stored form of one holding: the static API ``item`` plus the epoch
+    timestamps ``render`` needs. ``next_claim`` is None once it can no
+    longer be claimed.
+    """
+    next_claim = None
+    if claimable:
+        next_claim = last_claim_time + CLAIM_INTERVAL if last_claim_time else purchase_date
+    cycle_end = purchase_date + timedelta(days=days)
+    item.update({
+        'next_claim_time': _format(next_claim),
+        'cycle_end': _format(cycle_end),
+    })
+    return {
+        'item': item,
+        'start': purchase_date.timestamp(),
+        'next_claim': next_claim.timestamp() if next_claim else None,
+        'days': days,
+        'daily': daily,
+    }
+
+
+def build(user_id, units=None):
+    """
+    The user's portfolio, read from the holdings in two queries. The units
+    left in each project read along the way go into ``units`` when given.
+    """
+    vips = []
+    for user_vip in UserVIP.objects.filter(user_id=user_id).select_related('vip'):
+        vip = user_vip.vip
+        vips.append(_holding({
+            'id': vip.id,
+            'title': vip.title,
+            'price': float(vip.price),
+            'daily_income': float(vip.daily_income),
+            'income_days': vip.income_days,
+            'total_income': float(vip.daily_income * vip.income_days),
+            'purchase_date': user_vip.purchase_date.strftime('%Y-%m-%d'),
+            'last_claim_time': _format(user_vip.last_claim_time),
+            'type': 'vip',
+            'image_url': vip.image_url,
+        }, user_vip.purchase_date, user_vip.last_claim_time, vip.income_days, float(vip.daily_income)))
+
+    main_projects = []
+    for user_project in UserMainProject.objects.filter(user_id=user_id).select_related('main_project'):
+        project = user_project.main_project
+        if units is not None:
+            units[project.id] = project.available_units
+        main_projects.append(_holding({
+            'id': project.id,
+            'title': project.title,
+            'price': float(project.price),
+            'daily_income': float(project.daily_income),
+            'cycle_days': project.cycle_days,
+            'total_income': float(project.total_income),
+            'purchase_date': user_project.purchase_date.strftime('%Y-%m-%d'),
+            'units': user_project.units,
+            'last_claim_time': _format(user_project.last_claim_time),
+            'status': user_project.status,
+            'type': 'main_project',
+            'image_url': project.image_url,
+        }, user_project.purchase_date, user_project.last_claim_time, project.cycle_days,
+            float(project.daily_income * user_project.units), claimable=user_project.status == 'active'))
+
+    return {'catalog': _catalog_versions(), 'vips': vips, 'main_projects': main_projects}
+
+
+def refresh(user_id, units=None):
+    """Rebuild and store the user's portfolio; returns the stored data."""
+    data = build(user_id, units)
+    Portfolio.objects.bulk_create(
+        [Portfolio(user_id=user_id, data=data)],
+        update_conflicts=True, unique_fields=['user'], update_fields=['data', 'updated_at'],
+    )
+    return data
+
+
+def _rebuild(user_id):
+    refresh(user_id)
+    logger.debug('Rebuilt portfolio', extra={'event': 'portfolio.refresh', 'user_id': user_id})
+
+
+def mark_stale(user_id, rebuild=True):
+    """
+    Drop the user's stored portfolio within the current transaction and,
+    if ``rebuild``, build it again once the transaction commits.
+    """
+    Portfolio.objects.filter(user_id=user_id).delete()
+    if rebuild:
+        transaction.on_commit(partial(_rebuild, user_id), robust=True)
+
+
+# =======================
+# SERVING
+# =======================
+
+def render(data, now=None):
+    """The API payload for stored portfolio ``data`` at ``now``."""
+    now = (now or timezone.now()).timestamp()
+
+    def item(holding):
+        result = dict(holding['item'])
+        next_claim = holding['next_claim']
+        elapsed = max(0, int((now - holding['start']) // DAY))
+        if holding['days'] > 0:
+            elapsed = min(elapsed, holding['days'])
+        result['can_claim'] = next_claim is not None and next_claim <= now
+        result['accrued_income'] = round(holding['daily'] * elapsed, 2)
+        return result
+
+    vips = []
+    for holding in data['vips']:
+        vip = item(holding)
+        vip['status'] = 'active' if vip['can_claim'] else 'completed'
+        vips.append(vip)
+    main_projects = [item(holding) for holding in data['main_projects']]
+    return {
+        'vips': vips,
+        'main_projects': main_projects,
+        'total_count': len(vips) + len(main_projects),
+    }
+
+
+def load(user_id, units=None):
+    """
+    Stored portfolio data, read with the catalog stamps in one query; rebuilt
+    when missing or outdated, filling ``units`` as ``build`` does.
+    """
+    row = Portfolio.objects.filter(pk=user_id).annotate(
+        vip_version=catalog.version_subquery(VIP),
+        project_version=catalog.version_subquery(MainProject),
+    ).values_list('data', 'vip_version', 'project_version').first()
+    if row is not None:
+        data, *stamps = row
+        if None not in stamps and data['catalog'] == '.'.join(stamps):
+            return data
+    return refresh(user_id, units)
+
+
+def _add_available_units(items, units):
+    if not units:  # not rebuilt just now
+        units = dict(MainProject.objects.filter(id__in={item['id'] for item in items}).values_list(
+            'id', 'available_units',
+        ))
+    for item in items:
+        item['available_units'] = units.get(item['id'], 0)
+
+
+def payload(user):
+    """What get_user_investments returns for ``user``."""
+    units = {}
+    result = render(load(user.pk, units))
+    if result['main_projects']:
+        _add_available_units(result['main_projects'], units)
+    return result
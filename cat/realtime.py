@@ -0,0 +1,141 @@
+"""
+Push ledger and notification events to the user's websocket.
+
+Every signed-in app connection joins a ``user_<id>`` group (see
+``cat.consumers.UserConsumer``). Ledger and notification writes append
+``ledger.transaction`` / ``notification.recharge`` events to the outbox in
+their own transaction. Clients never see a change that was rolled back, and
+a re-fetch right after the push already sees it.
+
+How the frames leave depends on the channel layer. A shared layer
+(``CHANNEL_LAYER=unix`` or ``postgres``) reaches sockets in every process,
+so the outbox dispatcher feeds the events to the ``realtime`` handler below,
+one frame per user and batch. The default in-memory layer only reaches
+sockets in the process that sends, so each write pushes its own events once
+its transaction commits instead, and the handler does nothing.
+
+Ledger frames carry the user's recomputed balance, the same figures
+``balance_api`` returns. All users in a batch are covered by a single
+aggregate query.
+"""
+import logging
+from collections import defaultdict
+
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.db import transaction
+
+from . import ledger, outbox
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+def transaction_payload(entry):
+    return {
+        'id': entry.pk,
+        'type': entry.type,
+        'amount': str(entry.amount),
+        'status': entry.status,
+        'date': entry.date.isoformat() if entry.date else None,
+    }
+
+
+def notification_payload(notification):
+    return {
+        'id': notification.pk,
+        'recharge_id': notification.recharge_id,
+        'type': notification.notification_type,
+        'message': notification.message,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+    }
+
+
+# Outbox topic -> websocket event
+PUSHED_TOPICS = {
+    'ledger.transaction': lambda payload: {'kind': 'ledger', 'transaction': payload},
+    'notification.recharge': lambda payload: {'kind': 'notification', 'notification': payload},
+}
+
+
+def layer_is_shared():
+    """Whether a group send from this process reaches sockets in other processes."""
+    layer = get_channel_layer()
+    return layer is not None and not isinstance(layer, InMemoryChannelLayer)
+
+
+def record(transactions=(), notifications=()):
+    """
+    Append the outbox events for new ``Transaction`` and
+    ``RechargeNotification`` rows; call this inside the transaction that
+    creates them.
+    """
+    events = [('ledger.transaction', entry.customer_id, transaction_payload(entry)) for entry in transactions]
+    events += [('notification.recharge', entry.user_id, notification_payload(entry)) for entry in notifications]
+    OutboxEvent.record_many(events)
+    if events and not layer_is_shared():
+        pushed = [
+            (user_id, PUSHED_TOPICS[topic](payload)) for topic, user_id, payload in events if user_id is not None
+        ]
+        transaction.on_commit(partial(send_events, pushed), robust=True)
+
+
+def record_transactions(entries):
+    record(transactions=entries)
+
+
+def record_notifications(notifications):
+    record(notifications=notifications)
+
+
+def ledger_balances(user_ids):
+    """Balance figures per user id, computed like ``balance_api``."""
+    result = {}
+    for user_id, totals in ledger.totals(user_ids).items():
+        balance = float(totals['deposit'] - totals['withdraw'])
+        frozen_balance = float(balance * 0.01)
+        result[user_id] = {
+            'balance': balance,
+            'available_balance': float(balance - frozen_balance),
+            'frozen_balance': frozen_balance,
+        }
+    return result
+
+
+@outbox.handler('realtime')
+def push_outbox_events(events):
+    if not layer_is_shared():
+        return  # already pushed on commit by the process that wrote them
+    send_events([
+        (event.user_id, PUSHED_TOPICS[event.topic](event.payload))
+        for event in events
+        if event.topic in PUSHED_TOPICS and event.user_id is not None
+    ])
+
+
+def send_events(events):
+    """Send ``(user_id, event)`` pairs, one frame per user."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    per_user = defaultdict(list)
+    for user_id, event in events:
+        per_user[user_id].append(event)
+    ledger_users = [user_id for user_id, items in per_user.items() if any(e['kind'] == 'ledger' for e in items)]
+    try:
+        balances = ledger_balances(ledger_users) if ledger_users else {}
+        for user_id, items in per_user.items():
+            message = {'type': 'user.events', 'events': items}
+            if user_id in balances:
+                message['balance'] = balances[user_id]
+            async_to_sync(channel_layer.group_send)(user_group(user_id), message)
+    except Exception:
+        # The write already committed; a missed push only means the app
+        # picks the change up on its next refresh.
+        logger.exception('Failed to push user events', extra={'event': 'realtime.push', 'users': len(per_user)})
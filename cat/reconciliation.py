@@ -0,0 +1,187 @@
+"""
+Balance reconciliation.
+
+A user's balance is stored in places that are supposed to agree:
+
+* the expected figure, built from every recorded money movement:
+  ``deposit`` and ``profit`` transactions minus ``withdraw`` ones (hot and
+  archived, via ``ledger.grouped_totals``), plus gift redemptions
+  (``GiftRedemption.amount``), minus main project purchases
+  (``UserMainProject.invested_amount``). Gift redemption and project
+  purchase move ``Profile.balance`` without writing a transaction, so they
+  are read from their own rows;
+* ``Balance.amount``, shown through ``ProfileSerializer``;
+* ``Profile.balance`` / ``available_balance``, moved by the claim views.
+
+``reconcile`` walks users in id ranges. Each range costs six grouped
+queries: user ids, profiles, balance rows, ledger totals, gift redemptions
+and project purchases. The rows go into NumPy arrays of cents, aligned by
+user id, and the comparison is a handful of vectorised operations. Python
+only touches users that drifted, so a million users take about 120 queries
+and no per-user loop.
+
+The command only reports. Some paths still move one balance and not the
+others (``withdraw_api`` and VIP purchases write a ``withdraw`` row but
+leave ``Profile.balance`` alone), so no single figure is safe to write
+back until every path records its movement.
+"""
+import heapq
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import Sum
+
+from . import ledger
+from .models import Balance, GiftRedemption, Profile, User, UserMainProject
+
+# Transaction types counted, and their sign
+MOVEMENTS = {'deposit': 1, 'profit': 1, 'withdraw': -1}
+
+
+def to_cents(values):
+    """Money values (Decimal, float or None) as an int64 array of cents."""
+    return np.rint(np.array([value or 0 for value in values], dtype=np.float64) * 100).astype(np.int64)
+
+
+def from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+@dataclass
+class Chunk:
+    """Balances of one id range, as arrays aligned with ``ids`` (cents)."""
+    ids: np.ndarray
+    expected: np.ndarray
+    profile: np.ndarray
+    available: np.ndarray
+    has_profile: np.ndarray
+    balance: np.ndarray
+    has_balance: np.ndarray
+
+
+def _aligned(ids, rows, columns):
+    """Scatter ``(user_id, *values)`` rows into arrays aligned with ``ids``."""
+    present = np.zeros(len(ids), dtype=bool)
+    arrays = [np.zeros(len(ids), dtype=np.int64) for _ in range(columns)]
+    if rows:
+        user_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        positions = np.searchsorted(ids, user_ids)
+        present[positions] = True
+        for column, array in enumerate(arrays, start=1):
+            array[positions] = to_cents(row[column] for row in rows)
+    return present, arrays
+
+
+def load_chunk(ids):
+    """Read the three balances for the sorted user ``ids``."""
+    first, last = int(ids[0]), int(ids[-1])
+
+    has_profile, (profile, available) = _aligned(ids, list(
+        Profile.objects.filter(user_id__gte=first, user_id__lte=last).values_list(
+            'user_id', 'balance', 'available_balance',
+        )
+    ), 2)
+    has_balance, (balance,) = _aligned(ids, list(
+        Balance.objects.filter(customer_id__gte=first, customer_id__lte=last).values_list('customer_id', 'amount')
+    ), 1)
+
+    expected = np.zeros(len(ids), dtype=np.int64)
+    totals = list(ledger.grouped_totals(tuple(MOVEMENTS), customer_id__gte=first, customer_id__lte=last))
+    if totals:
+        positions = np.searchsorted(ids, np.fromiter((row[0] for row in totals), dtype=np.int64, count=len(totals)))
+        signs = np.fromiter((MOVEMENTS[row[1]] for row in totals), dtype=np.int64, count=len(totals))
+        np.add.at(expected, positions, signs * to_cents(row[2] for row in totals))
+    _, (gifts,) = _aligned(ids, list(
+        GiftRedemption.objects.filter(user_id__gte=first, user_id__lte=last).values('user_id').annotate(
+            total=Sum('amount'),
+        ).order_by().values_list('user_id', 'total')
+    ), 1)
+    _, (purchases,) = _aligned(ids, list(
+        UserMainProject.objects.filter(user_id__gte=first, user_id__lte=last).values('user_id').annotate(
+            total=Sum('invested_amount'),
+        ).order_by().values_list('user_id', 'total')
+    ), 1)
+    expected += gifts - purchases
+
+    return Chunk(ids, expected, profile, available, has_profile, balance, has_balance)
+
+
+def iter_chunks(chunk_size=50000):
+    last_id = 0
+    while True:
+        ids = np.fromiter(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size],
+            dtype=np.int64,
+        )
+        if not len(ids):
+            return
+        yield load_chunk(ids)
+        last_id = int(ids[-1])
+
+
+@dataclass
+class Report:
+    users: int = 0
+    profile_drift: int = 0
+    profile_drift_total: int = 0
+    missing_profiles: int = 0
+    balance_drift: int = 0
+    balance_drift_total: int = 0
+    missing_balances: int = 0
+    available_over_balance: int = 0
+    # (abs drift, user id, expected, profile, balance) in cents, largest first
+    worst: list = field(default_factory=list)
+
+
+def drift_masks(chunk, tolerance=0):
+    """Boolean arrays marking users whose stored balances disagree with the expected figure."""
+    profile_gap = np.abs(chunk.profile - chunk.expected)
+    balance_gap = np.abs(chunk.balance - chunk.expected)
+    return {
+        'profile': chunk.has_profile & (profile_gap > tolerance),
+        'balance': chunk.has_balance & (balance_gap > tolerance),
+        'missing_balance': ~chunk.has_balance & (chunk.expected != 0),
+        'available': chunk.has_profile & (chunk.available > chunk.profile),
+    }
+
+
+def reconcile(chunk_size=50000, tolerance=0, top=20, on_drift=None):
+    """
+    Compare every user's stored balances with the expected figure.
+    ``tolerance`` is in cents. ``on_drift(user_id, expected, profile,
+    balance)`` (cents, None when the row is missing) is called for every
+    drifted user.
+    """
+    report = Report()
+    for chunk in iter_chunks(chunk_size):
+        masks = drift_masks(chunk, tolerance)
+        report.users += len(chunk.ids)
+        report.profile_drift += int(masks['profile'].sum())
+        report.profile_drift_total += int(np.abs(chunk.profile - chunk.expected)[masks['profile']].sum())
+        report.missing_profiles += int((~chunk.has_profile).sum())
+        report.balance_drift += int(masks['balance'].sum())
+        report.balance_drift_total += int(np.abs(chunk.balance - chunk.expected)[masks['balance']].sum())
+        report.missing_balances += int(masks['missing_balance'].sum())
+        report.available_over_balance += int(masks['available'].sum())
+
+        drifted = np.flatnonzero(masks['profile'] | masks['balance'] | masks['missing_balance'])
+        gap = np.maximum(
+            np.where(masks['profile'], np.abs(chunk.profile - chunk.expected), 0),
+            np.where(masks['balance'] | masks['missing_balance'], np.abs(chunk.balance - chunk.expected), 0),
+        )
+        if top and len(drifted):
+            for index in drifted[np.argsort(-gap[drifted], kind='stable')[:top]]:
+                row = (int(gap[index]), int(chunk.ids[index]), int(chunk.expected[index]),
+                       int(chunk.profile[index]) if chunk.has_profile[index] else None,
+                       int(chunk.balance[index]) if chunk.has_balance[index] else None)
+                heapq.heappush(report.worst, row)
+                if len(report.worst) > top:
+                    heapq.heappop(report.worst)
+        if on_drift is not None:
+            for index in drifted:
+                on_drift(int(chunk.ids[index]), int(chunk.expected[index]),
+                         int(chunk.profile[index]) if chunk.has_profile[index] else None,
+                         int(chunk.balance[index]) if chunk.has_balance[index] else None)
+    report.worst.sort(reverse=True)
+    return report
@@ -0,0 +1,106 @@
+"""
+Full-text search over chat messages.
+
+SQLite keeps an FTS5 index (``cat_message_fts``) over ``Message.content``,
+kept in sync by triggers on ``cat_message``. PostgreSQL uses a GIN index on
+``to_tsvector('simple', content)``, which the database maintains itself.
+Both are created by migration 0014. Any other backend falls back to an
+``icontains`` scan.
+
+The triggers fire for every write path, including ``bulk_create`` from the
+websocket persistence buffer. SQLite drops them whenever a migration has to
+rebuild ``cat_message``; such a migration must recreate them, as 0025 does
+after the rebuild in 0015.
+"""
+import re
+
+from django.db import connection
+
+from .models import Message
+
+FTS_TABLE = 'cat_message_fts'
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _terms(query):
+    return _WORD.findall(query or '')
+
+
+def _fts5_query(terms):
+    # Quote every term so user input can't use FTS5 syntax; the last one is a
+    # prefix so results show up while staff are still typing.
+    quoted = ['"%s"' % term for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _sqlite_search(terms, room, limit, offset):
+    where = f'{FTS_TABLE} MATCH %s'
+    params = [_fts5_query(terms)]
+    if room:
+        where += ' AND m.room = %s'
+        params.append(room)
+    base = f'FROM {FTS_TABLE} JOIN cat_message m ON m.id = {FTS_TABLE}.rowid WHERE {where}'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) {base}', params)
+        total = cursor.fetchone()[0]
+        # bm25() is lower-is-better; flip it so rank reads like ts_rank.
+        cursor.execute(
+            f'SELECT m.id, -bm25({FTS_TABLE}) AS rank {base} ORDER BY rank DESC, m.id DESC LIMIT %s OFFSET %s',
+            params + [limit, offset],
+        )
+        return total, cursor.fetchall()
+
+
+def _postgres_search(terms, room, limit, offset):
+    where = "to_tsvector('simple', content) @@ q"
+    params = [' & '.join(terms[:-1] + [terms[-1] + ':*'])]
+    if room:
+        where += ' AND room = %s'
+        params.append(room)
+    base = f"FROM cat_message, to_tsquery('simple', %s) q WHERE {where}"
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) {base}', params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT id, ts_rank(to_tsvector('simple', content), q) AS rank {base} "
+            'ORDER BY rank DESC, id DESC LIMIT %s OFFSET %s',
+            params + [limit, offset],
+        )
+        return total, cursor.fetchall()
+
+
+def _scan_search(terms, room, limit, offset):
+    queryset = Message.objects.all()
+    for term in terms:
+        queryset = queryset.filter(content__icontains=term)
+    if room:
+        queryset = queryset.filter(room=room)
+    ids = list(queryset.order_by('-pk').values_list('pk', flat=True)[offset:offset + limit])
+    return queryset.count(), [(pk, 0.0) for pk in ids]
+
+
+def search_ids(query, room=None, limit=20, offset=0):
+    """
+    Return ``(total, [(message_id, rank), ...])`` for messages matching every
+    word of ``query``, best match first.
+    """
+    terms = _terms(query)
+    if not terms:
+        return 0, []
+    backend = {'sqlite': _sqlite_search, 'postgresql': _postgres_search}.get(connection.vendor, _scan_search)
+    return backend([term.lower() for term in terms], room, limit, offset)
+
+
+def search_messages(query, room=None, page=1, page_size=20):
+    """One page of matching ``Message`` objects, each with a ``rank`` attribute."""
+    total, hits = search_ids(query, room=room, limit=page_size, offset=(page - 1) * page_size)
+    messages = Message.objects.in_bulk([pk for pk, _ in hits])
+    results = []
+    for pk, rank in hits:
+        message = messages.get(pk)
+        if message is not None:
+            message.rank = rank
+            results.append(message)
+    return total, results
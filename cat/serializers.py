@@ -66,11 +66,25 @@ class ProfileSerializer(serializers.ModelSerializer):
             'vip', 'invite_code'
         ]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Balance rows memoized per serialization, keyed by profile pk
+        self._balance_cache = {}
+
     def get_username(self, obj):
         return getattr(obj.user, 'username', 'Unknown')
 
     def _get_balance_obj(self, obj):
-        return Balance.objects.filter(customer=obj.user).first()
+        """
+        Return the user's Balance, reading it at most once per profile.
+        Uses the row loaded by select_related('user__balance') when present.
+        """
+        if obj.pk not in self._balance_cache:
+            try:
+                self._balance_cache[obj.pk] = obj.user.balance
+            except Balance.DoesNotExist:
+                self._balance_cache[obj.pk] = None
+        return self._balance_cache[obj.pk]
 
     def get_balance(self, obj):
         balance = self._get_balance_obj(obj)
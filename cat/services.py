@@ -0,0 +1,97 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from . import realtime
+from .models import OutboxEvent, Profile, RechargeNotification, RechargeRequest, Transaction
+
+
+# =======================
+# RECHARGE APPROVAL
+# =======================
+
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+def approve_recharge_requests(queryset, admin_user):
+    """
+    Approve every pending, paid recharge in ``queryset`` in one transaction.
+
+    The query count does not depend on how many requests are selected:
+    the rows are locked and read once, balances are credited per user with
+    a single ``F()`` update, deposit transactions and notifications are
+    bulk inserted, and the requests are marked completed in one statement.
+    Outbox events for the deposits, notifications and approvals are written
+    in the same transaction.
+
+    Returns the number of approved requests.
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update()
+            .filter(status='pending', payment_status='paid')
+            .order_by()
+            .values_list('id', 'user_id', 'amount', 'transaction_id')
+        )
+        if not rows:
+            return 0
+
+        # Credit balances grouped per user
+        totals = defaultdict(Decimal)
+        for _, user_id, amount, _ in rows:
+            totals[user_id] += amount
+
+        credit = Case(
+            *[When(user_id=user_id, then=Value(total)) for user_id, total in totals.items()],
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        Profile.objects.filter(user_id__in=list(totals)).update(
+            balance=F('balance') + credit,
+            available_balance=F('available_balance') + credit,
+        )
+        account_numbers = dict(
+            Profile.objects.filter(user_id__in=list(totals)).values_list('user_id', 'account_number')
+        )
+
+        # Create transaction records and notifications
+        deposits = Transaction.objects.bulk_create([
+            Transaction(
+                customer_id=user_id,
+                type='deposit',
+                amount=amount,
+                status='success',
+                account_number=account_numbers.get(user_id),
+            )
+            for _, user_id, amount, _ in rows
+        ], batch_size=BULK_CREATE_BATCH_SIZE)
+
+        notifications = RechargeNotification.objects.bulk_create([
+            RechargeNotification(
+                recharge_id=recharge_id,
+                user_id=user_id,
+                message=f"Your recharge {transaction_id} of ETB {amount} has been approved.",
+                notification_type='approved',
+            )
+            for recharge_id, user_id, amount, transaction_id in rows
+        ], batch_size=BULK_CREATE_BATCH_SIZE)
+
+        RechargeRequest.objects.filter(id__in=[row[0] for row in rows]).update(
+            status='completed',
+            verified_by=admin_user,
+            verified_at=now,
+            processed_at=now,
+        )
+
+        # bulk_create skips post_save, so record the outbox events here
+        realtime.record(transactions=deposits, notifications=notifications)
+        OutboxEvent.record_many([
+            ('recharge.approved', user_id, {'recharge_id': recharge_id, 'amount': str(amount)})
+            for recharge_id, user_id, amount, _ in rows
+        ])
+
+    return len(rows)
@@ -31,3 +31,59 @@ def save_profile(sender, instance, **kwargs):
         instance.profile.save()
 
 
+# ---------------------------------
+# Invalidate cached catalog responses on admin edits
+# ---------------------------------
+from django.db.models.signals import post_delete
+from . import catalog
+from .models import VIP, BannedTerm, MainProject, PaymentMethod, Video
+
+@receiver(post_save, sender=VIP)
+@receiver(post_delete, sender=VIP)
+@receiver(post_save, sender=MainProject)
+@receiver(post_delete, sender=MainProject)
+@receiver(post_save, sender=PaymentMethod)
+@receiver(post_delete, sender=PaymentMethod)
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+@receiver(post_save, sender=BannedTerm)
+@receiver(post_delete, sender=BannedTerm)
+def bump_catalog_version(sender, **kwargs):
+    catalog.bump_version(sender)
+
+
+# ---------------------------------
+# Record ledger changes and notifications in the outbox; the dispatcher
+# pushes them to the user's websocket
+# ---------------------------------
+from . import realtime
+from .models import RechargeNotification, Transaction
+
+@receiver(post_save, sender=Transaction)
+def record_transaction(sender, instance, created, **kwargs):
+    if created:
+        realtime.record_transactions([instance])
+
+
+@receiver(post_save, sender=RechargeNotification)
+def record_recharge_notification(sender, instance, created, **kwargs):
+    if created:
+        realtime.record_notifications([instance])
+
+
+# ---------------------------------
+# Keep the portfolio read model in step with purchases and claims
+# ---------------------------------
+from . import portfolio
+from .models import UserMainProject, UserVIP
+
+@receiver(post_save, sender=UserVIP)
+@receiver(post_save, sender=UserMainProject)
+def refresh_portfolio(sender, instance, **kwargs):
+    portfolio.mark_stale(instance.user_id)
+
+
+@receiver(post_delete, sender=UserVIP)
+@receiver(post_delete, sender=UserMainProject)
+def drop_portfolio(sender, instance, **kwargs):
+    portfolio.mark_stale(instance.user_id, rebuild=False)
@@ -0,0 +1,97 @@
+"""
+Background jobs run by ``manage.py run_worker`` (see cat/jobs.py).
+"""
+import json
+import logging
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import catalog, idempotency, ledger
+from .jobs import task
+from .log import mask_phone
+from .models import Profile, Video
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INVITATION = 'Join me on this amazing platform and start earning!'
+
+
+def referral_link(invite_code):
+    return f"https://yourapp.com/register?ref={invite_code}"
+
+
+def invitation_text(greeting, invite_code):
+    return f"{greeting}\n\nUse my referral link to register: {referral_link(invite_code)}\n\nMy invite code: {invite_code}"
+
+
+def invitation_sender():
+    """
+    The callable named by ``INVITATION_SENDER`` (a dotted path), called as
+    ``sender(phone, message)``; None when no SMS service is configured.
+    """
+    path = getattr(settings, 'INVITATION_SENDER', '')
+    return import_string(path) if path else None
+
+
+@task('team.send_invitation', max_attempts=5)
+def send_invitation(user_id, phone, greeting=DEFAULT_INVITATION):
+    invite_code = Profile.objects.values_list('invite_code', flat=True).get(user_id=user_id)
+    extra = {"event": "team.invitation", "user_id": user_id, "phone": mask_phone(phone)}
+    sender = invitation_sender()
+    if sender is None:
+        logger.warning("Invitation not sent: no INVITATION_SENDER configured", extra=extra)
+        return
+    # Errors propagate so the job is retried
+    sender(phone, invitation_text(greeting, invite_code))
+    logger.info("Invitation sent", extra=extra)
+
+
+def probe_duration(path):
+    """Duration in whole seconds via ffprobe, or None when it isn't installed or can't read the file."""
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+    result = subprocess.run(
+        [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', path],
+        capture_output=True, text=True, timeout=60,
+    )
+    try:
+        return int(float(json.loads(result.stdout)['format']['duration']))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+@task('videos.process')
+def process_video(video_id):
+    """Fill in the stored file size and duration of an uploaded video."""
+    video = Video.objects.filter(pk=video_id).first()
+    if video is None or not video.video_file:
+        return
+    updates = {'file_size': video.video_file.size}
+    try:
+        duration = probe_duration(video.video_file.path)
+    except NotImplementedError:  # remote storage without local paths
+        duration = None
+    if duration is not None:
+        updates['duration'] = duration
+    Video.objects.filter(pk=video_id).update(**updates)
+    catalog.bump_version(Video)
+
+
+@task('idempotency.prune', every=60 * 60)
+def prune_idempotency_keys():
+    idempotency.prune_expired()
+
+
+@task('ledger.archive', every=60 * 60 * 24)
+def archive_ledger():
+    """
+    Move closed months out of the hot table, when LEDGER_ARCHIVE_SCHEDULED
+    is on; cold exports stay a manual step.
+    """
+    if not getattr(settings, 'LEDGER_ARCHIVE_SCHEDULED', False):
+        return
+    ledger.archive_closed_months()
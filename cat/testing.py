@@ -0,0 +1,164 @@
+"""
+Test helpers shared by the app test suites.
+"""
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver
+
+from .models import (
+    VIP, Balance, Commission, GiftCode, MainProject, Message, PaymentMethod, Profile,
+    Transaction, User, UserMainProject, UserVIP, Video,
+)
+
+
+# =======================
+# ROUTE DISCOVERY
+# =======================
+
+def api_routes(urlconf='cat.api_urls'):
+    """
+    Yield ``(name, route, methods)`` for every named route in ``urlconf``.
+    ``methods`` is the set of lower-case HTTP methods the DRF view accepts.
+    """
+    seen = set()
+    for pattern in get_resolver(urlconf).url_patterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name or pattern.name in seen:
+            continue
+        seen.add(pattern.name)
+        view_class = getattr(pattern.callback, 'cls', None)
+        methods = set(getattr(view_class, 'http_method_names', ())) - {'options'}
+        yield pattern.name, str(pattern.pattern), methods
+
+
+# =======================
+# QUERY BUDGETS
+# =======================
+
+class QueryBudgetMixin:
+    """
+    Assert that a request succeeds within a declared number of queries.
+    An error response proves nothing about the query count, so it fails.
+    A streaming body is consumed inside the capture, since its queries run
+    as it is read.
+    """
+
+    def assertQueryBudget(self, budget, method, url, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, **extra)
+            if response.streaming:
+                response.streaming_content = [b''.join(response.streaming_content)]
+        if not 200 <= response.status_code < 300:
+            self.fail(f'{method.upper()} {url} returned {response.status_code}, budgets are measured on success')
+        queries = len(ctx.captured_queries)
+        if queries > budget:
+            sql = '\n'.join(q['sql'] for q in ctx.captured_queries)
+            self.fail(f'{method.upper()} {url} ran {queries} queries, budget is {budget}:\n{sql}')
+        return response
+
+
+# =======================
+# QUERY PLANS
+# =======================
+
+def explain(sql):
+    """The database's plan for ``sql``, one line per step (SQLite or PostgreSQL)."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Test tables are tiny, so the planner would scan them anyway;
+            # a scan chosen even with this off means there is no usable index.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan, table, index_only=False):
+    """What is wrong with ``plan`` for reads of ``table``, as messages."""
+    problems = []
+    for line in plan:
+        step = line.strip().lstrip('->').strip()
+        if connection.vendor == 'postgresql':
+            if f'Seq Scan on {table}' in step:
+                problems.append(f'full scan: {step}')
+            elif index_only and step.startswith('Index Scan') and f' on {table}' in step:
+                problems.append(f'not index-only: {step}')
+            elif step.startswith('Sort'):
+                problems.append(f'sorts outside the index: {step}')
+        else:
+            if step.startswith(f'SCAN {table}'):
+                problems.append(f'full scan: {step}')
+            elif index_only and step.startswith(f'SEARCH {table} ') and 'COVERING INDEX' not in step:
+                problems.append(f'not index-only: {step}')
+            elif 'TEMP B-TREE FOR ORDER BY' in step:
+                problems.append(f'sorts outside the index: {step}')
+    return problems
+
+
+class QueryPlanMixin:
+    """
+    Assert that hot queries stay on an index as tables grow. ``run`` is
+    called once; every SELECT it issues against ``table`` is EXPLAINed and
+    must not scan the table or sort outside an index. ``index_only=True``
+    also requires the index to cover every column read.
+    """
+
+    def assertIndexedQueries(self, table, run, index_only=False):
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        checked = 0
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT') or f'"{table}"' not in sql:
+                continue
+            checked += 1
+            problems = plan_problems(explain(sql), table, index_only)
+            if problems:
+                self.fail(f'{sql}\n' + '\n'.join(problems))
+        if not checked:
+            self.fail(f'No query read {table}')
+
+
+# =======================
+# SEED DATA
+# =======================
+
+def seed_user_activity(user, size):
+    """
+    Give ``user`` ``size`` rows of everything the read endpoints touch:
+    transactions, investments, invited team members, commissions, chat
+    messages and videos, plus the shared catalog rows.
+    """
+    Profile.objects.get_or_create(user=user)
+    Balance.objects.get_or_create(customer=user)
+    GiftCode.objects.get_or_create(
+        code='WELCOME', defaults={'total_amount': Decimal('1000'), 'per_user_amount': Decimal('10')}
+    )
+    offset = MainProject.objects.count()
+
+    for i in range(size):
+        n = offset + i
+        vip = VIP.objects.create(
+            title=f'VIP {n}', description='', price=Decimal('100'),
+            daily_income=Decimal('5'), income_days=30, upgrade=n,
+        )
+        project = MainProject.objects.create(
+            title=f'Project {n}', description='', price=Decimal('100'), daily_income=Decimal('5'),
+            total_income=Decimal('150'), total_units=10, available_units=10, is_featured=True,
+        )
+        PaymentMethod.objects.create(name=f'Bank {n}', payment_type='bank', account_name='Ops', account_number=str(n))
+
+        member = User.objects.create_user(username=f'{user.username}-member-{n}', password='x')
+        Profile.objects.create(user=member, inviter=user)
+        UserVIP.objects.create(user=member, vip=vip, invested=vip.price)
+        UserMainProject.objects.create(user=member, main_project=project, invested_amount=project.price)
+        UserMainProject.objects.create(user=user, main_project=project, invested_amount=project.price)
+
+        Transaction.objects.create(customer=user, type='deposit', amount=Decimal('100'))
+        Transaction.objects.create(customer=user, type='withdraw', amount=Decimal('10'))
+        Commission.objects.create(user=user, level=1, amount=Decimal('2'))
+        Message.objects.create(sender=user.username, content=f'hello {n}')
+        Video.objects.create(title=f'Video {n}', video_file=f'videos/{n}.mp4', uploaded_by=member)
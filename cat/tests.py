@@ -1,3 +1,1497 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .models import (
+    VIP, ArchivedTransaction, Balance, BannedTerm, Commission, GiftCode, GiftRedemption, IdempotencyKey, Job,
+    LedgerExport, LedgerPeriod, MainProject, Message, OutboxCursor, OutboxEvent, Portfolio, Profile,
+    RechargeNotification, RechargeRequest, Transaction, User, UserMainProject, UserVIP, Video,
+)
+from . import catalog, idempotency, jobs, ledger, moderation, outbox, portfolio, realtime, tasks, ws_auth
+from .consumers import UserConsumer
+from .log import QueuedHandler, SamplingFilter, restart_after_fork
+from .moderation import ContentFilter
+from .services import approve_recharge_requests
+from .testing import QueryBudgetMixin, QueryPlanMixin, api_routes, seed_user_activity
+
+
+class BulkRechargeApprovalTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='ops', password='x', is_staff=True)
+
+    def _make_requests(self, users, per_user):
+        for user in users:
+            Profile.objects.get_or_create(user=user)
+            for _ in range(per_user):
+                RechargeRequest.objects.create(
+                    user=user, amount=Decimal('100.00'), fee=Decimal('0.00'), payment_status='paid'
+                )
+
+    def _approve_all(self):
+        with CaptureQueriesContext(connection) as ctx:
+            approved = approve_recharge_requests(RechargeRequest.objects.all(), self.admin)
+        return approved, len(ctx.captured_queries)
+
+    def test_credits_balances_and_records_deposits(self):
+        alice = User.objects.create_user(username='alice', password='x')
+        bob = User.objects.create_user(username='bob', password='x')
+        self._make_requests([alice], 2)
+        self._make_requests([bob], 1)
+        RechargeRequest.objects.create(user=bob, amount=Decimal('50.00'), fee=Decimal('0.00'))  # unpaid
+
+        approved, _ = self._approve_all()
+
+        self.assertEqual(approved, 3)
+        self.assertEqual(Profile.objects.get(user=alice).balance, Decimal('200.00'))
+        self.assertEqual(Profile.objects.get(user=bob).available_balance, Decimal('100.00'))
+        self.assertEqual(Transaction.objects.filter(type='deposit').count(), 3)
+        self.assertEqual(RechargeNotification.objects.filter(notification_type='approved').count(), 3)
+        self.assertEqual(RechargeRequest.objects.filter(status='completed', verified_by=self.admin).count(), 3)
+        self.assertEqual(RechargeRequest.objects.filter(status='pending').count(), 1)
+
+    def test_query_count_does_not_grow_with_selection(self):
+        few = [User.objects.create_user(username=f'few{i}', password='x') for i in range(2)]
+        self._make_requests(few, 2)
+        _, small = self._approve_all()
+
+        many = [User.objects.create_user(username=f'many{i}', password='x') for i in range(20)]
+        self._make_requests(many, 5)
+        approved, large = self._approve_all()
+
+        self.assertEqual(approved, 100)
+        self.assertEqual(small, large)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ProfileApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='x')
+        Profile.objects.create(user=self.user, account_number='1000123')
+        Balance.objects.create(customer=self.user, amount=Decimal('75.50'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_profile_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api_profile'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'alice')
+        self.assertEqual(response.data['balance'], 75.5)
+        self.assertEqual(response.data['available_balance'], 75.5)
+        self.assertEqual(response.data['account_number'], '1000123')
+
+    def test_profile_without_balance_row(self):
+        Balance.objects.filter(customer=self.user).delete()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api_profile'))
+
+        self.assertEqual(response.data['balance'], 0.0)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class DashboardApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='x')
+        Profile.objects.create(user=self.user)
+        Balance.objects.create(customer=self.user, amount=Decimal('10.00'))
+        self.vip = VIP.objects.create(
+            title='VIP 1', description='', price=Decimal('500'),
+            daily_income=Decimal('20'), income_days=30, upgrade=1,
+        )
+        self.project = MainProject.objects.create(
+            title='Farm', description='', price=Decimal('1000'), daily_income=Decimal('40'),
+            total_income=Decimal('1200'), total_units=10, available_units=10, is_featured=True,
+        )
+        gift = GiftCode.objects.create(code='WELCOME', total_amount=Decimal('100'), per_user_amount=Decimal('10'))
+        GiftRedemption.objects.create(code=gift, user=self.user, amount=Decimal('10'))
+        Transaction.objects.create(customer=self.user, type='deposit', amount=Decimal('900'))
+        Transaction.objects.create(customer=self.user, type='withdraw', amount=Decimal('100'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_dashboard_sections(self):
+        UserVIP.objects.create(user=self.user, vip=self.vip, invested=self.vip.price)
+        UserMainProject.objects.create(
+            user=self.user, main_project=self.project, invested_amount=self.project.price
+        )
+
+        response = self.client.get(reverse('api_dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profile']['username'], 'alice')
+        self.assertEqual(response.data['balance']['balance'], 800.0)
+        self.assertEqual(response.data['investments']['total_count'], 2)
+        self.assertEqual(len(response.data['vip_packages']), 1)
+        self.assertEqual(len(response.data['featured_projects']), 1)
+        self.assertEqual(response.data['gift']['remaining_amount'], 90.0)
+        self.assertTrue(response.data['gift']['already_redeemed'])
+
+    def test_query_count_is_fixed_with_warm_catalog(self):
+        self.client.get(reverse('api_dashboard'))  # warm the catalog cache
+        with CaptureQueriesContext(connection) as empty:
+            self.client.get(reverse('api_dashboard'))
+
+        UserVIP.objects.create(user=self.user, vip=self.vip, invested=self.vip.price)
+        for i in range(5):
+            project = MainProject.objects.create(
+                title=f'Project {i}', description='', price=Decimal('10'),
+                daily_income=Decimal('1'), total_income=Decimal('30'),
+            )
+            UserMainProject.objects.create(user=self.user, main_project=project, invested_amount=Decimal('10'))
+            Transaction.objects.create(customer=self.user, type='deposit', amount=Decimal('10'))
+
+        self.client.get(reverse('api_dashboard'))  # new projects invalidated the catalog
+        with CaptureQueriesContext(connection) as full:
+            self.client.get(reverse('api_dashboard'))
+
+        # Investments come from the stored portfolio row once it is built,
+        # plus one query for the units left once the user holds projects.
+        self.assertEqual(len(empty.captured_queries), 6)
+        self.assertEqual(len(full.captured_queries), 7)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.vip = VIP.objects.create(
+            title='VIP 1', description='', price=Decimal('500'),
+            daily_income=Decimal('20'), income_days=30, upgrade=1,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='alice', password='x'))
+
+    def test_repeat_requests_only_read_the_version_stamp(self):
+        first = self.client.get(reverse('api_vip_packages'))
+
+        with self.assertNumQueries(2):
+            second = self.client.get(reverse('api_vip_packages'))
+            not_modified = self.client.get(reverse('api_vip_packages'), HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+    def test_admin_edit_changes_the_etag(self):
+        first = self.client.get(reverse('api_vip_packages'))
+
+        self.vip.title = 'VIP Gold'
+        self.vip.save()
+        response = self.client.get(reverse('api_vip_packages'), HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()[0]['title'], 'VIP Gold')
+
+    @override_settings(SECURE_SSL_REDIRECT=False)
+    def test_investments_leave_the_catalog_stamp_alone_until_sold_out(self):
+        Profile.objects.create(user=User.objects.get(username='alice'), balance=Decimal('1000'))
+        project = MainProject.objects.create(
+            title='Farm', description='', price=Decimal('10'), daily_income=Decimal('1'),
+            total_income=Decimal('30'), total_units=3, available_units=3,
+        )
+        stamp = catalog.get_version(MainProject)
+
+        response = self.client.post(reverse('invest-in-main-project'), {'project_id': project.pk, 'units': 2},
+                                    format='json')
+
+        self.assertEqual(response.data['remaining_units'], 1)
+        self.assertEqual(catalog.get_version(MainProject), stamp)
+
+        other = User.objects.create_user(username='bob', password='x')
+        Profile.objects.create(user=other, balance=Decimal('1000'))
+        self.client.force_authenticate(other)
+        self.client.post(reverse('invest-in-main-project'), {'project_id': project.pk, 'units': 1}, format='json')
+
+        self.assertEqual(MainProject.objects.get(pk=project.pk).status, 'sold_out')
+        self.assertNotEqual(catalog.get_version(MainProject), stamp)
+
+
+# Queries each read route may run against seeded data. Every GET route in
+# cat/api_urls.py without URL arguments must declare a budget here; the
+# harness checks it at two data sizes so N+1 loops fail the build.
+ROUTE_QUERY_BUDGETS = {
+    'api_profile': 1,
+    'api_balance': 3,
+    'api_dashboard': 11,  # cold catalog and portfolio; 7 once both are warm
+    'api_withdraw_history': 1,
+    'api_vip_packages': 2,
+    'api_chat': 2,
+    'chat_api': 2,
+    'api_orders': 1,
+    'api_commissions': 1,
+    'get_my_invite_code': 1,
+    'get_gift_code_info': 3,
+    'main-projects': 2,
+    'featured-projects': 2,
+    'available-projects': 2,
+    'recharge_history': 1,
+    'api_notifications': 2,
+    'payment-methods': 2,
+    'user-investments': 4,  # cold: lookup, two reads, upsert; 2 once stored
+    'get-team-members': 2,
+    'get-commission-history': 1,
+    'get-team-stats': 3,
+    'video-list': 1,
+    'video-categories': 2,
+    'endpoint-metrics': 0,
+    'message-search': 3,
+    'transaction-archive': 2,  # streamed; counted as the body is read
+}
+
+# Query strings for routes that refuse a bare GET
+ROUTE_QUERY_PARAMS = {
+    'message-search': {'q': 'hello'},
+}
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RouteQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _read_routes(self):
+        for name, route, methods in api_routes():
+            if 'get' in methods and '<' not in route:
+                yield name
+
+    def test_every_read_route_declares_a_budget(self):
+        missing = [name for name in self._read_routes() if name not in ROUTE_QUERY_BUDGETS]
+        self.assertEqual(missing, [])
+
+    def test_read_routes_stay_within_budget(self):
+        for size in (2, 6):
+            seed_user_activity(self.user, size)
+            for name in self._read_routes():
+                cache.clear()
+                with self.subTest(route=name, size=size):
+                    self.assertQueryBudget(
+                        ROUTE_QUERY_BUDGETS[name], 'get', reverse(name), data=ROUTE_QUERY_PARAMS.get(name),
+                    )
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class TeamMembersApiTests(TestCase):
+    def test_members_carry_their_own_vip_and_investment(self):
+        alice = User.objects.create_user(username='alice', password='x')
+        Profile.objects.create(user=alice)
+        seed_user_activity(alice, 2)
+        first, second = User.objects.filter(profile__inviter=alice).order_by('pk')
+        Commission.objects.create(user=alice, level=1, amount=Decimal('5'))
+        client = APIClient()
+        client.force_authenticate(alice)
+
+        response = client.get(reverse('get-team-members'))
+
+        self.assertEqual(response.status_code, 200)
+        members = {member['username']: member for member in response.data['team_members']}
+        self.assertEqual(members[first.username]['investment'], 100.0)
+        self.assertEqual(members[second.username]['investment'], 100.0)
+        self.assertEqual(members[first.username]['level'], f'VIP {UserVIP.objects.get(user=first).vip.upgrade}')
+        self.assertEqual(response.data['team_stats']['total_investment'], 200.0)
+        self.assertEqual(response.data['team_stats']['commission_earned'], 9.0)
+
+    def test_stats_split_members_investment_and_commission_by_level(self):
+        alice = User.objects.create_user(username='alice', password='x')
+        seed_user_activity(alice, 2)
+        first = User.objects.filter(profile__inviter=alice).order_by('pk').first()
+        seed_user_activity(first, 2)
+        second = User.objects.filter(profile__inviter=first).order_by('pk').first()
+        seed_user_activity(second, 1)
+        UserMainProject.objects.filter(user=second).update(status='completed')
+        Commission.objects.create(user=alice, level=2, amount=Decimal('3.50'))
+        client = APIClient()
+        client.force_authenticate(alice)
+
+        response = client.get(reverse('get-team-stats'))
+
+        self.assertEqual(response.status_code, 200)
+        stats = response.data['stats']
+        self.assertEqual(stats['level1'], {'members': 2, 'investment': 400.0, 'commission': 4.0})
+        self.assertEqual(stats['level2'], {'members': 2, 'investment': 100.0, 'commission': 3.5})
+        self.assertEqual(stats['level3'], {'members': 1, 'investment': 100.0, 'commission': 0.0})
+        self.assertEqual(stats['total'], {'members': 5, 'investment': 600.0, 'commission': 7.5})
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, QUERY_METRICS_HEADERS=True)
+class QueryMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='ops', password='x', is_staff=True))
+        self.client.delete(reverse('endpoint-metrics'))
+
+    def test_records_queries_per_url_name(self):
+        response = self.client.get(reverse('api_withdraw_history'))
+        metrics = self.client.get(reverse('endpoint-metrics')).data['endpoints']
+
+        self.assertEqual(response['X-DB-Queries'], '1')
+        self.assertIn('X-Response-Time-ms', response)
+        self.assertEqual(metrics['api_withdraw_history']['requests'], 1)
+        self.assertEqual(metrics['api_withdraw_history']['max_queries'], 1)
+
+
+class SeedLoadCommandTests(TestCase):
+    def test_generates_consistent_dataset(self):
+        call_command(
+            'seed_load', users=40, transactions=400, messages=30, videos=5,
+            fanout=3, batch_size=64, seed=7, stdout=StringIO(),
+        )
+
+        users = User.objects.filter(username__startswith='load-')
+        self.assertEqual(users.count(), 40)
+        self.assertEqual(Profile.objects.filter(user__in=users).count(), 40)
+        self.assertEqual(Balance.objects.filter(customer__in=users).count(), 40)
+        self.assertEqual(Transaction.objects.count(), 400)
+        self.assertEqual(Message.objects.count(), 30)
+        self.assertEqual(Video.objects.count(), 5)
+        self.assertTrue(UserVIP.objects.exists())
+        self.assertTrue(UserMainProject.objects.exists())
+        self.assertTrue(GiftRedemption.objects.exists())
+
+        # Three levels below the root: 1 + 3 + 9 < 40 users.
+        self.assertTrue(Profile.objects.filter(inviter__profile__inviter__profile__inviter__isnull=False).exists())
+
+        # Balances agree with every movement reconcile_balances counts:
+        # deposits, profit, withdrawals, gifts and project purchases.
+        self.assertFalse(Profile.objects.filter(user__in=users, balance__lt=0).exists())
+        report = StringIO()
+        call_command('reconcile_balances', stdout=report)
+        self.assertIn('Profile.balance drift: 0 users', report.getvalue())
+        self.assertIn('Balance.amount drift: 0 users', report.getvalue())
+
+
+class HttpLoadTestCommandTests(TransactionTestCase):
+    def test_reports_percentiles_per_route(self):
+        call_command('seed_load', users=2, transactions=20, messages=5, videos=1, seed=1, stdout=StringIO())
+        out = StringIO()
+
+        call_command(
+            'http_loadtest', concurrency=2, iterations=4, seed=1,
+            journeys='dashboard,chat_poll', stdout=out, stderr=StringIO(),
+        )
+
+        report = json.loads(out.getvalue())
+        login = report['routes']['POST /api/auth/login/']
+        self.assertEqual(login['count'], 2)
+        self.assertEqual(login['statuses'], {'200': 2})
+        self.assertEqual(report['requests'], 2 + 2 * 4)
+        for route in ('GET /api/dashboard/', 'GET /api/chat/'):
+            if route in report['routes']:
+                stats = report['routes'][route]
+                self.assertEqual(set(stats['statuses']), {'200'})
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+
+class WebsocketLoadTestCommandTests(TransactionTestCase):
+    def test_chat_fanout_reaches_every_socket(self):
+        out = StringIO()
+
+        call_command(
+            'ws_loadtest', consumer='chat', connections=20, senders=2, messages=3,
+            interval=0, timeout=5, stdout=out,
+        )
+
+        result = json.loads(out.getvalue())['results'][0]
+        self.assertEqual(result['consumer'], 'chat')
+        self.assertEqual(result['frames_expected'], 20 * 2 * 3)
+        self.assertEqual(result['frames_received'], result['frames_expected'])
+        self.assertEqual(result['fanout_complete']['count'], 6)
+        self.assertIn('rss_per_connection_bytes', result)
+
+
+def log_from_child():
+    logging.getLogger('cat.tests.queued').info('from the child')
+
+
+class QueuedJsonLoggingTests(TestCase):
+    def _logger(self, handler):
+        logger = logging.getLogger('cat.tests.queued')
+        logger.handlers, logger.propagate = [handler], False
+        logger.setLevel(logging.DEBUG)
+        self.addCleanup(handler.close)
+        return logger
+
+    def test_records_are_written_as_json_by_the_listener(self):
+        stream = StringIO()
+        logger = self._logger(QueuedHandler(stream=stream))
+
+        logger.info('Invitation sent to %s', 'alice', extra={'event': 'team.invitation', 'user_id': 7})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('Failed')
+        logger.handlers[0].listener.stop()
+
+        first, second = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(first['message'], 'Invitation sent to alice')
+        self.assertEqual(first['event'], 'team.invitation')
+        self.assertEqual(first['user_id'], 7)
+        self.assertEqual(second['level'], 'ERROR')
+        self.assertIn('ValueError: boom', second['exc'])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = QueuedHandler(stream=StringIO(), queue_size=1)
+        handler.listener.stop()  # nothing drains the queue
+        logger = self._logger(handler)
+
+        for n in range(5):
+            logger.info('tick %s', n)
+
+        self.assertEqual(handler.dropped, 4)
+
+    def test_forked_children_write_through_a_fresh_listener(self):
+        path = os.path.join(tempfile.mkdtemp(), 'child.log')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        stream = open(path, 'w')
+        self.addCleanup(stream.close)
+        self._logger(QueuedHandler(stream=stream))
+
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=restart_after_fork) as executor:
+            executor.submit(log_from_child).result()
+
+        with open(path) as written:
+            self.assertEqual(json.loads(written.read())['message'], 'from the child')
+
+    def test_sampling_only_thins_listed_info_events(self):
+        sampler = SamplingFilter({'chat.receive': 0.0})
+
+        def record(level, event):
+            entry = logging.LogRecord('chat', level, __file__, 1, 'msg', (), None)
+            entry.event = event
+            return entry
+
+        self.assertFalse(sampler.filter(record(logging.INFO, 'chat.receive')))
+        self.assertTrue(sampler.filter(record(logging.WARNING, 'chat.receive')))
+        self.assertTrue(sampler.filter(record(logging.INFO, 'chat.connect')))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MessageSearchTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='ops', password='x', is_staff=True, is_superuser=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        Message.objects.bulk_create([
+            Message(sender='alice', content='My withdrawal is still pending'),
+            Message(sender='bob', content='Withdrawal pending, withdrawal pending!', room='support:2'),
+            Message(sender='carol', content='Recharge went through, thanks'),
+        ])
+
+    def _search(self, **params):
+        return self.client.get(reverse('message-search'), params)
+
+    def test_results_are_ranked_and_paginated(self):
+        first = self._search(q='withdrawal pending', page_size=1).data
+        second = self._search(q='withdrawal pending', page_size=1, page=2).data
+
+        self.assertEqual(first['count'], 2)
+        self.assertEqual([m['sender'] for m in first['results'] + second['results']], ['bob', 'alice'])
+        self.assertGreater(first['results'][0]['rank'], second['results'][0]['rank'])
+
+    def test_room_filter_prefix_match_and_edits(self):
+        self.assertEqual([m['sender'] for m in self._search(q='withdr', room='public').data['results']], ['alice'])
+
+        Message.objects.filter(sender='carol').update(content='Withdrawal request sent')
+        Message.objects.filter(sender='alice').delete()
+
+        self.assertEqual([m['sender'] for m in self._search(q='withdrawal', room='public').data['results']], ['carol'])
+
+    def test_search_is_one_page_of_queries_and_staff_only(self):
+        self.assertQueryBudget(3, 'get', reverse('message-search') + '?q=pending')
+        self.assertEqual(self._search().status_code, 400)
+
+        self.client.force_authenticate(User.objects.create_user(username='eve', password='x'))
+        self.assertEqual(self._search(q='pending').status_code, 403)
+
+    def test_admin_search_uses_the_index(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:cat_message_changelist'), {'q': 'recharge'})
+
+        self.assertEqual([m.sender for m in response.context['cl'].result_list], ['carol'])
+
+
+class ContentFilterTests(TestCase):
+    def test_masks_and_flags_whole_words_ignoring_case(self):
+        content_filter = ContentFilter({'scam': 'flag', 'bad word': 'mask', 'ass': 'mask'})
+
+        result = content_filter.check('A SCAM with a Bad Word in class')
+
+        self.assertEqual(result.text, 'A SCAM with a ******** in class')
+        self.assertTrue(result.flagged)
+        self.assertEqual(result.hits, ['bad word', 'scam'])
+        self.assertFalse(content_filter.check('classy assessment').hits)
+
+    def test_overlapping_terms_are_all_found(self):
+        content_filter = ContentFilter({'he': 'mask', 'she': 'mask', 'hers': 'mask', 'she hers': 'flag'})
+
+        result = content_filter.check('she hers')
+
+        self.assertEqual(result.text, '*** ****')
+        self.assertTrue(result.flagged)
+        self.assertEqual(result.hits, ['hers', 'she', 'she hers'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, MODERATION_RELOAD_INTERVAL=0)
+class ModerationApiTests(TestCase):
+    def setUp(self):
+        BannedTerm.objects.create(term='Scam', action='flag')
+        BannedTerm.objects.create(term='idiot')
+        self.staff = User.objects.create_user(username='ops', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_chat_messages_are_masked_and_flagged(self):
+        self.client.post(reverse('api_save_message'), {'content': 'this idiot runs a scam'}, format='json')
+
+        message = Message.objects.get()
+        self.assertEqual(message.content, 'this ***** runs a scam')
+        self.assertTrue(message.is_flagged)
+
+    def test_flagged_video_metadata_goes_to_review_even_for_staff(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with self.settings(MEDIA_ROOT=media):
+            response = self.client.post(reverse('video-upload'), {
+                'title': 'Easy scam profits',
+                'description': 'by an idiot',
+                'video_file': SimpleUploadedFile('clip.mp4', b'\x00' * 16, content_type='video/mp4'),
+            }, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        video = Video.objects.get()
+        self.assertEqual((video.description, video.status, video.is_published), ('by an *****', 'pending', False))
+
+    def test_reload_picks_up_bulk_edits(self):
+        BannedTerm.objects.filter(term='idiot').update(is_active=False)  # no signal
+
+        response = self.client.post(reverse('moderation-reload'))
+
+        self.assertEqual(response.data['terms'], 1)
+        self.client.post(reverse('api_save_message'), {'content': 'idiot'}, format='json')
+        self.assertEqual(Message.objects.get().content, 'idiot')
+
+    def test_other_processes_follow_the_stamp_after_the_interval(self):
+        moderation.reload_filter()
+        # Another process edits the list and bumps the database stamp.
+        BannedTerm.objects.filter(term='idiot').update(is_active=False)
+        catalog.bump_version(BannedTerm)
+
+        with override_settings(MODERATION_RELOAD_INTERVAL=60):
+            self.assertEqual(len(moderation.get_filter()), 2)
+        self.assertIsNone(moderation.cached_filter())
+        self.assertEqual(len(moderation.get_filter()), 1)
+
+
+class UserEventsSocketTests(TransactionTestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='ops', password='x', is_staff=True)
+        self.alice = User.objects.create_user(username='alice', password='x')
+        Transaction.objects.create(customer=self.alice, type='deposit', amount=Decimal('40.00'))
+        outbox.get_cursor('realtime')
+
+    def _run(self, steps, dispatch=False):
+        """
+        Connect as alice, run ``steps`` (and one dispatcher pass when
+        ``dispatch``) in a thread, and return every frame received.
+        """
+        def steps_then_dispatch():
+            steps()
+            if dispatch:
+                outbox.dispatch('realtime')
+
+        async def scenario():
+            communicator = WebsocketCommunicator(UserConsumer.as_asgi(), '/ws/user/')
+            communicator.scope['user'] = self.alice
+            await communicator.connect()
+            frames = [await communicator.receive_json_from(timeout=5)]
+            await database_sync_to_async(steps_then_dispatch)()
+            while not await communicator.receive_nothing(timeout=0.3):
+                frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return frames
+        return async_to_sync(scenario)()
+
+    def test_anonymous_socket_is_rejected(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(UserConsumer.as_asgi(), '/ws/user/')
+            connected, _ = await communicator.connect()
+            return connected
+        self.assertFalse(async_to_sync(scenario)())
+
+    def test_approval_is_pushed_once_committed(self):
+        RechargeRequest.objects.create(
+            user=self.alice, amount=Decimal('100.00'), fee=Decimal('0.00'), payment_status='paid',
+        )
+
+        snapshot, pushed = self._run(lambda: approve_recharge_requests(RechargeRequest.objects.all(), self.admin))
+
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual(snapshot['balance']['balance'], 40.0)
+        self.assertEqual([event['kind'] for event in pushed['events']], ['ledger', 'notification'])
+        self.assertEqual(pushed['events'][1]['notification']['type'], 'approved')
+        self.assertEqual(pushed['balance']['balance'], 140.0)
+
+    def test_rolled_back_writes_are_not_pushed(self):
+        def withdraw_then_fail():
+            try:
+                with transaction.atomic():
+                    Transaction.objects.create(customer=self.alice, type='withdraw', amount=Decimal('5.00'))
+                    raise ValueError
+            except ValueError:
+                pass
+            Transaction.objects.create(customer=self.alice, type='withdraw', amount=Decimal('7.00'))
+
+        frames = self._run(withdraw_then_fail)[1:]
+
+        self.assertEqual([frame['events'][0]['transaction']['amount'] for frame in frames], ['7.00'])
+        self.assertEqual(frames[0]['balance']['balance'], 33.0)
+
+    def test_shared_layer_pushes_from_the_dispatcher_only(self):
+        def withdraw():
+            Transaction.objects.create(customer=self.alice, type='withdraw', amount=Decimal('5.00'))
+            Transaction.objects.create(customer=self.alice, type='withdraw', amount=Decimal('7.00'))
+
+        with mock.patch.object(realtime, 'layer_is_shared', return_value=True):
+            frames = self._run(withdraw, dispatch=True)[1:]
+
+        self.assertEqual(len(frames), 1)
+        self.assertEqual([e['transaction']['amount'] for e in frames[0]['events']], ['5.00', '7.00'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class NotificationsApiTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='x')
+        recharge = RechargeRequest.objects.create(user=self.alice, amount=Decimal('10.00'), fee=Decimal('0.00'))
+        self.notifications = RechargeNotification.objects.bulk_create([
+            RechargeNotification(recharge=recharge, user=self.alice, message=text, notification_type='processing')
+            for text in ('first', 'second')
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_list_and_mark_read(self):
+        url = reverse('api_notifications')
+        self.client.post(url, {'ids': [self.notifications[0].pk]}, format='json')
+
+        unread = self.client.get(url, {'unread': 1}).data
+        everything = self.client.get(url).data
+
+        self.assertEqual(unread['unread_count'], 1)
+        self.assertEqual([n['message'] for n in unread['notifications']], ['second'])
+        self.assertEqual(len(everything['notifications']), 2)
+        self.assertEqual(self.client.post(url, format='json').data['marked_read'], 1)
+
+
+class AsgiImportTests(SimpleTestCase):
+    def test_asgi_module_imports_in_a_fresh_process(self):
+        # What daphne/uvicorn do: import dog.asgi before anything set Django up.
+        result = subprocess.run(
+            [sys.executable, '-c', 'import dog.asgi'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='dog.settings'), timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+class TokenAuthMiddlewareTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='x')
+        self.token = Token.objects.create(user=self.alice)
+        self.app = ws_auth.TokenAuthMiddlewareStack(UserConsumer.as_asgi())
+
+    def _connect(self, path='/ws/user/', subprotocols=None):
+        async def scenario():
+            communicator = WebsocketCommunicator(self.app, path, subprotocols=subprotocols)
+            connected, subprotocol = await communicator.connect()
+            if connected:
+                await communicator.receive_json_from(timeout=5)  # snapshot
+                await communicator.disconnect()
+            return connected, subprotocol
+        return async_to_sync(scenario)()
+
+    def test_each_handshake_rechecks_the_token(self):
+        with mock.patch.object(ws_auth, '_load_user', wraps=ws_auth._load_user) as load:
+            results = [self._connect(f'/ws/user/?token={self.token.key}') for _ in range(3)]
+
+        self.assertEqual(results, [(True, None)] * 3)
+        self.assertEqual(load.call_count, 3)
+
+    def test_concurrent_handshakes_share_one_lookup(self):
+        async def storm():
+            communicators = [
+                WebsocketCommunicator(self.app, f'/ws/user/?token={self.token.key}') for _ in range(10)
+            ]
+            results = await asyncio.gather(*(c.connect() for c in communicators))
+            for communicator in communicators:
+                await communicator.disconnect()
+            return results
+
+        with mock.patch.object(ws_auth, '_load_user', wraps=ws_auth._load_user) as load:
+            results = async_to_sync(storm)()
+
+        self.assertTrue(all(connected for connected, _ in results))
+        self.assertEqual(load.call_count, 1)
+
+    def test_subprotocol_token_is_accepted_with_the_token_protocol(self):
+        self.assertEqual(self._connect(subprotocols=['token', self.token.key]), (True, 'token'))
+
+    def test_unknown_and_deleted_tokens_are_rejected(self):
+        self.assertEqual(self._connect('/ws/user/?token=nope')[0], False)
+        self._connect(f'/ws/user/?token={self.token.key}')
+
+        self.token.delete()
+
+        self.assertEqual(self._connect(f'/ws/user/?token={self.token.key}')[0], False)
+
+    def test_deactivated_users_are_rejected_on_the_next_connect(self):
+        self.assertEqual(self._connect(f'/ws/user/?token={self.token.key}')[0], True)
+
+        User.objects.filter(pk=self.alice.pk).update(is_active=False)
+
+        self.assertEqual(self._connect(f'/ws/user/?token={self.token.key}')[0], False)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='x')
+        Profile.objects.create(user=self.alice)
+        Transaction.objects.create(customer=self.alice, type='deposit', amount=Decimal('100.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_money_moves_are_recorded_with_their_transaction(self):
+        vip = VIP.objects.create(
+            title='V1', description='', price=Decimal('30.00'), daily_income=Decimal('2.00'), income_days=30, upgrade=1,
+        )
+
+        self.client.post(reverse('api_buy_vip'), {'vip_id': vip.pk}, format='json')
+        UserVIP.objects.filter(user=self.alice).update(last_claim_time=None)
+        self.client.post(reverse('claim-vip-income', args=[vip.pk]))
+
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list('topic', flat=True)),
+            ['ledger.transaction', 'ledger.transaction', 'vip.purchased', 'ledger.transaction', 'vip.claimed'],
+        )
+        self.assertEqual(OutboxEvent.objects.last().payload, {'vip_id': vip.pk, 'amount': '2.00'})
+
+    def test_gift_redemption_is_recorded_and_credited_once(self):
+        gift = GiftCode.objects.create(code='WELCOME', total_amount=Decimal('100'), per_user_amount=Decimal('10'))
+
+        first = self.client.post(reverse('redeem_gift_code'), {'code': 'WELCOME'}, format='json')
+        second = self.client.post(reverse('redeem_gift_code'), {'code': 'WELCOME'}, format='json')
+
+        self.assertEqual((first.status_code, second.status_code), (200, 400))
+        self.assertEqual(Profile.objects.get(user=self.alice).balance, Decimal('10.00'))
+        event = OutboxEvent.objects.get(topic='gift.redeemed')
+        self.assertEqual(event.user_id, self.alice.pk)
+        self.assertEqual(event.payload, {
+            'redemption_id': GiftRedemption.objects.get(code=gift).pk, 'code': 'WELCOME', 'amount': '10.00',
+        })
+
+    def test_rolled_back_writes_leave_no_event(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            Transaction.objects.create(customer=self.alice, type='withdraw', amount=Decimal('5.00'))
+            raise ValueError
+
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+    def test_dispatch_advances_the_cursor_only_after_the_handler_succeeds(self):
+        seen = []
+        outbox.HANDLERS['test'] = seen.extend
+        self.addCleanup(outbox.HANDLERS.pop, 'test')
+        outbox.get_cursor('test', from_start=True)
+
+        self.assertEqual(outbox.dispatch('test', batch_size=10), 1)
+        OutboxEvent.record('vip.claimed', self.alice.pk, {})
+        outbox.HANDLERS['test'] = mock.Mock(side_effect=RuntimeError)
+        with self.assertRaises(RuntimeError):
+            outbox.dispatch('test')
+        outbox.HANDLERS['test'] = seen.extend
+        outbox.dispatch('test')
+
+        self.assertEqual([event.topic for event in seen], ['ledger.transaction', 'vip.claimed'])
+        self.assertEqual(OutboxCursor.objects.get(name='test').position, OutboxEvent.objects.last().pk)
+
+    def test_reader_waits_on_a_recent_gap(self):
+        first = OutboxEvent.record('vip.claimed', self.alice.pk, {})
+        OutboxEvent.objects.create(id=first.pk + 2, topic='vip.claimed', user_id=self.alice.pk)
+
+        self.assertEqual([e.pk for e in outbox.read_batch(first.pk - 1, 10, grace=60)[0]], [first.pk])
+        events, skipped = outbox.read_batch(first.pk - 1, 10, grace=0)
+        self.assertEqual((len(events), skipped), (2, [first.pk + 1]))
+
+    def test_skipped_ids_that_commit_late_are_still_delivered(self):
+        seen = []
+        outbox.HANDLERS['test'] = seen.extend
+        self.addCleanup(outbox.HANDLERS.pop, 'test')
+        first = OutboxEvent.objects.get()
+        outbox.get_cursor('test', from_start=True)
+        OutboxEvent.objects.create(id=first.pk + 2, topic='vip.claimed', user_id=self.alice.pk)
+
+        self.assertEqual(outbox.dispatch('test', grace=0), 2)
+        self.assertEqual(OutboxCursor.objects.get(name='test').gaps, {str(first.pk + 1): mock.ANY})
+        # The transaction holding the skipped id commits after all.
+        OutboxEvent.objects.create(id=first.pk + 1, topic='vip.purchased', user_id=self.alice.pk)
+
+        self.assertEqual(outbox.dispatch('test', grace=0), 1)
+        self.assertEqual(outbox.dispatch('test', grace=0), 0)
+        self.assertEqual([e.topic for e in seen], ['ledger.transaction', 'vip.claimed', 'vip.purchased'])
+        self.assertEqual(OutboxCursor.objects.get(name='test').gaps, {})
+
+    def test_skipped_ids_are_forgotten_after_the_timeout(self):
+        outbox.HANDLERS['test'] = list
+        self.addCleanup(outbox.HANDLERS.pop, 'test')
+        cursor = outbox.get_cursor('test')
+        OutboxCursor.objects.filter(pk=cursor.pk).update(gaps={'999': 0})
+
+        outbox.dispatch('test')
+
+        self.assertEqual(OutboxCursor.objects.get(pk=cursor.pk).gaps, {})
+
+    def test_dispatch_command_drains_registered_handlers(self):
+        out = StringIO()
+        with mock.patch.object(realtime, 'layer_is_shared', return_value=True):
+            call_command('dispatch_outbox', '--once', '--from-start', stdout=out)
+        self.assertIn('realtime: 1 events', out.getvalue())
+
+    def test_dispatch_command_refuses_realtime_without_a_shared_layer(self):
+        with self.assertRaisesMessage(CommandError, 'shared between processes'):
+            call_command('dispatch_outbox', '--once', stdout=StringIO())
+
+
+
+@override_settings(JOB_RETRY_BASE=0, SECURE_SSL_REDIRECT=False)
+class JobQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.calls = []
+        jobs.TASKS['test.record'] = jobs.Task('test.record', lambda **kwargs: self.calls.append(kwargs), 3)
+        jobs.TASKS['test.fail'] = jobs.Task('test.fail', mock.Mock(side_effect=RuntimeError('boom')), 2)
+        self.addCleanup(jobs.TASKS.pop, 'test.record')
+        self.addCleanup(jobs.TASKS.pop, 'test.fail')
+
+    def run_worker(self):
+        out = StringIO()
+        call_command('run_worker', '--once', '--concurrency', '2', stdout=out)
+        return out.getvalue()
+
+    def test_worker_runs_due_jobs(self):
+        job = jobs.enqueue('test.record', n=1)
+
+        self.assertIn('done: 1', self.run_worker())
+        self.assertEqual(self.calls, [{'n': 1}])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), ('done', 1, ''))
+
+    def test_failing_job_is_retried_then_marked_failed(self):
+        job = jobs.enqueue('test.fail')
+
+        with override_settings(JOB_RETRY_BASE=60):
+            jobs.execute(jobs.claim(1)[0].pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, job.created_at + timedelta(seconds=59))
+
+        Job.objects.update(run_at=job.created_at)
+        self.assertIn('failed: 1', self.run_worker())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+    def test_future_jobs_wait_for_their_time(self):
+        jobs.enqueue('test.record', delay=3600, n=1)
+
+        self.run_worker()
+        self.assertEqual(self.calls, [])
+        self.assertTrue(Job.objects.filter(name='jobs.prune', status='queued').exists())
+
+    def test_concurrent_claims_do_not_overlap(self):
+        for n in range(6):
+            jobs.enqueue('test.record', n=n)
+
+        first = jobs.claim(4, 'a')
+        second = jobs.claim(4, 'b')
+
+        self.assertEqual((len(first), len(second)), (4, 2))
+        self.assertFalse({job.pk for job in first} & {job.pk for job in second})
+
+    def test_stale_running_jobs_are_requeued(self):
+        jobs.enqueue('test.record')
+        jobs.claim(1, 'gone')
+        Job.objects.update(locked_at=Job.objects.get().locked_at - timedelta(hours=1))
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(Job.objects.get().status, 'queued')
+
+    def test_heartbeat_keeps_a_long_job_from_being_requeued(self):
+        jobs.enqueue('test.record')
+        job = jobs.claim(1, 'w1')[0]
+        Job.objects.update(locked_at=job.locked_at - timedelta(hours=1))
+
+        self.assertEqual(jobs.heartbeat([job.pk], 'w1'), 1)
+        self.assertEqual(jobs.requeue_stale(), 0)
+        self.assertEqual(jobs.heartbeat([job.pk], 'w2'), 0)
+
+    def test_worker_that_lost_its_lock_does_not_record_the_outcome(self):
+        jobs.enqueue('test.record')
+        job = jobs.claim(1, 'w1')[0]
+        Job.objects.update(locked_at=job.locked_at - timedelta(hours=1))
+        jobs.requeue_stale()
+        jobs.claim(1, 'w2')
+
+        self.assertEqual(jobs.execute(job.pk, 'w1'), 'lost')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('running', 'w2', 0))
+
+    def test_invitations_are_queued_instead_of_sent_inline(self):
+        user = User.objects.create_user(username='inviter', password='x')
+        Profile.objects.create(user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post(reverse('send-invitation'), {'phone': '0911000000'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        job = Job.objects.get(name='team.send_invitation')
+        self.assertEqual(job.kwargs['phone'], '0911000000')
+        self.assertNotIn(user.profile.invite_code, json.dumps(job.kwargs))
+
+    def test_invitation_log_masks_the_phone_and_omits_the_text(self):
+        user = User.objects.create_user(username='inviter', password='x')
+        profile = Profile.objects.create(user=user)
+
+        with self.assertLogs('cat.tasks', 'INFO') as logs:
+            jobs.enqueue('team.send_invitation', user_id=user.pk, phone='0911000042')
+            jobs.execute(jobs.claim(1)[0].pk)
+
+        record = logs.records[0]
+        self.assertEqual(record.user_id, user.pk)
+        self.assertEqual(record.phone, '********42')
+        self.assertFalse(hasattr(record, 'text'))
+        self.assertNotIn('0911000042', logs.output[0])
+        self.assertNotIn(profile.invite_code, logs.output[0])
+        self.assertIn('not sent', logs.output[0])
+
+    @override_settings(INVITATION_SENDER='sms.send')
+    def test_invitations_go_to_the_configured_sender(self):
+        user = User.objects.create_user(username='inviter', password='x')
+        profile = Profile.objects.create(user=user)
+        sender = mock.Mock()
+
+        with mock.patch('cat.tasks.import_string', return_value=sender) as resolve:
+            with self.assertLogs('cat.tasks', 'INFO') as logs:
+                jobs.enqueue('team.send_invitation', user_id=user.pk, phone='0911000042', greeting='Hi')
+                jobs.execute(jobs.claim(1)[0].pk)
+
+        resolve.assert_called_once_with('sms.send')
+        sender.assert_called_once_with('0911000042', tasks.invitation_text('Hi', profile.invite_code))
+        self.assertEqual(logs.records[0].getMessage(), 'Invitation sent')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='x')
+        Transaction.objects.create(customer=self.alice, type='deposit', amount=Decimal('100.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def withdraw(self, amount, key='retry-1'):
+        return self.client.post(reverse('api_withdraw'), {'amount': amount}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response_with_one_lookup(self):
+        first = self.withdraw('10.00')
+        with self.assertNumQueries(1):
+            replay = self.withdraw('10.00')
+
+        self.assertEqual((replay.status_code, replay.json()), (first.status_code, first.json()))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.filter(type='withdraw').count(), 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.withdraw('10.00')
+
+        self.assertEqual(self.withdraw('20.00').status_code, 422)
+        self.assertEqual(Transaction.objects.filter(type='withdraw').count(), 1)
+
+    def test_keys_are_scoped_per_user(self):
+        self.withdraw('10.00')
+        bob = User.objects.create_user(username='bob', password='x')
+        Transaction.objects.create(customer=bob, type='deposit', amount=Decimal('50.00'))
+        self.client.force_authenticate(bob)
+
+        self.assertNotIn('Idempotent-Replayed', self.withdraw('10.00'))
+        self.assertEqual(Transaction.objects.filter(type='withdraw').count(), 2)
+
+    def test_server_errors_are_not_stored(self):
+        vip = VIP.objects.create(
+            title='V1', description='', price=Decimal('30.00'), daily_income=Decimal('2.00'), income_days=30, upgrade=1,
+        )
+        UserVIP.objects.create(user=self.alice, vip=vip)
+        url = reverse('claim-vip-income', args=[vip.pk])
+
+        # No profile yet, so the claim fails half way and rolls back
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='claim-1').status_code, 500)
+        Profile.objects.create(user=self.alice)
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY='claim-1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Transaction.objects.filter(type='profit').count(), 1)
+
+    def test_expired_keys_run_again_and_are_pruned(self):
+        self.withdraw('10.00')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertNotIn('Idempotent-Replayed', self.withdraw('10.00'))
+        self.assertEqual(Transaction.objects.filter(type='withdraw').count(), 2)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(idempotency.prune_expired(), 1)
+
+    def test_requests_without_a_key_are_unchanged(self):
+        self.client.post(reverse('api_withdraw'), {'amount': '10.00'}, format='json')
+        self.client.post(reverse('api_withdraw'), {'amount': '10.00'}, format='json')
+
+        self.assertEqual(Transaction.objects.filter(type='withdraw').count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RechargeHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def history(self, **params):
+        response = self.client.get(reverse('recharge_history'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_walks_every_deposit_once_newest_first(self):
+        deposits = [
+            Transaction.objects.create(customer=self.alice, type='deposit', amount=Decimal(n + 1)) for n in range(5)
+        ]
+        Transaction.objects.create(customer=self.alice, type='withdraw', amount=Decimal('1'))
+        # Two rows sharing a timestamp must not be skipped at a page boundary
+        Transaction.objects.filter(pk__in=[deposits[1].pk, deposits[2].pk]).update(date=deposits[2].date)
+
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                page = self.history(limit=2, **({'cursor': cursor} if cursor else {}))
+            seen += [row['id'] for row in page['transactions']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [d.pk for d in reversed(deposits)])
+
+    def test_open_recharge_requests_are_merged_on_request(self):
+        Transaction.objects.create(customer=self.alice, type='deposit', amount=Decimal('50'))
+        pending = RechargeRequest.objects.create(
+            user=self.alice, amount=Decimal('20'), fee=Decimal('0'), reference_number='REF1',
+        )
+        RechargeRequest.objects.create(user=self.alice, amount=Decimal('50'), fee=Decimal('0'), status='completed')
+
+        self.assertEqual(len(self.history()['transactions']), 1)
+        with self.assertNumQueries(2):
+            page = self.history(include_requests=1, limit=1)
+        self.assertEqual(
+            [(row['source'], row['transaction_id']) for row in page['transactions']],
+            [('request', pending.transaction_id)],
+        )
+        rest = self.history(include_requests=1, cursor=page['next_cursor'])
+        self.assertEqual([row['source'] for row in rest['transactions']], ['transaction'])
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(reverse('recharge_history'), {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class HotQueryPlanTests(QueryPlanMixin, TestCase):
+    """The per-user reads every screen makes must stay on an index."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='x')
+        seed_user_activity(self.user, 6)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_balance_sums_are_index_only(self):
+        user = self.user
+        self.assertIndexedQueries('cat_transaction', lambda: Transaction.objects.filter(customer=user).aggregate(
+            deposit=Sum('amount', filter=Q(type='deposit')),
+            withdraw=Sum('amount', filter=Q(type='withdraw')),
+        ), index_only=True)
+        self.assertIndexedQueries('cat_transaction', lambda: self.client.post(reverse('api_withdraw'), {'amount': 0}),
+                                  index_only=True)
+        self.assertIndexedQueries('cat_commission', lambda: Commission.objects.filter(
+            user=user, level=1).aggregate(total=Sum('amount')), index_only=True)
+        self.assertIndexedQueries('cat_usermainproject', lambda: UserMainProject.objects.filter(
+            user=user, status='active').aggregate(total=Sum('invested_amount')), index_only=True)
+
+    def test_histories_read_in_index_order(self):
+        for table, route in [
+            ('cat_transaction', 'api_withdraw_history'),
+            ('cat_transaction', 'recharge_history'),
+            ('cat_commission', 'get-commission-history'),
+        ]:
+            with self.subTest(route=route, table=table):
+                self.assertIndexedQueries(table, lambda: self.client.get(reverse(route)))
+        for table in ('cat_usermainproject', 'cat_uservip'):
+            with self.subTest(table=table):
+                self.assertIndexedQueries(table, lambda: portfolio.build(self.user.pk))
+        self.assertIndexedQueries(
+            'cat_transaction', lambda: list(Transaction.objects.filter(customer=self.user).order_by('-date')[:5])
+        )
+
+    def test_full_scans_are_reported(self):
+        with self.assertRaisesMessage(AssertionError, 'full scan'):
+            self.assertIndexedQueries('cat_transaction', lambda: list(Transaction.objects.filter(amount=1)))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, LEDGER_HOT_DAYS=90)
+class LedgerArchiveTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        override = override_settings(LEDGER_ARCHIVE_DIR=self.archive_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.alice = User.objects.create_user(username='alice', password='x')
+        self.bob = User.objects.create_user(username='bob', password='x')
+        now = timezone.now()
+        self.entry(self.alice, 'deposit', '100.00', now - timedelta(days=400))
+        self.entry(self.alice, 'withdraw', '30.00', now - timedelta(days=200))
+        self.entry(self.alice, 'profit', '5.00', now - timedelta(days=200, hours=1))
+        self.entry(self.bob, 'deposit', '70.00', now - timedelta(days=200))
+        self.entry(self.alice, 'deposit', '50.00', now)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def entry(self, user, kind, amount, when):
+        entry = Transaction.objects.create(customer=user, type=kind, amount=Decimal(amount))
+        Transaction.objects.filter(pk=entry.pk).update(date=when)
+        return entry
+
+    def streamed_history(self, **params):
+        response = self.client.get(reverse('transaction-archive'), params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_archiving_keeps_balances_and_shrinks_the_hot_table(self):
+        out = StringIO()
+        call_command('archive_ledger', stdout=out)
+
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(ArchivedTransaction.objects.count(), 4)
+        self.assertEqual(out.getvalue().count('Archived'), 2)
+        self.assertEqual(ledger.balance(self.alice), Decimal('120.00'))
+        self.assertEqual(self.client.get(reverse('api_balance')).json()['balance'], 120.0)
+        self.assertEqual(
+            set(LedgerPeriod.objects.filter(customer=self.alice).values_list('type', 'total', 'count')),
+            {('deposit', Decimal('100.00'), 1), ('withdraw', Decimal('30.00'), 1), ('profit', Decimal('5.00'), 1)},
+        )
+
+        call_command('archive_ledger', stdout=out)
+        self.assertEqual(ArchivedTransaction.objects.count(), 4)
+
+    def test_exported_months_stream_back_from_compressed_files(self):
+        call_command('archive_ledger', '--export', '--export-days', '300', stdout=StringIO())
+
+        export = LedgerExport.objects.get()
+        self.assertEqual(export.rows, 1)
+        self.assertEqual(ArchivedTransaction.objects.count(), 3)
+        with gzip.open(f'{self.archive_dir}/{export.path}', 'rt') as handle:
+            self.assertEqual(json.loads(handle.read())['amount'], '100.00')
+        self.assertEqual(ledger.balance(self.alice), Decimal('120.00'))
+
+        rows = self.streamed_history()
+        self.assertEqual([(row['type'], row['amount']) for row in rows], [
+            ('withdraw', '30.00'), ('profit', '5.00'), ('deposit', '100.00'),
+        ])
+        period = timezone.localtime(timezone.now() - timedelta(days=400)).strftime('%Y-%m')
+        self.assertEqual(len(self.streamed_history(period=period)), 1)
+        self.assertEqual(self.client.get(reverse('transaction-archive'), {'period': 'soon'}).status_code, 400)
+
+    def test_rows_archived_into_an_exported_month_are_merged_into_its_file(self):
+        call_command('archive_ledger', '--export', '--export-days', '300', stdout=StringIO())
+        first = LedgerExport.objects.get()
+        self.entry(self.alice, 'withdraw', '40.00', timezone.now() - timedelta(days=400, hours=2))
+        self.entry(self.bob, 'deposit', '15.00', timezone.now() - timedelta(days=400, hours=3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_ledger', '--export', '--export-days', '300', stdout=StringIO())
+
+        export = LedgerExport.objects.get()
+        self.assertEqual(export.rows, 3)
+        self.assertNotEqual(export.path, first.path)
+        self.assertFalse(os.path.exists(f'{self.archive_dir}/{first.path}'))
+        self.assertEqual(ledger.balance(self.alice), Decimal('80.00'))
+        period = timezone.localtime(timezone.now() - timedelta(days=400)).strftime('%Y-%m')
+        self.assertEqual(
+            [(row['type'], row['amount']) for row in self.streamed_history(period=period)],
+            [('deposit', '100.00'), ('withdraw', '40.00')],
+        )
+        self.assertEqual(
+            [row['amount'] for row in ledger.read_chunk(export.chunks.get(customer_id=self.bob.pk))], ['15.00'],
+        )
+
+    def test_the_scheduled_job_only_archives_when_enabled(self):
+        tasks.archive_ledger()
+        self.assertEqual(ArchivedTransaction.objects.count(), 0)
+
+        with override_settings(LEDGER_ARCHIVE_SCHEDULED=True):
+            tasks.archive_ledger()
+        self.assertEqual(ArchivedTransaction.objects.count(), 4)
+
+
+class ReconcileBalancesTests(TestCase):
+    def setUp(self):
+        self.users = {}
+        for name, ledger_amount, profile_amount, balance_amount in [
+            ('even', '50.00', '50.00', '50.00'),
+            ('profile-off', '80.00', '95.50', '80.00'),
+            ('balance-off', '20.00', '20.00', '12.00'),
+            ('no-balance-row', '10.00', '10.00', None),
+        ]:
+            user = User.objects.create_user(username=name, password='x')
+            Transaction.objects.create(customer=user, type='deposit', amount=Decimal(ledger_amount) + 5)
+            Transaction.objects.create(customer=user, type='withdraw', amount=Decimal('5.00'))
+            Profile.objects.create(
+                user=user, balance=Decimal(profile_amount), available_balance=Decimal(profile_amount) - 1,
+            )
+            if balance_amount is not None:
+                Balance.objects.create(customer=user, amount=Decimal(balance_amount))
+            self.users[name] = user
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_balances', '--chunk-size', '3', *args, stdout=out)
+        return out.getvalue()
+
+    def test_reports_drift_against_the_ledger(self):
+        report = self.reconcile()
+
+        self.assertIn('Users scanned: 4', report)
+        self.assertIn('Profile.balance drift: 1 users, 15.50 ETB', report)
+        self.assertIn('Balance.amount drift: 1 users, 8.00 ETB in total (1 missing rows)', report)
+        self.assertIn(f"{self.users['profile-off'].pk}: 80.00 / 95.50 / 80.00", report)
+        self.assertIn('Profile.balance drift: 0 users', self.reconcile('--tolerance', '20'))
+
+    def test_csv_lists_every_drifted_user_and_nothing_is_written(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        csv_path = os.path.join(directory, 'drift.csv')
+
+        self.reconcile('--csv', csv_path)
+
+        with open(csv_path) as handle:
+            self.assertEqual(len(handle.read().splitlines()), 4)
+        self.assertEqual(Profile.objects.get(user=self.users['profile-off']).balance, Decimal('95.50'))
+        self.assertFalse(Balance.objects.filter(customer=self.users['no-balance-row']).exists())
+
+    @override_settings(SECURE_SSL_REDIRECT=False)
+    def test_claims_gifts_and_project_purchases_are_not_drift(self):
+        user = self.users['even']
+        project = MainProject.objects.create(
+            title='Farm', description='', price=Decimal('20'), daily_income=Decimal('3'),
+            total_income=Decimal('90'), total_units=10, available_units=10,
+        )
+        GiftCode.objects.create(code='WELCOME', total_amount=Decimal('100'), per_user_amount=Decimal('10'))
+        client = APIClient()
+        client.force_authenticate(user)
+
+        self.assertEqual(client.post(reverse('redeem_gift_code'), {'code': 'WELCOME'}, format='json').status_code, 200)
+        self.assertEqual(client.post(
+            reverse('invest-in-main-project'), {'project_id': project.pk, 'units': 1}, format='json',
+        ).status_code, 201)
+        self.assertEqual(client.post(
+            reverse('claim-project-income'), {'project_id': project.pk}, format='json',
+        ).status_code, 200)
+
+        self.assertEqual(Profile.objects.get(user=user).balance, Decimal('43.00'))
+        self.assertEqual(Transaction.objects.filter(customer=user, type='profit').count(), 1)
+        self.assertIn('Profile.balance drift: 1 users, 15.50 ETB', self.reconcile())
+
+    def test_missing_numpy_is_a_command_error(self):
+        package = sys.modules['cat']
+        with mock.patch.dict('sys.modules', {'cat.reconciliation': None}), mock.patch.dict(vars(package)):
+            vars(package).pop('reconciliation', None)
+            with self.assertRaisesMessage(CommandError, 'numpy'):
+                self.reconcile()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class PortfolioTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='x')
+        Profile.objects.create(user=self.alice)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def project(self, title='P1', **fields):
+        return MainProject.objects.create(
+            title=title, description='', price=Decimal('50.00'), daily_income=Decimal('3.00'),
+            cycle_days=10, total_income=Decimal('30.00'), total_units=100, available_units=100, **fields,
+        )
+
+    def invest(self, project, units=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            return UserMainProject.objects.create(
+                user=self.alice, main_project=project, units=units, invested_amount=project.price * units,
+            )
+
+    def investments(self):
+        return self.client.get(reverse('user-investments')).json()
+
+    def test_purchase_stores_the_portfolio(self):
+        Transaction.objects.create(customer=self.alice, type='deposit', amount=Decimal('100.00'))
+        vip = VIP.objects.create(
+            title='V1', description='', price=Decimal('30.00'), daily_income=Decimal('2.00'), income_days=30, upgrade=1,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('api_buy_vip'), {'vip_id': vip.pk}, format='json')
+
+        self.assertEqual(Portfolio.objects.get(user=self.alice).data['vips'][0]['item']['title'], 'V1')
+        with self.assertNumQueries(1):
+            data = self.investments()
+        user_vip = UserVIP.objects.get(user=self.alice)
+        self.assertEqual(data['total_count'], 1)
+        self.assertEqual(data['vips'][0]['status'], 'completed')
+        self.assertFalse(data['vips'][0]['can_claim'])
+        self.assertEqual(
+            data['vips'][0]['next_claim_time'],
+            (user_vip.last_claim_time + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+    def test_claim_moves_the_next_claim_time(self):
+        holding = self.invest(self.project())
+        self.assertTrue(self.investments()['main_projects'][0]['can_claim'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('claim-project-income'), {'project_id': holding.main_project_id},
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+
+        holding.refresh_from_db()
+        item = self.investments()['main_projects'][0]
+        self.assertFalse(item['can_claim'])
+        self.assertEqual(item['last_claim_time'], holding.last_claim_time.strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(
+            item['next_claim_time'], (holding.last_claim_time + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+    def test_query_count_is_fixed_whatever_the_holdings(self):
+        for count in (1, 20):
+            for index in range(count):
+                self.invest(self.project(title=f'P{count}-{index}'))
+            # Creating projects bumps the catalog stamp; the first read rebuilds.
+            self.investments()
+            # The stored row with the stamps, then the units left per project.
+            with self.subTest(count=count), self.assertNumQueries(2):
+                data = self.investments()
+            self.assertEqual(data['total_count'], UserMainProject.objects.filter(user=self.alice).count())
+
+    def test_other_users_purchases_do_not_rebuild_the_portfolio(self):
+        project = self.project()
+        self.invest(project)
+        self.investments()
+        stored_at = Portfolio.objects.get(user=self.alice).updated_at
+
+        bob = User.objects.create_user(username='bob', password='x')
+        Profile.objects.create(user=bob, balance=Decimal('500'))
+        self.client.force_authenticate(bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('invest-in-main-project'), {'project_id': project.pk, 'units': 2},
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.force_authenticate(self.alice)
+
+        with self.assertNumQueries(2):
+            item = self.investments()['main_projects'][0]
+        self.assertEqual(item['available_units'], 98)
+        self.assertEqual(Portfolio.objects.get(user=self.alice).updated_at, stored_at)
+
+    def test_available_units_are_read_when_serving(self):
+        project = self.project()
+        self.invest(project)
+        self.investments()
+
+        # Other users' purchases only touch the project row.
+        MainProject.objects.filter(pk=project.pk).update(available_units=7)
+
+        self.assertNotIn('available_units', Portfolio.objects.get(user=self.alice).data['main_projects'][0]['item'])
+        self.assertEqual(self.investments()['main_projects'][0]['available_units'], 7)
+
+    def test_catalog_edits_rebuild_on_next_read(self):
+        project = self.project()
+        self.invest(project)
+        self.investments()
+
+        project.title = 'Renamed'
+        project.save()
+
+        self.assertEqual(self.investments()['main_projects'][0]['title'], 'Renamed')
+
+    def test_accrued_income_and_cycle_end_follow_the_clock(self):
+        holding = self.invest(self.project(), units=2)
+        data = portfolio.load(self.alice.pk)
+
+        item = portfolio.render(data, now=holding.purchase_date + timedelta(days=3, hours=5))['main_projects'][0]
+        self.assertEqual(item['accrued_income'], 18.0)
+        self.assertEqual(item['cycle_end'], (holding.purchase_date + timedelta(days=10)).strftime('%Y-%m-%d %H:%M:%S'))
+
+        item = portfolio.render(data, now=holding.purchase_date + timedelta(days=40))['main_projects'][0]
+        self.assertEqual(item['accrued_income'], 60.0)
+
+    def test_deleted_holdings_drop_the_stored_portfolio(self):
+        holding = self.invest(self.project())
+        self.assertTrue(Portfolio.objects.filter(user=self.alice).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            holding.delete()
+
+        self.assertFalse(Portfolio.objects.filter(user=self.alice).exists())
+        self.assertEqual(self.investments()['total_count'], 0)
@@ -0,0 +1,100 @@
+"""
+Websocket authentication with DRF tokens.
+
+The Flutter app has no session cookie, so it authenticates the handshake
+with the same token it sends to the REST API, either as
+
+* ``ws/...?token=<key>``, or
+* the subprotocol pair ``token, <key>``. The server then accepts the
+  ``token`` subprotocol, as browsers require.
+
+Every handshake looks the token up again (one query), so a logout or a
+deactivated account takes effect on the next connect in every process.
+Concurrent handshakes for the same token share that query, which keeps a
+reconnect storm after a deploy to about one query per user. Tokens that
+don't resolve to an active user are remembered for WS_AUTH_NEGATIVE_TTL
+seconds, so a client retrying a dead token doesn't hit the database either.
+
+Handshakes without a token fall through to the session-cookie stack that
+admin pages and the web client use.
+"""
+import asyncio
+import hashlib
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework.authtoken.models import Token
+
+SUBPROTOCOL = 'token'
+
+
+def token_from_scope(scope):
+    """Return ``(key, subprotocol)``; ``subprotocol`` is set when the key came that way."""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0], None
+    subprotocols = list(scope.get('subprotocols') or ())
+    if SUBPROTOCOL in subprotocols:
+        position = subprotocols.index(SUBPROTOCOL)
+        if position + 1 < len(subprotocols):
+            return subprotocols[position + 1], SUBPROTOCOL
+    return None, None
+
+
+def cache_key(key):
+    # Hash the token so raw credentials never end up in the cache backend.
+    return 'ws_auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def _load_user(key):
+    token = Token.objects.select_related('user').filter(key=key).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+class TokenAuthMiddleware:
+    def __init__(self, inner):
+        self.inner = inner
+        self.session_app = AuthMiddlewareStack(inner)
+        self._inflight = {}
+
+    async def __call__(self, scope, receive, send):
+        key, subprotocol = token_from_scope(scope) if scope['type'] == 'websocket' else (None, None)
+        if key is None:
+            return await self.session_app(scope, receive, send)
+
+        user = await self.resolve_user(key)
+        scope = dict(scope, user=user or AnonymousUser())
+        if subprotocol:
+            async def send_with_subprotocol(message):
+                if message['type'] == 'websocket.accept' and not message.get('subprotocol'):
+                    message = dict(message, subprotocol=subprotocol)
+                await send(message)
+            return await self.inner(scope, receive, send_with_subprotocol)
+        return await self.inner(scope, receive, send)
+
+    async def resolve_user(self, key):
+        """The active user owning ``key``, or None."""
+        entry = cache_key(key)
+        if await cache.aget(entry) is not None:
+            return None  # a known-bad token
+        lookup = self._inflight.get(entry)
+        if lookup is None:
+            lookup = self._inflight[entry] = asyncio.ensure_future(self._fetch(entry, key))
+            lookup.add_done_callback(lambda _: self._inflight.pop(entry, None))
+        return await asyncio.shield(lookup)
+
+    async def _fetch(self, entry, key):
+        user = await database_sync_to_async(_load_user)(key)
+        if user is None:
+            await cache.aset(entry, False, getattr(settings, 'WS_AUTH_NEGATIVE_TTL', 30))
+        return user
+
+
+def TokenAuthMiddlewareStack(inner):
+    return TokenAuthMiddleware(inner)
@@ -0,0 +1,119 @@
+"""
+Bounded outbound queues for websocket fan-out.
+
+Each chat connection gets an ``OutboundQueue``. Group handlers only append
+to it and return, so a slow client can no longer hold up the consumer or
+grow an unbounded backlog in process memory. A writer task drains the
+queue; whatever piled up while the previous frame was being written goes
+out as one ``batch`` frame.
+
+When the queue is full the policy decides what goes:
+
+* ``drop_oldest`` - discard the oldest pending message.
+* ``coalesce`` - collapse the whole backlog; the next frame reports how
+  many messages were ``skipped`` so the client can re-fetch history.
+"""
+import asyncio
+import json
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('drop_oldest', 'coalesce')
+
+
+class OutboundMetrics:
+    """Process-wide counters for the staff metrics endpoint."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.messages = 0
+        self.batched_frames = 0
+        self.dropped = 0
+        self.congested_connections = 0
+
+    def snapshot(self):
+        return {
+            'frames': self.frames,
+            'messages': self.messages,
+            'batched_frames': self.batched_frames,
+            'dropped': self.dropped,
+            'congested_connections': self.congested_connections,
+        }
+
+
+outbound_metrics = OutboundMetrics()
+
+
+class OutboundQueue:
+    def __init__(self, send, maxsize=100, policy='drop_oldest', batch_max=50, name=''):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown outbound policy {policy!r}; expected one of {POLICIES}')
+        self._send = send
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_max = batch_max
+        self.name = name
+        self.dropped = 0
+        self._pending = deque()
+        self._skipped = 0
+        self._wakeup = asyncio.Event()
+        self._writer = None
+
+    def put(self, message):
+        """Queue ``message`` for the client without waiting for the socket."""
+        if len(self._pending) >= self.maxsize:
+            if self.policy == 'coalesce':
+                dropped = len(self._pending)
+                self._skipped += dropped
+                self._pending.clear()
+            else:
+                dropped = 1
+                self._pending.popleft()
+            self._record_drop(dropped)
+        self._pending.append(message)
+        self._wakeup.set()
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._drain())
+
+    def _record_drop(self, count):
+        if not self.dropped:
+            outbound_metrics.congested_connections += 1
+            logger.warning('Outbound queue full, dropping frames', extra={
+                'event': 'chat.backpressure', 'channel': self.name, 'policy': self.policy,
+            })
+        self.dropped += count
+        outbound_metrics.dropped += count
+
+    async def _drain(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                count = min(self.batch_max, len(self._pending))
+                batch = [self._pending.popleft() for _ in range(count)]
+                skipped, self._skipped = self._skipped, 0
+                if count == 1 and not skipped:
+                    frame = batch[0]
+                else:
+                    frame = {'type': 'batch', 'messages': batch}
+                    if skipped:
+                        frame['skipped'] = skipped
+                    outbound_metrics.batched_frames += 1
+                await self._send(json.dumps(frame))
+                outbound_metrics.frames += 1
+                outbound_metrics.messages += count
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        self._pending.clear()
@@ -1,28 +1,85 @@
 import json
+import logging
+import uuid
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.utils import timezone
+
+from cat import moderation
+
+from .backpressure import OutboundQueue
+from .persistence import get_message_buffer
+from .rooms import resolve_room, room_history
+
+logger = logging.getLogger(__name__)
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        self.room_group_name = "public_chat"
+        kwargs = self.scope.get("url_route", {}).get("kwargs", {})
+        self.room = resolve_room(self.scope.get("user"), kwargs.get("kind"), kwargs.get("name"))
+        if self.room is None:
+            await self.close()
+            return
+
+        self.room_group_name = self.room.group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        self.outbox = OutboundQueue(
+            self._send_text,
+            maxsize=getattr(settings, "CHAT_OUTBOX_SIZE", 100),
+            policy=getattr(settings, "CHAT_OUTBOX_POLICY", "drop_oldest"),
+            batch_max=getattr(settings, "CHAT_BATCH_MAX", 50),
+            name=self.channel_name,
+        )
+        history = await room_history.join(self.room.key)
         await self.accept()
-        print("✅ WebSocket connected:", self.channel_name)
+        await self.send(text_data=json.dumps({
+            "type": "history",
+            "room": self.room.key,
+            "messages": history,
+        }))
+        logger.info("WebSocket connected", extra={
+            "event": "chat.connect", "channel": self.channel_name, "room": self.room.key,
+        })
 
     async def disconnect(self, close_code):
+        if getattr(self, "room", None) is None:
+            return
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-        print("❌ WebSocket disconnected:", close_code)
+        room_history.leave(self.room.key)
+        # Don't leave this socket's last messages waiting on the timer.
+        await get_message_buffer().flush()
+        await self.outbox.close()
+        logger.info("WebSocket disconnected", extra={
+            "event": "chat.disconnect", "channel": self.channel_name, "close_code": close_code,
+        })
 
     async def receive(self, text_data):
-        print("📩 Message received:", text_data)
+        logger.info("Message received", extra={"event": "chat.receive", "channel": self.channel_name})
         data = json.loads(text_data)
-        message = data["message"]
+        content_filter = moderation.cached_filter() or await database_sync_to_async(moderation.get_filter)()
+        checked = content_filter.check(data["message"])
+        message = checked.text
         sender = data.get("sender", "Anonymous")
+        user = self.scope.get("user")
+        if user is not None and user.is_authenticated:
+            sender = user.username
+        timestamp = timezone.now()
+
+        # Stored in the background; the sender gets a "saved" frame with the id.
+        get_message_buffer().add(
+            sender, message, timestamp,
+            reply_channel=self.channel_name, client_id=data.get("client_id"),
+            room=self.room.key, is_support=self.room.is_support, is_flagged=checked.flagged,
+        )
 
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -30,13 +87,32 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 "type": "chat_message",
                 "message": message,
                 "sender": sender,
+                "room": self.room.key,
+                "timestamp": timestamp.isoformat(),
+                "uid": uuid.uuid4().hex,
             }
         )
 
     async def chat_message(self, event):
-        print("📤 Broadcasting:", event)
-        await self.send(text_data=json.dumps({
+        logger.debug("Broadcasting", extra={"event": "chat.broadcast", "channel": self.channel_name})
+        if "uid" in event:
+            room_history.record(event["room"], {
+                "uid": event["uid"],
+                "sender": event["sender"],
+                "message": event["message"],
+                "timestamp": event["timestamp"],
+            })
+        self.outbox.put({
             "message": event["message"],
             "sender": event["sender"],
-        }))
+            "room": event.get("room", self.room.key),
+        })
+
+    async def _send_text(self, text):
+        await self.send(text_data=text)
 
+    async def chat_saved(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "saved",
+            "messages": event["messages"],
+        }))
@@ -0,0 +1,419 @@
+"""
+Channel layers that fan out across worker processes on one host.
+
+InMemoryChannelLayer only reaches consumers in its own process, so with more
+than one worker a ``group_send`` misses every socket held by the others.
+The layers here keep its per-process queues and group membership and add a
+bus between workers:
+
+* ``UnixSocketChannelLayer`` - every worker binds a datagram socket in a
+  shared directory and publishes to its peers' sockets. No broker; meant for
+  local multi-worker runs.
+* ``PostgresChannelLayer`` - LISTEN/NOTIFY on the application database, for
+  deployments that already have Postgres (Render) but no Redis.
+
+Remote traffic is batched: group messages and sends to channels owned by
+another worker are queued for ``batch_interval`` seconds (or until
+``batch_size`` messages), coalesced per destination and published as one
+payload. Local members are still delivered to immediately.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory layer plus a bus to the other workers. Subclasses implement
+    ``_start_bus``, ``_stop_bus`` and ``_publish``, and hand received
+    payloads to ``_deliver``.
+    """
+
+    def __init__(self, batch_interval=0.005, batch_size=100, **kwargs):
+        super().__init__(**kwargs)
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.stats = {'published': 0, 'payloads': 0, 'received': 0, 'dropped': 0}
+        self._groups_out = {}
+        self._channels_out = {}
+        self._pending = 0
+        self._flush_task = None
+        self._loop = None
+
+    # Channel names carry the owning worker so peers can tell who delivers them.
+
+    async def new_channel(self, prefix='specific.'):
+        return f'{prefix}{self.client_prefix}!{uuid.uuid4().hex[:12]}'
+
+    def _is_local(self, channel):
+        if '!' not in channel:
+            return True
+        return channel.split('!', 1)[0].endswith(self.client_prefix)
+
+    async def send(self, channel, message):
+        if self._is_local(channel):
+            return await super().send(channel, message)
+        await self._ensure_bus()
+        self._queue(self._channels_out, channel, message)
+
+    async def receive(self, channel):
+        await self._ensure_bus()
+        return await super().receive(channel)
+
+    async def group_add(self, group, channel):
+        await self._ensure_bus()
+        await super().group_add(group, channel)
+
+    async def group_send(self, group, message):
+        await super().group_send(group, message)
+        await self._ensure_bus()
+        self._queue(self._groups_out, group, message)
+
+    async def flush(self):
+        await super().flush()
+        self._groups_out, self._channels_out, self._pending = {}, {}, 0
+
+    async def close(self):
+        if self._loop is not None:
+            await self._flush_outbox()
+            await self._stop_bus()
+            self._loop = None
+
+    # =======================
+    # BATCHING
+    # =======================
+
+    def _queue(self, outbox, name, message):
+        outbox.setdefault(name, []).append(message)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._schedule_flush(0)
+        elif self._flush_task is None:
+            self._schedule_flush(self.batch_interval)
+
+    def _schedule_flush(self, delay):
+        if self._flush_task is not None and delay:
+            return
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+
+        async def flush_later():
+            if delay:
+                await asyncio.sleep(delay)
+            self._flush_task = None
+            await self._flush_outbox()
+
+        self._flush_task = asyncio.ensure_future(flush_later())
+
+    async def _flush_outbox(self):
+        if not self._pending:
+            return
+        payload = {'from': self.client_prefix, 'groups': self._groups_out, 'channels': self._channels_out}
+        self.stats['published'] += self._pending
+        self.stats['payloads'] += 1
+        self._groups_out, self._channels_out, self._pending = {}, {}, 0
+        try:
+            await self._publish(payload)
+        except Exception:
+            logger.exception('Channel layer publish failed')
+
+    def _encode(self, payload):
+        return json.dumps(payload, separators=(',', ':')).encode()
+
+    def _split(self, payload, limit):
+        """
+        Encode ``payload`` in pieces of at most ``limit`` bytes, falling back
+        to per-destination chunks. A single message that can never fit is
+        dropped and logged.
+        """
+        data = self._encode(payload)
+        if len(data) <= limit:
+            yield data
+            return
+        sender = payload['from']
+        for key in ('groups', 'channels'):
+            for name, messages in payload[key].items():
+                chunk = []
+                for message in messages:
+                    if len(self._encode({'from': sender, key: {name: chunk + [message]}})) <= limit:
+                        chunk.append(message)
+                        continue
+                    if chunk:
+                        yield self._encode({'from': sender, key: {name: chunk}})
+                    chunk = [message]
+                    if len(self._encode({'from': sender, key: {name: chunk}})) > limit:
+                        self.stats['dropped'] += 1
+                        logger.error('Dropping message for %s: larger than %d bytes', name, limit)
+                        chunk = []
+                if chunk:
+                    yield self._encode({'from': sender, key: {name: chunk}})
+
+    # =======================
+    # DELIVERY
+    # =======================
+
+    async def _ensure_bus(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        if self._loop is not None:
+            # The previous event loop is gone (e.g. repeated asyncio.run); its
+            # bus tasks died with it.
+            self._flush_task = None
+            await self._stop_bus()
+        self._loop = loop
+        await self._start_bus()
+
+    async def _deliver(self, data):
+        payload = json.loads(data)
+        if payload.get('from') == self.client_prefix:
+            return
+        for group, messages in payload.get('groups', {}).items():
+            for message in messages:
+                self.stats['received'] += 1
+                await super().group_send(group, message)
+        for channel, messages in payload.get('channels', {}).items():
+            if not self._is_local(channel):
+                continue
+            for message in messages:
+                self.stats['received'] += 1
+                try:
+                    await super().send(channel, message)
+                except ChannelFull:
+                    self.stats['dropped'] += 1
+
+    async def _start_bus(self):
+        raise NotImplementedError
+
+    async def _stop_bus(self):
+        raise NotImplementedError
+
+    async def _publish(self, payload):
+        raise NotImplementedError
+
+
+# =======================
+# UNIX DATAGRAM SOCKETS
+# =======================
+
+class UnixSocketChannelLayer(BroadcastChannelLayer):
+    """
+    Each worker binds ``<path>/<client_prefix>.sock``; publishing sends the
+    payload to every other socket in the directory. Sockets whose worker has
+    gone away are unlinked on the first failed send.
+    """
+
+    PEER_REFRESH = 1.0
+    MAX_DATAGRAM = 200 * 1024
+
+    def __init__(self, path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or os.path.join(tempfile.gettempdir(), 'channels-layer')
+        self._sock = None
+        self._address = None
+        self._inbox = None
+        self._reader = None
+        self._peers = []
+        self._peers_at = 0.0
+
+    async def _start_bus(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._address = os.path.join(self.path, f'{self.client_prefix}.sock')
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._sock.bind(self._address)
+        self._sock.setblocking(False)
+        self._peers_at = 0.0
+        self._inbox = asyncio.Queue()
+        self._reader = asyncio.ensure_future(self._drain_inbox())
+        self._loop.add_reader(self._sock.fileno(), self._on_readable)
+
+    async def _stop_bus(self):
+        if self._sock is None:
+            return
+        self._reader.cancel()
+        try:
+            self._loop.remove_reader(self._sock.fileno())
+        except (RuntimeError, ValueError):
+            pass  # loop already closed
+        self._sock.close()
+        self._sock = None
+        try:
+            os.unlink(self._address)
+        except FileNotFoundError:
+            pass
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self._sock.recv(self.MAX_DATAGRAM)
+            except OSError:
+                return
+            self._inbox.put_nowait(data)
+
+    async def _drain_inbox(self):
+        # One consumer keeps payloads from a peer in the order they were sent.
+        while True:
+            data = await self._inbox.get()
+            try:
+                await self._deliver(data)
+            except Exception:
+                logger.exception('Channel layer delivery failed')
+
+    def _current_peers(self):
+        now = time.monotonic()
+        if now - self._peers_at > self.PEER_REFRESH:
+            self._peers = [
+                os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.endswith('.sock') and name != f'{self.client_prefix}.sock'
+            ]
+            self._peers_at = now
+        return self._peers
+
+    async def _publish(self, payload):
+        peers = self._current_peers()
+        for data in self._split(payload, self.MAX_DATAGRAM):
+            for peer in list(peers):
+                try:
+                    self._sock.sendto(data, peer)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    peers.remove(peer)
+                    try:
+                        os.unlink(peer)
+                    except FileNotFoundError:
+                        pass
+                except BlockingIOError:
+                    # The peer's receive buffer is full; like a full channel,
+                    # the message is dropped rather than stalling this worker.
+                    self.stats['dropped'] += 1
+
+
+# =======================
+# POSTGRES LISTEN/NOTIFY
+# =======================
+
+class PostgresChannelLayer(BroadcastChannelLayer):
+    """
+    Publishes with ``pg_notify`` and listens on a dedicated connection to
+    the ``database`` alias. NOTIFY payloads are limited to 8000 bytes, so
+    large batches are split per destination. Requires psycopg 3.
+
+    If either connection drops (database restart, failover), it is opened
+    again with exponential backoff and the listener re-issues LISTEN.
+    Notifications sent while the listener was disconnected are lost, as
+    with any channel layer message that finds no receiver.
+    """
+
+    MAX_PAYLOAD = 7900
+    RECONNECT_BASE = 0.5
+    RECONNECT_MAX = 30
+
+    def __init__(self, database='default', notify_channel='channels_layer', **kwargs):
+        super().__init__(**kwargs)
+        self.database = database
+        self.notify_channel = notify_channel
+        self._listen_conn = None
+        self._notify_conn = None
+        self._listener = None
+
+    def _conninfo(self):
+        from django.db import connections
+
+        connection = connections[self.database]
+        if connection.vendor != 'postgresql':
+            raise ImproperlyConfigured(f'PostgresChannelLayer needs a PostgreSQL database, not {connection.vendor}.')
+        params = connection.get_connection_params()
+        return {key: value for key, value in params.items() if key not in ('cursor_factory', 'context')}
+
+    async def _connect(self):
+        try:
+            import psycopg
+        except ImportError:
+            raise ImproperlyConfigured('PostgresChannelLayer requires psycopg 3 (pip install psycopg).')
+        return await psycopg.AsyncConnection.connect(autocommit=True, **self._conninfo())
+
+    async def _start_bus(self):
+        self._notify_conn = await self._connect()
+        await self._open_listener()
+        self._listener = asyncio.ensure_future(self._listen())
+
+    async def _open_listener(self):
+        self._listen_conn = await self._connect()
+        await self._listen_conn.execute(f'LISTEN "{self.notify_channel}"')
+
+    def _backoff(self, failures):
+        return min(self.RECONNECT_BASE * 2 ** failures, self.RECONNECT_MAX)
+
+    async def _listen(self):
+        failures = 0
+        while True:
+            try:
+                if self._listen_conn is None or self._listen_conn.closed:
+                    await self._open_listener()
+                    logger.info('Channel layer listener reconnected', extra={
+                        'event': 'layer.reconnect', 'attempts': failures,
+                    })
+                    failures = 0
+                async for notify in self._listen_conn.notifies():
+                    failures = 0
+                    try:
+                        await self._deliver(notify.payload)
+                    except Exception:
+                        logger.exception('Channel layer delivery failed')
+                raise ConnectionError('notification stream ended')
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                delay = self._backoff(failures)
+                failures += 1
+                logger.warning('Channel layer listener lost its connection; retrying in %.1fs', delay, exc_info=True,
+                               extra={'event': 'layer.disconnect', 'attempts': failures})
+                await self._close(self._listen_conn)
+                self._listen_conn = None
+                await asyncio.sleep(delay)
+
+    async def _close(self, conn):
+        if conn is not None:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    async def _stop_bus(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        for conn in (self._listen_conn, self._notify_conn):
+            await self._close(conn)
+        self._listen_conn = self._notify_conn = None
+
+    async def _publish(self, payload):
+        chunks = list(self._split(payload, self.MAX_PAYLOAD))
+        for attempt in range(2):
+            if self._notify_conn is None or self._notify_conn.closed:
+                self._notify_conn = await self._connect()
+            try:
+                async with self._notify_conn.transaction():
+                    for data in chunks:
+                        await self._notify_conn.execute(
+                            'SELECT pg_notify(%s, %s)', (self.notify_channel, data.decode()),
+                        )
+                return
+            except Exception:
+                # A broken connection gets one fresh retry; NOTIFY inside the
+                # failed transaction was never sent, so nothing is doubled.
+                if attempt or not self._notify_conn.closed:
+                    raise
+                self._notify_conn = None
@@ -0,0 +1,149 @@
+"""
+Buffered persistence for websocket chat messages.
+
+ChatConsumer broadcasts immediately and hands each message to the buffer of
+its event loop. The buffer writes everything it holds with one
+``bulk_create`` once CHAT_PERSIST_BATCH_SIZE messages are waiting or
+CHAT_PERSIST_INTERVAL_MS has passed, then tells each sender which ids its
+messages were stored under through a ``chat.saved`` event.
+
+A consumer flushes the buffer when its socket disconnects, and whatever is
+still buffered when the process exits is written by ``flush_pending``.
+"""
+import asyncio
+import atexit
+import logging
+import weakref
+
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from cat.models import Message
+
+logger = logging.getLogger(__name__)
+
+
+def _message(row, parent_id=None):
+    return Message(
+        sender=row['sender'], content=row['content'], timestamp=row['timestamp'],
+        room=row['room'], is_support=row['is_support'], is_flagged=row['is_flagged'], parent_id=parent_id,
+    )
+
+
+def _insert(rows):
+    ids = [None] * len(rows)
+
+    # Support messages hang off the first message of their thread; a new
+    # thread's first message is written on its own to get that id.
+    roots = {}
+    for i, row in enumerate(rows):
+        if row['is_support'] and row['room'] not in roots:
+            root = Message.objects.filter(room=row['room'], parent__isnull=True).order_by('pk').values_list(
+                'pk', flat=True,
+            ).first()
+            if root is None:
+                message = _message(row)
+                message.save()
+                root = ids[i] = message.pk
+            roots[row['room']] = root
+
+    pending = [i for i in range(len(rows)) if ids[i] is None]
+    created = Message.objects.bulk_create([
+        _message(rows[i], roots.get(rows[i]['room']) if rows[i]['is_support'] else None)
+        for i in pending
+    ])
+    for i, message in zip(pending, created):
+        ids[i] = message.pk
+    return ids
+
+
+class MessageBuffer:
+    def __init__(self, batch_size=None, interval=None):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_PERSIST_BATCH_SIZE', 50)
+        self.interval = (interval or getattr(settings, 'CHAT_PERSIST_INTERVAL_MS', 200)) / 1000
+        self._rows = []
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    def add(self, sender, content, timestamp, reply_channel=None, client_id=None, room='public', is_support=False,
+            is_flagged=False):
+        """Queue a message; the caller does not wait for the database."""
+        self._rows.append({
+            'sender': sender, 'content': content, 'timestamp': timestamp,
+            'reply_channel': reply_channel, 'client_id': client_id,
+            'room': room, 'is_support': is_support, 'is_flagged': is_flagged,
+        })
+        if len(self._rows) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.interval, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        """Write everything buffered so far and confirm the ids to the senders."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        rows, self._rows = self._rows, []
+        if not rows:
+            return []
+
+        # One flush at a time keeps ids in the order messages arrived.
+        async with self._lock:
+            try:
+                ids = await database_sync_to_async(_insert)(rows)
+            except Exception:
+                logger.exception('Failed to persist %d chat messages', len(rows))
+                ids = [None] * len(rows)
+            await self._confirm(rows, ids)
+        return ids
+
+    async def _confirm(self, rows, ids):
+        confirmations = {}
+        for row, pk in zip(rows, ids):
+            if row['reply_channel']:
+                confirmations.setdefault(row['reply_channel'], []).append({
+                    'client_id': row['client_id'],
+                    'id': pk,
+                    'timestamp': row['timestamp'].isoformat(),
+                    'saved': pk is not None,
+                })
+        channel_layer = get_channel_layer()
+        for channel, messages in confirmations.items():
+            try:
+                await channel_layer.send(channel, {'type': 'chat.saved', 'messages': messages})
+            except ChannelFull:
+                pass  # the sender has stopped reading; its messages are stored regardless
+
+
+_buffers = weakref.WeakKeyDictionary()
+
+
+def get_message_buffer():
+    """The buffer belonging to the running event loop."""
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = MessageBuffer()
+    return buffer
+
+
+def flush_pending():
+    """
+    Write what every buffer still holds, synchronously, without
+    confirmations. Runs at interpreter exit, after the event loops stopped.
+    """
+    for buffer in list(_buffers.values()):
+        rows, buffer._rows = buffer._rows, []
+        if not rows:
+            continue
+        try:
+            _insert(rows)
+        except Exception:
+            logger.exception('Failed to persist %d chat messages at exit', len(rows))
+
+
+atexit.register(flush_pending)
@@ -0,0 +1,121 @@
+"""
+Chat rooms and their in-process history.
+
+A room is stored on ``Message.room`` as one of:
+
+* ``public`` - the original public chat (group ``public_chat``).
+* ``topic:<slug>`` - a topic room listed in CHAT_TOPIC_ROOMS.
+* ``support:<user_id>`` - one support thread per user. Its messages have
+  ``is_support`` set and hang off the thread's first message via ``parent``.
+  Only the user and staff may join.
+
+Every room has its own channel-layer group, so a broadcast only reaches that
+room's members. While a worker has members in a room it keeps the last
+CHAT_HISTORY_SIZE messages in a ring buffer. The buffer is loaded from the
+database on the first local join, and after that joins are served from
+memory. It is dropped when the last local member leaves, because a worker
+without members stops seeing that room's broadcasts.
+"""
+from collections import deque
+from dataclasses import dataclass
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from cat.models import Message
+
+
+@dataclass(frozen=True)
+class Room:
+    key: str
+    group: str
+    is_support: bool = False
+
+
+def public_room():
+    return Room('public', 'public_chat')
+
+
+def resolve_room(user, kind=None, name=None):
+    """
+    Map a websocket route to a ``Room``, or None when it does not exist or
+    ``user`` may not join it.
+    """
+    if kind is None:
+        return public_room()
+    if kind == 'topic':
+        if name not in getattr(settings, 'CHAT_TOPIC_ROOMS', ()):
+            return None
+        return Room(f'topic:{name}', f'chat.topic.{name}')
+    if kind == 'support':
+        if user is None or not user.is_authenticated:
+            return None
+        if name is None:
+            owner = user.pk
+        elif user.is_staff:
+            owner = int(name)
+        else:
+            return None
+        return Room(f'support:{owner}', f'chat.support.{owner}', is_support=True)
+    return None
+
+
+class _RoomBuffer:
+    def __init__(self, size, messages):
+        self.members = 0
+        self.messages = deque(messages, maxlen=size)
+        self.uids = {message['uid'] for message in self.messages}
+
+    def append(self, message):
+        if message['uid'] in self.uids:
+            return
+        if len(self.messages) == self.messages.maxlen:
+            self.uids.discard(self.messages[0]['uid'])
+        self.messages.append(message)
+        self.uids.add(message['uid'])
+
+
+def _load(room_key, size):
+    rows = Message.objects.filter(room=room_key).order_by('-timestamp', '-pk').values_list(
+        'pk', 'sender', 'content', 'timestamp',
+    )[:size]
+    return [
+        {'uid': f'db-{pk}', 'sender': sender, 'message': content, 'timestamp': timestamp.isoformat()}
+        for pk, sender, content, timestamp in reversed(rows)
+    ]
+
+
+class RoomHistory:
+    """Ring buffers of recent messages for the rooms this worker has members in."""
+
+    def __init__(self, size=None):
+        self.size = size
+        self._rooms = {}
+
+    def _size(self):
+        return self.size or getattr(settings, 'CHAT_HISTORY_SIZE', 50)
+
+    async def join(self, room_key):
+        """Register a member and return the room's recent messages."""
+        buffer = self._rooms.get(room_key)
+        if buffer is None:
+            messages = await database_sync_to_async(_load)(room_key, self._size())
+            # Another member may have loaded it while we waited.
+            buffer = self._rooms.setdefault(room_key, _RoomBuffer(self._size(), messages))
+        buffer.members += 1
+        return [{k: v for k, v in message.items() if k != 'uid'} for message in buffer.messages]
+
+    def leave(self, room_key):
+        buffer = self._rooms.get(room_key)
+        if buffer is not None:
+            buffer.members -= 1
+            if buffer.members <= 0:
+                del self._rooms[room_key]
+
+    def record(self, room_key, message):
+        buffer = self._rooms.get(room_key)
+        if buffer is not None:
+            buffer.append(message)
+
+
+room_history = RoomHistory()
@@ -4,4 +4,7 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<kind>topic)/(?P<name>[\w-]+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<kind>support)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<kind>support)/(?P<name>\d+)/$', consumers.ChatConsumer.as_asgi()),
 ]
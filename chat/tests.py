@@ -1,3 +1,327 @@
-from django.test import TestCase
+import asyncio
+import json
+import shutil
+import tempfile
+from types import SimpleNamespace
 
-# Create your tests here.
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from cat.models import BannedTerm, Message
+
+from . import persistence, rooms
+from .backpressure import OutboundQueue
+from .consumers import ChatConsumer
+from .layers import PostgresChannelLayer, UnixSocketChannelLayer
+from .routing import websocket_urlpatterns
+
+User = get_user_model()
+
+
+class UnixSocketChannelLayerTests(SimpleTestCase):
+    """Two layer instances stand in for two worker processes sharing a directory."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='channels-test-')
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+
+    def _run(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 5))
+
+    def test_group_send_reaches_members_in_other_workers(self):
+        async def scenario():
+            worker_a = UnixSocketChannelLayer(path=self.path)
+            worker_b = UnixSocketChannelLayer(path=self.path)
+            local = await worker_a.new_channel()
+            remote = await worker_b.new_channel()
+            await worker_a.group_add('public_chat', local)
+            await worker_b.group_add('public_chat', remote)
+
+            for n in range(3):
+                await worker_a.group_send('public_chat', {'type': 'chat.message', 'message': n})
+
+            received = [
+                [(await layer.receive(channel))['message'] for _ in range(3)]
+                for layer, channel in ((worker_a, local), (worker_b, remote))
+            ]
+            stats = worker_a.stats
+            await worker_a.close()
+            await worker_b.close()
+            return received, stats
+
+        received, stats = self._run(scenario())
+
+        self.assertEqual(received, [[0, 1, 2], [0, 1, 2]])
+        self.assertEqual(stats['published'], 3)
+        self.assertEqual(stats['payloads'], 1)  # coalesced into one datagram
+
+    def test_send_to_channel_owned_by_another_worker(self):
+        async def scenario():
+            worker_a = UnixSocketChannelLayer(path=self.path)
+            worker_b = UnixSocketChannelLayer(path=self.path)
+            channel = await worker_b.new_channel()
+            receiving = asyncio.ensure_future(worker_b.receive(channel))
+            await asyncio.sleep(0)
+
+            await worker_a.send(channel, {'type': 'user.event', 'value': 'ok'})
+            message = await receiving
+            await worker_a.close()
+            await worker_b.close()
+            return message
+
+        self.assertEqual(self._run(scenario())['value'], 'ok')
+
+    def test_oversized_batches_are_split(self):
+        layer = UnixSocketChannelLayer(path=self.path)
+        payload = {'from': 'x', 'groups': {'g': [{'text': 'a' * 40} for _ in range(10)]}, 'channels': {}}
+
+        pieces = list(layer._split(payload, 200))
+
+        self.assertGreater(len(pieces), 1)
+        self.assertTrue(all(len(piece) <= 200 for piece in pieces))
+
+
+class FakePgConnection:
+    """Stands in for a psycopg AsyncConnection that delivers ``payloads`` and then drops."""
+
+    def __init__(self, payloads=(), drop=True):
+        self.payloads = list(payloads)
+        self.drop = drop
+        self.closed = False
+        self.executed = []
+
+    async def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+    async def notifies(self):
+        for payload in self.payloads:
+            yield SimpleNamespace(payload=payload)
+        if not self.drop:
+            await asyncio.Event().wait()
+        self.closed = True
+        raise OSError('server closed the connection unexpectedly')
+
+    async def close(self):
+        self.closed = True
+
+
+class PostgresChannelLayerTests(SimpleTestCase):
+    def test_listener_reconnects_and_listens_again_after_a_drop(self):
+        def payload(n):
+            return json.dumps({'from': 'other', 'groups': {'public_chat': [{'type': 'chat.message', 'n': n}]}})
+
+        first, second = FakePgConnection([payload(1)]), FakePgConnection([payload(2)], drop=False)
+        connections = iter([FakePgConnection(drop=False), first, second])
+
+        async def scenario():
+            layer = PostgresChannelLayer()
+            layer.RECONNECT_BASE = 0
+            channel = await layer.new_channel()
+            with mock.patch.object(layer, '_connect', side_effect=lambda: next(connections)):
+                await layer.group_add('public_chat', channel)
+                received = [(await layer.receive(channel))['n'] for _ in range(2)]
+            await layer.close()
+            return received
+
+        with self.assertLogs('chat.layers', 'WARNING'):
+            received = asyncio.run(asyncio.wait_for(scenario(), 5))
+
+        self.assertEqual(received, [1, 2])
+        self.assertEqual(second.executed, ['LISTEN "channels_layer"'])
+
+
+@override_settings(CHAT_PERSIST_BATCH_SIZE=3, CHAT_PERSIST_INTERVAL_MS=50)
+class ChatPersistenceTests(TransactionTestCase):
+    async def _chat(self, texts):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/chat/')
+        await communicator.connect()
+        for n, text in enumerate(texts):
+            await communicator.send_json_to({'message': text, 'sender': 'alice', 'client_id': f'c{n}'})
+
+        frames = []
+        while not any(frame.get('type') == 'saved' for frame in frames):
+            frames.append(await communicator.receive_json_from(timeout=5))
+        await communicator.disconnect()
+        return frames
+
+    async def test_full_batch_is_written_at_once_and_confirmed(self):
+        frames = await self._chat(['one', 'two', 'three'])
+
+        broadcasts = [frame['message'] for frame in frames if 'message' in frame]
+        saved = next(frame for frame in frames if frame.get('type') == 'saved')['messages']
+        self.assertEqual(broadcasts, ['one', 'two', 'three'])
+        self.assertEqual([item['client_id'] for item in saved], ['c0', 'c1', 'c2'])
+        stored = {pk: content async for pk, content in Message.objects.values_list('pk', 'content')}
+        self.assertEqual([stored[item['id']] for item in saved], ['one', 'two', 'three'])
+
+    async def test_partial_batch_is_flushed_after_the_interval(self):
+        frames = await self._chat(['lonely'])
+
+        saved = next(frame for frame in frames if frame.get('type') == 'saved')['messages']
+        self.assertTrue(saved[0]['saved'])
+        self.assertEqual(await Message.objects.filter(sender='alice').acount(), 1)
+
+    @override_settings(CHAT_PERSIST_INTERVAL_MS=60000)
+    async def test_disconnect_flushes_the_buffer(self):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/chat/')
+        await communicator.connect()
+        await communicator.send_json_to({'message': 'bye', 'sender': 'alice'})
+        while 'message' not in await communicator.receive_json_from(timeout=5):
+            pass
+
+        await communicator.disconnect()
+
+        self.assertEqual(await Message.objects.filter(sender='alice', content='bye').acount(), 1)
+
+    @override_settings(CHAT_PERSIST_INTERVAL_MS=60000)
+    def test_pending_messages_are_written_at_exit(self):
+        async def buffered():
+            persistence.get_message_buffer().add('alice', 'last words', timezone.now())
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(buffered())
+
+        persistence.flush_pending()
+
+        self.assertTrue(Message.objects.filter(content='last words').exists())
+
+
+@override_settings(CHAT_PERSIST_BATCH_SIZE=1, CHAT_PERSIST_INTERVAL_MS=20, CHAT_TOPIC_ROOMS=['general'])
+class ChatRoomTests(TransactionTestCase):
+    async def _join(self, path, user=None):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        if user is not None:
+            communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        history = await communicator.receive_json_from(timeout=5) if connected else None
+        return communicator, connected, history
+
+    async def _next_broadcast(self, communicator):
+        while True:
+            frame = await communicator.receive_json_from(timeout=5)
+            if frame.get('type') is None:
+                return frame
+
+    async def test_topic_messages_stay_in_their_room_and_warm_joins_skip_the_database(self):
+        public, _, _ = await self._join('/ws/chat/')
+        topic, _, history = await self._join('/ws/chat/topic/general/')
+        self.assertEqual(history, {'type': 'history', 'room': 'topic:general', 'messages': []})
+
+        await topic.send_json_to({'message': 'hi topic', 'sender': 'alice'})
+        frame = await self._next_broadcast(topic)
+        self.assertEqual(frame, {'message': 'hi topic', 'sender': 'alice', 'room': 'topic:general'})
+        self.assertTrue(await public.receive_nothing(timeout=0.2))
+
+        with mock.patch.object(rooms, '_load', wraps=rooms._load) as load:
+            second, _, history = await self._join('/ws/chat/topic/general/')
+        load.assert_not_called()
+        self.assertEqual([m['message'] for m in history['messages']], ['hi topic'])
+
+        for communicator in (public, topic, second):
+            await communicator.disconnect()
+        self.assertEqual(
+            await Message.objects.filter(room='topic:general').acount(), 1,
+        )
+
+    async def test_cold_join_loads_history_from_the_database(self):
+        await Message.objects.acreate(sender='bob', content='earlier', room='topic:general')
+        await Message.objects.acreate(sender='bob', content='elsewhere')
+
+        communicator, _, history = await self._join('/ws/chat/topic/general/')
+        await communicator.disconnect()
+
+        self.assertEqual([m['message'] for m in history['messages']], ['earlier'])
+
+    @override_settings(MODERATION_RELOAD_INTERVAL=0)
+    async def test_banned_terms_are_masked_before_broadcast(self):
+        await database_sync_to_async(BannedTerm.objects.create)(term='idiot')
+        await database_sync_to_async(BannedTerm.objects.create)(term='scam', action='flag')
+        communicator, _, _ = await self._join('/ws/chat/topic/general/')
+
+        await communicator.send_json_to({'message': 'what an idiot scam', 'sender': 'bob'})
+        frame = await self._next_broadcast(communicator)
+        while (await communicator.receive_json_from(timeout=5)).get('type') != 'saved':
+            pass
+        await communicator.disconnect()
+
+        self.assertEqual(frame['message'], 'what an ***** scam')
+        self.assertTrue(await Message.objects.filter(content='what an ***** scam', is_flagged=True).aexists())
+
+    async def test_unknown_topic_is_rejected(self):
+        _, connected, _ = await self._join('/ws/chat/topic/nope/')
+        self.assertFalse(connected)
+
+    async def test_support_thread_is_private_and_threaded(self):
+        alice = await database_sync_to_async(User.objects.create_user)(username='alice', password='x')
+        bob = await database_sync_to_async(User.objects.create_user)(username='bob', password='x')
+        staff = await database_sync_to_async(User.objects.create_user)(
+            username='agent', password='x', is_staff=True,
+        )
+
+        _, connected, _ = await self._join(f'/ws/chat/support/{alice.pk}/', user=bob)
+        self.assertFalse(connected)
+
+        own, _, history = await self._join('/ws/chat/support/', user=alice)
+        agent, _, _ = await self._join(f'/ws/chat/support/{alice.pk}/', user=staff)
+        self.assertEqual(history['room'], f'support:{alice.pk}')
+
+        await own.send_json_to({'message': 'help'})
+        self.assertEqual((await self._next_broadcast(agent))['sender'], 'alice')
+        await agent.send_json_to({'message': 'on it'})
+        replies = [(await self._next_broadcast(own))['sender'] for _ in range(2)]
+        self.assertEqual(replies, ['alice', 'agent'])
+        for communicator in (own, agent):
+            await communicator.disconnect()
+
+        for _ in range(100):
+            if await Message.objects.filter(room=f'support:{alice.pk}').acount() == 2:
+                break
+            await asyncio.sleep(0.05)
+        thread = [m async for m in Message.objects.filter(room=f'support:{alice.pk}').order_by('pk')]
+        self.assertEqual([m.content for m in thread], ['help', 'on it'])
+        self.assertTrue(all(m.is_support for m in thread))
+        self.assertIsNone(thread[0].parent_id)
+        self.assertEqual(thread[1].parent_id, thread[0].pk)
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """A gate stands in for a client that stops reading."""
+
+    async def _storm(self, policy, count):
+        gate = asyncio.Event()
+        frames = []
+
+        async def slow_send(text):
+            frames.append(json.loads(text))
+            await gate.wait()
+
+        outbox = OutboundQueue(slow_send, maxsize=3, policy=policy, batch_max=10)
+        for n in range(count):
+            outbox.put({'message': n})
+            await asyncio.sleep(0)
+        gate.set()
+        await asyncio.sleep(0.01)
+        await outbox.close()
+        return outbox, frames
+
+    async def test_drop_oldest_keeps_the_newest_and_batches_them(self):
+        outbox, frames = await self._storm('drop_oldest', 10)
+
+        self.assertEqual(frames[0], {'message': 0})
+        self.assertEqual(frames[1], {'type': 'batch', 'messages': [{'message': n} for n in (7, 8, 9)]})
+        self.assertEqual(outbox.dropped, 6)
+
+    async def test_coalesce_reports_skipped_messages(self):
+        outbox, frames = await self._storm('coalesce', 10)
+
+        self.assertEqual(frames[0], {'message': 0})
+        self.assertEqual(frames[1]['type'], 'batch')
+        self.assertEqual(frames[1]['skipped'] + len(frames[1]['messages']), 9)
+        self.assertEqual(outbox.dropped, frames[1]['skipped'])
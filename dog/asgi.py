@@ -10,22 +10,30 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import chat.routing
-import aviator.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dog.settings')
 
+# Set Django up before importing the token middleware and consumers, which
+# import models
+django_asgi_app = get_asgi_application()
+
+from cat.ws_auth import TokenAuthMiddlewareStack  # noqa: E402
+import cat.routing  # noqa: E402
+import chat.routing  # noqa: E402
+import aviator.routing  # noqa: E402
+
 # Combine all websocket URL patterns
 websocket_urlpatterns = (
+    cat.routing.websocket_urlpatterns +
     chat.routing.websocket_urlpatterns +
     aviator.routing.websocket_urlpatterns
 )
 
 # Main ASGI application
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),  # Handles normal HTTP requests
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,  # Handles normal HTTP requests
+    # DRF token from the query string or subprotocol; falls back to the session cookie
+    "websocket": TokenAuthMiddlewareStack(
         URLRouter(websocket_urlpatterns)
     ),
 })
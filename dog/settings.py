@@ -60,6 +60,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'cat.User'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'cat.middleware.QueryMetricsMiddleware',  # Per-endpoint query count and latency
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add Whitenoise for static files
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -203,6 +204,74 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Websocket chat messages are stored in batches (see chat/persistence.py)
+CHAT_PERSIST_BATCH_SIZE = env.int('CHAT_PERSIST_BATCH_SIZE', default=50)
+CHAT_PERSIST_INTERVAL_MS = env.int('CHAT_PERSIST_INTERVAL_MS', default=200)
+
+# Chat rooms (see chat/rooms.py): topic rooms clients may join, and how many
+# recent messages each worker keeps in memory per active room
+CHAT_TOPIC_ROOMS = env.list('CHAT_TOPIC_ROOMS', default=['general', 'investments', 'vip'])
+CHAT_HISTORY_SIZE = env.int('CHAT_HISTORY_SIZE', default=50)
+
+# Websocket token auth (cat/ws_auth.py): seconds an unknown or inactive
+# token is remembered as invalid
+WS_AUTH_NEGATIVE_TTL = env.int('WS_AUTH_NEGATIVE_TTL', default=30)
+
+# Background jobs (cat/jobs.py): seconds before a running job with no
+# worker heartbeat is requeued, how often workers send one, first retry
+# delay (doubles per attempt), and how long finished jobs are kept
+JOB_LOCK_TIMEOUT = env.int('JOB_LOCK_TIMEOUT', default=300)
+JOB_HEARTBEAT_INTERVAL = env.int('JOB_HEARTBEAT_INTERVAL', default=60)
+JOB_RETRY_BASE = env.int('JOB_RETRY_BASE', default=10)
+JOB_RETENTION_DAYS = env.int('JOB_RETENTION_DAYS', default=7)
+
+# Dotted path to a callable(phone, message) that delivers team invitations
+# (cat/tasks.py); invitations are logged and dropped while it is unset
+INVITATION_SENDER = env('INVITATION_SENDER', default='')
+
+# Seconds a stored Idempotency-Key response is replayed (cat/idempotency.py)
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=60 * 60 * 24)
+
+# Ledger archive (cat/ledger.py): days of transactions kept in the hot table,
+# age after which archived months go to compressed files, and where
+LEDGER_HOT_DAYS = env.int('LEDGER_HOT_DAYS', default=90)
+LEDGER_EXPORT_DAYS = env.int('LEDGER_EXPORT_DAYS', default=365)
+LEDGER_ARCHIVE_DIR = env('LEDGER_ARCHIVE_DIR', default=str(BASE_DIR / 'ledger_archive'))
+# The daily ledger.archive job only moves rows when this is on. Recharge and
+# withdraw history and the dashboard read the hot table alone, so archived
+# rows drop out of them (the archive endpoint still serves them).
+LEDGER_ARCHIVE_SCHEDULED = env.bool('LEDGER_ARCHIVE_SCHEDULED', default=False)
+
+# Seconds the outbox dispatcher waits on an id gap before reading past it,
+# and how long it keeps re-reading a skipped id before treating it as a
+# rolled-back transaction (cat/outbox.py)
+OUTBOX_GAP_GRACE = env.int('OUTBOX_GAP_GRACE', default=5)
+OUTBOX_GAP_TIMEOUT = env.int('OUTBOX_GAP_TIMEOUT', default=3600)
+
+# Seconds between checks for banned-term edits made in other processes
+MODERATION_RELOAD_INTERVAL = env.int('MODERATION_RELOAD_INTERVAL', default=5)
+
+# Per-connection chat outbound queue (see chat/backpressure.py):
+# CHAT_OUTBOX_POLICY is drop_oldest or coalesce
+CHAT_OUTBOX_SIZE = env.int('CHAT_OUTBOX_SIZE', default=100)
+CHAT_OUTBOX_POLICY = env('CHAT_OUTBOX_POLICY', default='drop_oldest')
+CHAT_BATCH_MAX = env.int('CHAT_BATCH_MAX', default=50)
+
+# Multi-worker fan-out without a broker (see chat/layers.py):
+#   CHANNEL_LAYER=unix      Unix datagram sockets, for several local workers
+#   CHANNEL_LAYER=postgres  LISTEN/NOTIFY on the default database
+CHANNEL_LAYER = env('CHANNEL_LAYER', default='memory')
+if CHANNEL_LAYER == 'unix':
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+        'CONFIG': {'path': env('CHANNEL_LAYER_PATH', default=os.path.join(BASE_DIR, '.channels'))},
+    }
+elif CHANNEL_LAYER == 'postgres':
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'chat.layers.PostgresChannelLayer',
+        'CONFIG': {'database': 'default'},
+    }
+
 # Jazzmin admin theme settings
 JAZZMIN_SETTINGS = {
     "site_title": "Yosef.com Admin",
@@ -327,6 +396,9 @@ if RENDER_EXTERNAL_HOSTNAME:
     ALLOWED_HOSTS.append(RENDER_EXTERNAL_HOSTNAME)
 
 # Logging configuration
+# Application loggers go through cat.log.QueuedHandler: records are queued in
+# the caller and written as JSON lines by a background thread, so the event
+# loop never blocks on log I/O. High-frequency events are sampled.
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -340,16 +412,25 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        'sampling': {
+            '()': 'cat.log.SamplingFilter',
+            'rates': {
+                'chat.receive': env.float('LOG_SAMPLE_CHAT', default=0.01),
+                'chat.broadcast': env.float('LOG_SAMPLE_CHAT', default=0.01),
+            },
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
-        'file': {
-            'level': 'ERROR',
-            'class': 'logging.FileHandler',
+        'queued_json': {
+            '()': 'cat.log.QueuedHandler',
             'filename': BASE_DIR / 'debug.log',
-            'formatter': 'verbose',
+            'file_level': 'ERROR',
+            'filters': ['sampling'],
         },
     },
     'loggers': {
@@ -359,13 +440,21 @@ LOGGING = {
             'propagate': True,
         },
         'cat': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queued_json'],
+            'level': 'DEBUG' if DEBUG else 'INFO',
+            'propagate': False,
+        },
+        'chat': {
+            'handlers': ['queued_json'],
             'level': 'DEBUG' if DEBUG else 'INFO',
             'propagate': False,
         },
     },
 }
 
+# Query metrics: expose X-DB-Queries / X-DB-Time-ms / X-Response-Time-ms headers
+QUERY_METRICS_HEADERS = env.bool('QUERY_METRICS_HEADERS', default=DEBUG)
+
 # Custom settings for your app
 APP_NAME = "Yosef.com"
 APP_VERSION = "1.0.0"